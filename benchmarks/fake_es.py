@@ -0,0 +1,54 @@
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+from contextlib import contextmanager
+from unittest.mock import patch
+
+
+class FakeIndices():
+    def __init__(self, es: 'FakeElasticsearch') -> None:
+        self.es = es
+
+    def exists(self, index: str) -> bool:
+        return index in self.es.documents
+
+    def create(self, index: str, ignore: int = None):
+        self.es.documents.setdefault(index, [])
+
+    def delete(self, index: str):
+        self.es.documents.pop(index, None)
+
+
+class FakeElasticsearch():
+    """
+    In-memory stand in for the parts of the client data.es writes with. Documents are shared
+    between instances, like a real cluster.
+    """
+    documents: Dict[str, List[Dict[str, Any]]] = {}
+
+    def __init__(self, *args, **kwargs) -> None:
+        self.indices = FakeIndices(self)
+
+    def index(self, index: str, body: Dict[str, Any], **kwargs):
+        self.documents.setdefault(index, []).append(dict(body))
+
+    @classmethod
+    def clear(cls):
+        # Indices stay created, as they would on a real cluster
+        for documents in cls.documents.values(): documents.clear()
+
+
+def bulk(es: FakeElasticsearch, actions: Iterable[Dict[str, Any]], **kwargs) -> Tuple[int, List]:
+    n = 0
+    for action in actions:
+        es.index(action['_index'], action['_source'])
+        n += 1
+    return n, []
+
+
+@contextmanager
+def fake_es(cls: type = FakeElasticsearch) -> Iterator[FakeElasticsearch]:
+    """
+    Routes data.es writes to the in-memory fake (or a subclass of it) for the duration of the block
+    """
+    cls.clear()
+    # The shared client is dropped so it's rebuilt from the fake, and restored afterwards
+    with patch('data.es.Elasticsearch', cls), patch('data.es.helpers.bulk', bulk), patch('data.es._client', None): yield cls
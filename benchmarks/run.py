@@ -0,0 +1,225 @@
+"""
+Offline benchmarks for the ingestion hot paths, run from the repository root:
+    python -m benchmarks.run                            # just report the results
+    python -m benchmarks.run -b /tmp/bench.json -s      # save the results as a baseline for this machine
+    python -m benchmarks.run -b /tmp/bench.json         # compare against it, exits non-zero on a regression
+    python -m benchmarks.run -f extract                 # only benchmarks whose name contains 'extract'
+Timings only compare on the machine that recorded them, so no baseline is checked in.
+"""
+from typing import Any, Callable, Dict, Iterator, List
+from contextlib import contextmanager
+from optparse import OptionParser
+from unittest.mock import patch
+import os, sys, json, time, tracemalloc
+
+# Benchmarks never touch the real sentiment cache
+os.environ.setdefault('TS_SENTIMENT_CACHE', ':memory:')
+
+from bs4 import BeautifulSoup
+from nltk.sentiment.vader import SentimentIntensityAnalyzer
+
+from benchmarks.fake_es import fake_es
+from config.models import Analysis, SentimentContext, PipelineArticle, TweetData
+from data.es import add_analyses
+from scrapers.cache import SentimentCache
+from scrapers.matching import company_trie, ticker_tokenizer
+from scrapers.scoring import rate_symbols
+from scrapers.utils import extract_tickers
+from scrapers.mixed import (
+    CNBC, AP, REUTERS, CNN, MARKET_WATCH, PR_NEWSWIRE, FINURLS_SOURCES,
+    _reuters_discover_period, _ap_discover_period, _pr_nw_discover, _bloomberg_parse_sitemap
+)
+
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+REGRESSION_THRESHOLD = 0.25 # fractional drop in throughput (or growth in peak memory) reported as a regression
+
+
+def fixture(path: str) -> str:
+    with open(os.path.join(FIXTURES, path), 'r') as f: return f.read()
+
+
+class FixtureResponse():
+    def __init__(self, text: str, status_code: int = 200) -> None:
+        self.text = text
+        self.status_code = status_code
+        self.headers: Dict[str, str] = {}
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+@contextmanager
+def serving(text: str) -> Iterator[None]:
+    """
+    Answers every requests.get with the fixture
+    """
+    with patch('requests.get', lambda *args, **kwargs: FixtureResponse(text)): yield
+
+@contextmanager
+def fresh_sentiment_cache() -> Iterator[None]:
+    """
+    Scores from scratch rather than measuring cache hits
+    """
+    cache = SentimentCache(':memory:')
+    with patch('scrapers.cache.sentiment_cache', lambda: cache), patch('scrapers.scoring.sentiment_cache', lambda: cache): yield
+
+
+
+# Benchmarks: name -> a pass over the fixtures, returning the # of items it processed
+BENCHMARKS: Dict[str, Callable[[], int]] = {}
+
+def _sitemap_benchmarks():
+    for name, discover in [
+        ('reuters', lambda: _reuters_discover_period('20210309-20210310', set())),
+        ('ap', lambda: _ap_discover_period('2021-03-10', set())),
+        ('pr_newswire', lambda: _pr_nw_discover('recent', set())), # 2 sitemap pages
+    ]:
+        sitemap = fixture(f'sitemaps/{name}.xml')
+        pages = 2 if name == 'pr_newswire' else 1
+        def run(sitemap: str = sitemap, discover: Callable = discover, urls: int = sitemap.count('<url>') * pages) -> int:
+            with serving(sitemap):
+                for _ in discover(): pass
+            return urls
+        BENCHMARKS[f'sitemap_{name}'] = run
+
+    bloomberg = fixture('sitemaps/bloomberg.xml')
+    BENCHMARKS['sitemap_bloomberg'] = lambda: len(_bloomberg_parse_sitemap(bloomberg))
+
+def _extract_benchmarks():
+    for source in [CNBC, AP, REUTERS, MARKET_WATCH, CNN, PR_NEWSWIRE] + list(FINURLS_SOURCES.values()):
+        html = fixture(f'articles/{source.name}.html')
+        def run(source=source, html: str = html) -> int:
+            article = PipelineArticle(source.name, f'https://example.com/{source.name}', source.name)
+            source.extract(article, BeautifulSoup(html, source.parser))
+            return 1
+        BENCHMARKS[f'extract_{source.name}'] = run
+
+def _article_texts() -> List[str]:
+    return [BeautifulSoup(fixture(f'articles/{name}'), 'html.parser').get_text(' ') for name in sorted(os.listdir(os.path.join(FIXTURES, 'articles')))]
+
+def _text_benchmarks():
+    articles = _article_texts()
+    comments = [c['body'] for c in json.loads(fixture('json/wsb_comments.json'))]
+
+    def tickers() -> int:
+        for text in articles + comments: extract_tickers(text, True)
+        return len(articles) + len(comments)
+    BENCHMARKS['extract_tickers'] = tickers
+
+    def wsb_tokenizer() -> int:
+        for body in comments: ticker_tokenizer().find(body, 'wsb')
+        return len(comments)
+    BENCHMARKS['wsb_tokenizer'] = wsb_tokenizer
+
+    vader = SentimentIntensityAnalyzer()
+    article_symbols = [extract_tickers(text, True) for text in articles]
+    def score(cached: bool) -> int:
+        if cached:
+            for text, symbols in zip(articles, article_symbols): rate_symbols(vader, text, symbols)
+        else:
+            with fresh_sentiment_cache():
+                for text, symbols in zip(articles, article_symbols): rate_symbols(vader, text, symbols)
+        return len(articles)
+    BENCHMARKS['vader_rate_symbols'] = lambda: score(False)
+    BENCHMARKS['vader_rate_symbols_cached'] = lambda: score(True)
+
+    def vader_comments() -> int:
+        for body in comments: vader.polarity_scores(body)
+        return len(comments)
+    BENCHMARKS['vader_wsb_comments'] = vader_comments
+
+def _json_benchmarks():
+    messages = json.loads(fixture('json/stocktwits_aapl.json'))['messages']
+    def stocktwits() -> int:
+        for message in messages: TweetData(message)
+        return len(messages)
+    BENCHMARKS['stocktwits_parse'] = stocktwits
+
+    titles = [item['title'] for item in json.loads(fixture('json/hn_items.json')) if item['type'] == 'story']
+    def hn_titles() -> int:
+        for title in titles: company_trie().find(title.split(' '))
+        return len(titles)
+    BENCHMARKS['hn_title_match'] = hn_titles
+
+    entries = [SentimentContext(['AAPL', 'TSLA', 'MSFT', 'DIS'][i % 4], 'benchmark', 1615380000 + i, 0.25) for i in range(1000)]
+    def es_bulk() -> int:
+        analysis = Analysis()
+        analysis.data = list(entries)
+        with fake_es(): add_analyses([analysis], bulk=True)
+        return len(entries)
+    BENCHMARKS['es_add_analyses'] = es_bulk
+
+_sitemap_benchmarks()
+_extract_benchmarks()
+_text_benchmarks()
+_json_benchmarks()
+
+
+
+# Running
+def measure(fn: Callable[[], int], min_time: float = 1.0, min_rounds: int = 3) -> Dict[str, float]:
+    fn() # warm up lazily built singletons
+    items, rounds, start = 0, 0, time.perf_counter()
+    while rounds < min_rounds or time.perf_counter() - start < min_time:
+        items += fn()
+        rounds += 1
+    elapsed = time.perf_counter() - start
+
+    # Peak memory of a single pass, measured separately as tracing slows everything down
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return { 'items_per_sec': round(items / elapsed, 2), 'peak_kb': round(peak / 1024, 1), 'rounds': rounds }
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]]) -> List[str]:
+    """
+    Returns the names of benchmarks that regressed past the threshold
+    """
+    regressed: List[str] = []
+    for name, result in results.items():
+        if name not in baseline: continue
+        throughput = result['items_per_sec'] / baseline[name]['items_per_sec'] - 1
+        memory = result['peak_kb'] / max(baseline[name]['peak_kb'], 1) - 1
+        flag = throughput < -REGRESSION_THRESHOLD or memory > REGRESSION_THRESHOLD
+        if flag: regressed.append(name)
+        print(f'\t{name:<28} throughput {throughput:+.1%} | peak memory {memory:+.1%}{"  <- regression" if flag else ""}')
+    return regressed
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-f', '--filter', dest='filter', help='Only run benchmarks containing this string', metavar='STR', default='')
+    parser.add_option('-b', '--baseline', dest='baseline', help='Baseline recorded on this machine to compare against (or save to with -s)', metavar='PATH', default=None)
+    parser.add_option('-s', '--save', dest='save', help='Save results as the baseline', action='store_true', default=False)
+    parser.add_option('-t', '--min-time', dest='min_time', help='Seconds to run each benchmark for', type='float', default=1.0)
+    (options, _) = parser.parse_args()
+
+    results: Dict[str, Dict[str, float]] = {}
+    for name, fn in BENCHMARKS.items():
+        if options.filter not in name: continue
+        results[name] = measure(fn, options.min_time)
+        print(f'{name:<28} {results[name]["items_per_sec"]:>12,.1f} items/sec | peak {results[name]["peak_kb"]:>9,.1f} KiB')
+
+    if options.baseline is None:
+        if options.save: print('Pass the baseline path to save to with -b')
+        return
+
+    if options.save:
+        baseline = {}
+        if os.path.exists(options.baseline):
+            with open(options.baseline, 'r') as f: baseline = json.loads(f.read())
+        baseline.update(results)
+        with open(options.baseline, 'w') as f: f.write(json.dumps(baseline, indent=4, sort_keys=True))
+        print(f'Baseline saved to {options.baseline}')
+        return
+
+    if not os.path.exists(options.baseline):
+        print(f'No baseline at {options.baseline}, run with -s to record one')
+        return
+    print('\nCompared to baseline:')
+    with open(options.baseline, 'r') as f: regressed = compare(results, json.loads(f.read()))
+    if len(regressed) > 0:
+        print(f'{len(regressed)} benchmarks regressed: {", ".join(regressed)}')
+        sys.exit(1)
+
+if __name__ == '__main__': main()
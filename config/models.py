@@ -1,13 +1,19 @@
-from typing import Dict, Set, List, NamedTuple, Any
+from typing import Dict, FrozenSet, Set, List, NamedTuple, Any
 import datetime as dt
 
 class SymbolData():
     symbols: Set[str]
-    companies: Dict[str, str]
+    companies: Dict[str, str]   # Map of stock symbols to reduced company names
+    blacklist: FrozenSet[str]
+    extended_blacklist: FrozenSet[str]
+    focus_symbols: FrozenSet[str]
 
     def __init__(self) -> None:
         self.symbols = set()
         self.companies = {}
+        self.blacklist = frozenset()
+        self.extended_blacklist = frozenset()
+        self.focus_symbols = frozenset()
 
 
 class SentimentContext():
@@ -29,12 +35,51 @@ class Analysis():
     """
     # data: Dict[str, SentimentContext] # Map of stock symbols to a sentiment context
     data: List[SentimentContext] # Map of stock symbols to a sentiment context
+    ids: List[str]               # Optional document ids parallel to data, re-stored entries replace the earlier document
 
-    def __init__(self, data: List[SentimentContext] = None) -> None:
+    def __init__(self, data: List[SentimentContext] = None, ids: List[str] = None) -> None:
         self.data = data if data is not None else []
+        self.ids = ids
 
 
 
+class Mention(NamedTuple):
+    symbol: str
+    start: int  # Character offset of the mention within the scanned text
+    end: int
+    kind: str   # How the mention was found (e.g. company)
+
+
+class PipelineArticle():
+    """
+    An article as it moves through the scraping pipeline, fields are filled in stage by stage
+    """
+    source: str
+    url: str
+    id: Any
+    timestamp: int              # Publish time, from discovery or extraction
+    html: str                   # Raw page, dropped once parsed
+    text: str                   # Scoreable body text, dropped once scored
+    symbols: Set[str]
+    mentions: List[Mention]     # Symbol positions within text, located at scoring time when not provided
+    ratings: Dict[str, float]   # Per-symbol compound rating
+    period: str                 # Sitemap period the article was discovered in, for period based sources
+    failed: bool                # Fetching or writing it failed, the article is retried by a later run
+
+    def __init__(self, source: str, url: str, id: Any, timestamp: int = None) -> None:
+        self.source = source
+        self.url = url
+        self.id = id
+        self.timestamp = timestamp
+        self.html = None
+        self.text = None
+        self.symbols = set()
+        self.mentions = None
+        self.ratings = None
+        self.period = None
+        self.failed = False
+
+
 class Sentiment(NamedTuple):
     symbol: str
     source: str
@@ -52,8 +97,9 @@ class HN_Item():
     type: str # can be any of ['story', 'comment', 'job', 'poll', 'pollopt']
     url: str
     kids: List[int]
+    parent: int # comments only
 
-    def __init__(self, id: int, descendants: int = 0, score: int = 0, time: int = 0, title: str = '', text: str = '', type: str = '', url: str = '', kids: List[int] = None) -> None:
+    def __init__(self, id: int, descendants: int = 0, score: int = 0, time: int = 0, title: str = '', text: str = '', type: str = '', url: str = '', kids: List[int] = None, parent: int = None) -> None:
         self.id = id
         self.descendants = descendants
         self.score = score
@@ -63,11 +109,12 @@ class HN_Item():
         self.type = type
         self.url = url
         self.kids = kids if kids is not None else []
+        self.parent = parent
 
     @classmethod
     def from_json(cls, data: dict):
         # remove unwanted fields
-        for field in [k for k in data.keys() if k not in ['descendants', 'id', 'score', 'time', 'title', 'text', 'type', 'url', 'kids']]:
+        for field in [k for k in data.keys() if k not in ['descendants', 'id', 'score', 'time', 'title', 'text', 'type', 'url', 'kids', 'parent']]:
             del data[field]
         return cls(**data)
 
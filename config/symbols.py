@@ -1,4 +1,4 @@
-import pandas as pd
+import pickle, os, threading
 from config.models import SymbolData
 
 us = {
@@ -19,11 +19,8 @@ extended_blacklist = blacklist.union(set([
 
 
 focus_symbols = set([
-    """
-    Current implementations for some fetch methods require specific symbols to be
-    searched for. Rather than search all available symbols, they can be specified here
-    """
-
+    # Current implementations for some fetch methods require specific symbols to be
+    # searched for. Rather than search all available symbols, they can be specified here
     'AAPL', 'TSLA', 'DIS', 'AMZN',
     'BA', 'UAL', 'FB', 'GME', 'GE', 'GM', 'F'
 
@@ -31,13 +28,57 @@ focus_symbols = set([
 
 
 
-def enhanced_symbols() -> SymbolData:
-    df = pd.read_csv('symbol_data/enhanced_symbols.csv')
+SYMBOLS_CSV = 'config/enhanced_symbols.csv'
+SYMBOLS_ARTIFACT = 'config/symbols.pkl'
+ARTIFACT_VERSION = 1
+
+
+def compile_symbol_data(csv_path: str = SYMBOLS_CSV, artifact_path: str = SYMBOLS_ARTIFACT) -> SymbolData:
+    """
+    Compiles the enhanced symbol csv + blacklists into a pickled artifact that loads without pandas
+    """
+    import pandas as pd
+
+    # Tickers such as NA would otherwise be parsed as missing values
+    df = pd.read_csv(csv_path, usecols=['Symbol', 'Reduced Name'], keep_default_na=False)
+    df = df[(df['Symbol'] != '') & (df['Reduced Name'] != '')]
     data = SymbolData()
-    
-    for i in range(df.shape[0]):
-        symbol, name = df.iloc[i]['Symbol'], df.iloc[i]['Reduced Name']
-        data.symbols.add(symbol)
-        data.companies[symbol] = name
+    data.symbols = set(df['Symbol'])
+    data.companies = dict(zip(df['Symbol'], df['Reduced Name']))
+    data.blacklist = frozenset(blacklist)
+    data.extended_blacklist = frozenset(extended_blacklist)
+    data.focus_symbols = frozenset(focus_symbols)
 
+    # Written aside and moved into place, so processes loading it concurrently never see a partial file
+    tmp_path = f'{artifact_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'version': ARTIFACT_VERSION, 'data': data}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, artifact_path)
     return data
+
+def load_symbol_data(csv_path: str = SYMBOLS_CSV, artifact_path: str = SYMBOLS_ARTIFACT) -> SymbolData:
+    """
+    Loads the compiled artifact, rebuilding it first if it's missing, outdated or stale relative to the csv
+    """
+    stale = not os.path.exists(artifact_path) or (os.path.exists(csv_path) and os.path.getmtime(csv_path) > os.path.getmtime(artifact_path))
+    if not stale:
+        try:
+            with open(artifact_path, 'rb') as f: artifact = pickle.load(f)
+            if artifact['version'] == ARTIFACT_VERSION: return artifact['data']
+        except Exception as e: print('Error loading compiled symbol data, rebuilding:', e)
+
+    return compile_symbol_data(csv_path, artifact_path)
+
+
+_symbol_data: SymbolData = None
+_symbol_data_lock = threading.Lock()
+
+def enhanced_symbols() -> SymbolData:
+    """
+    Returns the process-wide symbol universe, loaded once on first use
+    """
+    global _symbol_data
+    if _symbol_data is None:
+        with _symbol_data_lock:
+            if _symbol_data is None: _symbol_data = load_symbol_data()
+    return _symbol_data
@@ -1,42 +1,41 @@
 import pandas as pd
 
+from config.symbols import SYMBOLS_CSV, compile_symbol_data
+
 
 def initialze_symbol_data():
-    df = pd.read_csv('symbol_data/symbols.csv')
+    df = pd.read_csv('config/symbols.csv', keep_default_na=False)
 
     # We build enhanced symbol data by simplifying company names for better relevance
-    def strip_lingo(name: str) -> str:
-        name = name.lower()
-
-        remove_strings = [
-            'Ordinary Shares', 'New Common Stock', 'Common Stock', 'Common Shares',
-            'Common Units Representing Limited Partner Interests',
-            'representing Limited Partner Interests',
-            'Common Units',
-            'Class A Voting', 'Class B Voting',
-            'Class A', 'Class B', 'Class C',
-            'voting shares', 'american depositary shares', 'depositary shares',
-            'Group Holdings',
-            # 'Holdings',
-            'Corporation', 'Stock', ' Corp ', ' Corp.',
-            ', Inc', ', Inc.', ' Inc.', ' Inc ',
-            ' Ltd ', ' Ltd.', ' limited partner', ' Limited', 'l.p.',
-            ' plc ', 'p.l.c.', ' lp ', 's.a.', 'llc',
-            '(The)', '(New)'
-        ]
-        # remove_strings = remove_strings + [s.lower() for s in remove_strings] + [s.upper() for s in remove_strings]
-        remove_strings = [s.lower() for s in remove_strings]
-        
-        if 'corporation' in name: name = name[:name.index('corporation')]
-        if '(' in name: name = name[:name.index('(')]
-        for target in remove_strings: name = name.replace(target, '')
-
-        name = ' '.join(name.title().strip().split())
-        if name.split(' ')[-1] in remove_strings: name = ' '.join(name.split(' ')[:-1])
-
-        return name
-
-    df['Reduced Name'] = df['Name'].apply(strip_lingo)
-    df.to_csv('symbol_data/enhanced_symbols.csv')
-
-
+    remove_strings = [
+        'Ordinary Shares', 'New Common Stock', 'Common Stock', 'Common Shares',
+        'Common Units Representing Limited Partner Interests',
+        'representing Limited Partner Interests',
+        'Common Units',
+        'Class A Voting', 'Class B Voting',
+        'Class A', 'Class B', 'Class C',
+        'voting shares', 'american depositary shares', 'depositary shares',
+        'Group Holdings',
+        # 'Holdings',
+        'Corporation', 'Stock', ' Corp ', ' Corp.',
+        ', Inc', ', Inc.', ' Inc.', ' Inc ',
+        ' Ltd ', ' Ltd.', ' limited partner', ' Limited', 'l.p.',
+        ' plc ', 'p.l.c.', ' lp ', 's.a.', 'llc',
+        '(The)', '(New)'
+    ]
+    remove_strings = [s.lower() for s in remove_strings]
+
+    # Column-wise string ops rather than a per-row python function
+    names = df['Name'].str.lower()
+    names = names.str.split('corporation', n=1).str[0]
+    names = names.str.split('(', n=1).str[0]
+    for target in remove_strings: names = names.str.replace(target, '', regex=False)
+    names = names.str.title().str.split().str.join(' ')
+
+    last_words = names.str.rsplit(' ', n=1)
+    trailing_lingo = last_words.str[-1].isin(remove_strings)
+    names[trailing_lingo] = last_words[trailing_lingo].map(lambda words: words[0] if len(words) > 1 else '')
+
+    df['Reduced Name'] = names
+    df.to_csv(SYMBOLS_CSV)
+    compile_symbol_data()
@@ -0,0 +1,192 @@
+from typing import Dict, List, Tuple
+import datetime as dt, numpy as np, pandas as pd, time, os
+
+from config.symbols import us
+from data.es import NEWS_INDEX, available_sources, _initialize
+from data.export import read as read_export
+
+
+ANALYSIS_DIR = 'scrapers/fetched/analysis'
+PAGE_SIZE = 10000
+MIN_PERIODS = 3         # trailing periods required before a z-score is computed
+MIN_VOLUME = 5          # impressions within the window required to be ranked
+Z_THRESHOLD = 3         # |z| above which a period is reported as an anomaly
+ALL_SOURCES = 'all'     # source label of the across-source series
+
+
+# Loading
+def load(from_time: int, to_time: int, sources: List[str] = available_sources) -> pd.DataFrame:
+    """
+    Impressions in [from_time, to_time) as columns (symbol, source, timestamp, rating), scrolled
+    in large pages of just those fields and kept columnar rather than built into Sentiment tuples
+    """
+    es = _initialize()
+    columns: Dict[str, List] = { 'symbol': [], 'source': [], 'timestamp': [], 'rating': [] }
+    page = es.search(
+        body={
+            'query': { 'bool': { 'filter': [
+                { 'terms': { 'source': sources } },
+                { 'range': { 'timestamp': { 'gte': from_time, 'lt': to_time } } },
+            ] } },
+            '_source': list(columns.keys()),
+            'sort': ['_doc'],
+            'size': PAGE_SIZE,
+        },
+        index=NEWS_INDEX,
+        scroll='2m',
+    )
+    while len(page['hits']['hits']) > 0:
+        for hit in page['hits']['hits']:
+            for field, values in columns.items(): values.append(hit['_source'].get(field))
+        page = es.scroll(scroll_id=page['_scroll_id'], scroll='2m')
+    es.clear_scroll(scroll_id=page['_scroll_id'])
+
+    return pd.DataFrame({
+        'symbol': pd.Categorical(columns['symbol']),
+        'source': pd.Categorical(columns['source']),
+        'timestamp': np.array(columns['timestamp'], dtype=np.int64),
+        'rating': np.array(columns['rating'], dtype=np.float64),
+    })
+
+
+
+# Analysis
+def pivot(frame: pd.DataFrame, freq: str, from_time: int, to_time: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Rating sums + impression counts per period (rows) and (symbol, source) (columns), with an extra
+    (symbol, 'all') column per symbol across its sources. Periods without impressions are zero filled.
+    """
+    periods = pd.to_datetime(frame['timestamp'], unit='s', utc=True).dt.floor(freq)
+    grouped = frame.assign(period=periods).groupby(['period', 'symbol', 'source'], observed=True)['rating'].agg(['sum', 'count'])
+    index = pd.date_range(pd.Timestamp(from_time, unit='s', tz='utc').floor(freq), pd.Timestamp(to_time - 1, unit='s', tz='utc').floor(freq), freq=freq)
+
+    wide: List[pd.DataFrame] = []
+    for field in ['sum', 'count']:
+        by_source = grouped[field].unstack(['symbol', 'source'], fill_value=0).reindex(index, fill_value=0)
+        combined = by_source.T.groupby(level='symbol', observed=True).sum().T
+        combined.columns = pd.MultiIndex.from_arrays([combined.columns, [ALL_SOURCES] * len(combined.columns)], names=['symbol', 'source'])
+        wide.append(pd.concat([by_source, combined], axis=1).sort_index(axis=1))
+    return wide[0], wide[1].astype(np.float64)
+
+def trailing(values: np.ndarray, window: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Sum, sum of squares + count of the non-NaN values over each period's trailing [window] periods
+    (itself included), from cumulative sums so every column is handled in one pass
+    """
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0)
+    def windowed(a: np.ndarray) -> np.ndarray:
+        total = np.cumsum(a, axis=0)
+        total[window:] = total[window:] - total[:-window].copy()
+        return total
+    return windowed(filled), windowed(filled ** 2), windowed(valid.astype(np.float64))
+
+def divide(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'): return np.where(b > 0, a / np.where(b > 0, b, 1), np.nan)
+
+def trailing_z(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    How many standard deviations each period is from the [window] periods before it
+    """
+    previous = np.vstack([np.full((1, values.shape[1]), np.nan), values[:-1]])
+    total, squares, n = trailing(previous, window)
+    mean = divide(total, n)
+    std = np.sqrt(np.clip(divide(squares - total * mean, n - 1), 0, None))
+    std[(n < MIN_PERIODS) | (std < 1e-9)] = np.nan
+    return (values - mean) / std
+
+def analyze(frame: pd.DataFrame, freq: str, window: int, from_time: int, to_time: int) -> pd.DataFrame:
+    """
+    Per period, symbol and source (plus 'all' sources):
+        - count, mean: the period's impressions + their mean rating
+        - rolling_mean: mean of the per-period means over the trailing [window] periods
+        - vw_mean: volume weighted sentiment, every impression in the trailing window weighted equally
+        - volume_z, sentiment_z: the period's count / mean against the trailing window
+        - rank, percentile: cross-symbol rank by vw_mean among symbols with MIN_VOLUME impressions in
+          the window ('all' rows only, 1 is most positive)
+    """
+    sums, counts = pivot(frame, freq, from_time, to_time)
+    periods, columns = counts.index, counts.columns
+    sums, counts = sums.to_numpy(dtype=np.float64), counts.to_numpy(dtype=np.float64)
+    means = divide(sums, counts)
+    window_sums, _, _ = trailing(sums, window)
+    window_counts, _, _ = trailing(counts, window)
+    vw_means = divide(window_sums, window_counts)
+    mean_sums, _, mean_n = trailing(means, window)
+
+    # Ranks across the 'all' columns of each period, computed by pandas' row-wise rank
+    combined = columns.get_level_values('source') == ALL_SOURCES
+    rankable = pd.DataFrame(np.where(window_counts[:, combined] >= MIN_VOLUME, vw_means[:, combined], np.nan))
+    ranks, percentiles = np.full(counts.shape, np.nan), np.full(counts.shape, np.nan)
+    ranks[:, combined] = rankable.rank(axis=1, ascending=False, method='min').to_numpy()
+    percentiles[:, combined] = rankable.rank(axis=1, pct=True).to_numpy()
+
+    matrices = {
+        'count': counts,
+        'mean': means,
+        'rolling_mean': divide(mean_sums, mean_n),
+        'vw_mean': vw_means,
+        'volume_z': trailing_z(counts, window),
+        'sentiment_z': trailing_z(means, window),
+        'rank': ranks,
+        'percentile': percentiles,
+    }
+
+    # Matrices -> long rows without a python loop: every cell becomes (period, symbol, source, values...)
+    n_periods, n_columns = counts.shape
+    series = pd.DataFrame({
+        'period': np.repeat(periods, n_columns),
+        'symbol': np.tile(columns.get_level_values('symbol').astype(str), n_periods),
+        'source': np.tile(columns.get_level_values('source').astype(str), n_periods),
+        **{ name: matrix.ravel() for name, matrix in matrices.items() },
+    })
+    return series[series['vw_mean'].notna()].reset_index(drop=True)
+
+def rankings(series: pd.DataFrame) -> pd.DataFrame:
+    """
+    Each symbol's standing in the last period, with its impression totals over the whole range
+    """
+    combined = series[series['source'] == ALL_SOURCES]
+    latest = combined[combined['period'] == combined['period'].max()].set_index('symbol')
+    totals = combined.groupby('symbol').agg(impressions=('count', 'sum'), mean=('mean', 'mean'))
+    table = totals.join(latest[['vw_mean', 'volume_z', 'sentiment_z', 'rank', 'percentile']], how='inner')
+    return table.sort_values(['rank', 'impressions'], ascending=[True, False], na_position='last').reset_index()
+
+def anomalies(series: pd.DataFrame, threshold: float = Z_THRESHOLD) -> pd.DataFrame:
+    return series[(series['volume_z'].abs() > threshold) | (series['sentiment_z'].abs() > threshold)].sort_values('period').reset_index(drop=True)
+
+
+
+# Running
+def write(frame: pd.DataFrame, path: str, format: str):
+    if format == 'parquet':
+        try: frame.to_parquet(f'{path}.parquet', index=False)
+        except ImportError as e: raise Exception(f'Parquet output requires pyarrow or fastparquet: {e}')
+    else: frame.to_csv(f'{path}.csv', index=False)
+
+def run(since: str = None, until: str = None, freq: str = '1D', window: int = 7, output: str = ANALYSIS_DIR, format: str = 'csv',
+        sources: List[str] = available_sources, universe: bool = True, input: str = None) -> pd.DataFrame:
+    """
+    Loads impressions between the YYYY-MM-DD dates (default the last 90 days), analyzes them and
+    writes series, rankings + anomalies to [output]. [universe] restricts symbols to the us listing.
+    With [input] the impressions are read from a parquet export (data.export) instead of elasticsearch.
+    """
+    to_time = int(time.time()) if until is None else int(dt.datetime.strptime(until, '%Y-%m-%d').replace(tzinfo=dt.timezone.utc).timestamp())
+    from_time = to_time - 90 * 24 * 60 * 60 if since is None else int(dt.datetime.strptime(since, '%Y-%m-%d').replace(tzinfo=dt.timezone.utc).timestamp())
+
+    start = time.perf_counter()
+    frame = load(from_time, to_time, sources) if input is None else read_export(input, from_time, to_time, sources)
+    if universe: frame = frame[frame['symbol'].isin(us)]
+    print(f'analysis | loaded {len(frame)} impressions in {time.perf_counter() - start:.1f}s')
+    if len(frame) == 0: return None
+
+    start = time.perf_counter()
+    series = analyze(frame, freq, window, from_time, to_time)
+    table, unusual = rankings(series), anomalies(series)
+    print(f'analysis | {series["symbol"].nunique()} symbols over {series["period"].nunique()} periods analyzed in {time.perf_counter() - start:.1f}s')
+
+    os.makedirs(output, exist_ok=True)
+    for name, result in [('series', series), ('rankings', table), ('anomalies', unusual)]: write(result, os.path.join(output, name), format)
+    print(f'analysis | {len(series)} series rows, {len(unusual)} anomalies written to {output}')
+    print(table.head(10).to_string(index=False))
+    return table
@@ -1,8 +1,9 @@
 from elasticsearch import Elasticsearch, helpers
-from typing import Dict, List, Tuple
-import datetime as dt
+from typing import Callable, Dict, List, Tuple
+import datetime as dt, threading, time, os
 
 from config.models import Analysis, Sentiment
+from instrumentation.metrics import metrics, timed, LAG_BUCKETS
 
 
 NEWS_INDEX = 'news'
@@ -17,9 +18,29 @@ def _initialize() -> Elasticsearch:
 
     return es
 
+_client: Elasticsearch = None
+_client_pid: int = None
+_client_lock = threading.Lock()
+CLIENT_POOL_SIZE = 25   # connections kept open to the cluster, shared by every reading + writing thread
+
+def client() -> Elasticsearch:
+    """
+    Returns the process-wide client, the index is only checked when it's first built. Forked
+    processes (e.g. backfill workers) build their own rather than sharing the parent's connections.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                es = Elasticsearch(maxsize=CLIENT_POOL_SIZE)
+                if not es.indices.exists(NEWS_INDEX): es.indices.create(index=NEWS_INDEX, ignore=400)
+                _client, _client_pid = es, os.getpid()
+    return _client
+
 def reset():
     es = Elasticsearch()
     es.indices.delete(NEWS_INDEX)
+    es.indices.create(index=NEWS_INDEX, ignore=400) # the shared client only creates it when first built
 
 
 # Helpers
@@ -133,24 +154,44 @@ def reindex(es: Elasticsearch, from_index: str, target_index: str, source: str):
 
 
 # Saving
+_listeners: List[Callable[[Analysis], None]] = []
+
+def add_listener(listener: Callable[[Analysis], None]):
+    """
+    Calls [listener] with every analysis once it has been written, in the writing thread
+    """
+    if listener not in _listeners: _listeners.append(listener)
+
 def add_analyses(analyses: List[Analysis], reset_indices: bool = False, bulk: bool = False):
     if reset_indices: reset()
-    es = _initialize()
+    es = client()
 
-    if bulk:
-        for analysis in analyses:
-            actions = [
-                {
-                    '_index': NEWS_INDEX,
-                    '_type': '_doc',
-                    '_source': entry.__dict__
-                } for entry in analysis.data
-            ]
-            helpers.bulk(es, actions)
-    else:
-        for analysis in analyses:
-            for entry in analysis.data:
-                es.index(NEWS_INDEX, entry.__dict__)
+    for analysis in analyses:
+        if len(analysis.data) == 0: continue
+        with timed('es_write_seconds', analysis.data[0].source):
+            if bulk:
+                actions = [
+                    {
+                        '_index': NEWS_INDEX,
+                        '_type': '_doc',
+                        '_source': entry.__dict__
+                    } for entry in analysis.data
+                ]
+                if analysis.ids is not None:
+                    for action, doc_id in zip(actions, analysis.ids): action['_id'] = doc_id
+                helpers.bulk(es, actions)
+            else:
+                for i, entry in enumerate(analysis.data): es.index(NEWS_INDEX, entry.__dict__, id=analysis.ids[i] if analysis.ids is not None else None)
+
+        # Publish to index lag, from each entry's own timestamp
+        now = time.time()
+        for entry in analysis.data:
+            metrics().count('es_documents_total', entry.source)
+            if entry.timestamp is not None: metrics().observe('index_lag_seconds', entry.source, max(now - entry.timestamp, 0), LAG_BUCKETS)
+
+        for listener in _listeners:
+            try: listener(analysis)
+            except Exception as e: print(f'es | listener {getattr(listener, "__qualname__", listener)} failed: {e}')
 
 
 
@@ -159,7 +200,7 @@ def add_analyses(analyses: List[Analysis], reset_indices: bool = False, bulk: bo
 # News fetching
 available_sources = ['seeking_alpha', 'cnbc', 'ap', 'benzinga', 'investors', 'bloomberg', 'reuters', 'market_watch', 'wsb', 'hacker_news']
 def fetch_impressions(symbol: str, from_time: int, to_time: int, sources: List[str] = available_sources) -> Tuple[List[Sentiment], Dict[str, int]]:
-    es = _initialize()
+    es = client()
 
     entries: List[Sentiment] = []
     source_counts: Dict[str, int] = {}
@@ -192,14 +233,15 @@ def fetch_impressions(symbol: str, from_time: int, to_time: int, sources: List[s
     for hit in page['hits']['hits']: entries.append(Sentiment(**(hit['_source'])))
     for bucket in page['aggregations']['sources']['buckets']: source_counts[bucket['key']] = bucket['doc_count']
 
-    # Scroll through additional results if needed
+    # Scroll through additional results if needed, releasing the scroll context once done
     sid = page['_scroll_id']
-    scroll_size = page['hits']['total']['value']
+    scroll_size = len(page['hits']['hits']) if page['hits']['total']['value'] > len(entries) else 0
     while (scroll_size > 0):
         page = es.scroll(scroll_id = sid, scroll = '2m')
         sid = page['_scroll_id']
         scroll_size = len(page['hits']['hits'])
         for hit in page['hits']['hits']: entries.append(Sentiment(**(hit['_source'])))
+    es.clear_scroll(scroll_id = sid)
 
     return entries, source_counts
 
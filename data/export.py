@@ -0,0 +1,200 @@
+from typing import Any, Dict, List
+import datetime as dt, numpy as np, pandas as pd, time, json, os
+
+from data.es import NEWS_INDEX, available_sources, _initialize
+
+try: import pyarrow as pa, pyarrow.parquet as pq, pyarrow.dataset as ds
+except ImportError: pa = pq = ds = None
+
+
+EXPORT_DIR = 'scrapers/fetched/export'
+PAGE_SIZE = 10000
+ROW_GROUP_SIZE = 100000     # rows buffered per partition before a row group is written
+COMPRESSION = 'zstd'
+SETTLE_SECONDS = 60 * 60    # days ending less than this before the export may still receive documents
+DAY = 24 * 60 * 60
+
+
+def _require():
+    if pa is None: raise Exception('Export requires pyarrow (pip install pyarrow)')
+
+def schema(by_source: bool) -> 'pa.Schema':
+    """
+    Symbols + sources are dictionary encoded, with source left out of the files when it's a partition key
+    """
+    fields = [('symbol', pa.dictionary(pa.int32(), pa.string()))]
+    if not by_source: fields.append(('source', pa.dictionary(pa.int32(), pa.string())))
+    return pa.schema(fields + [('timestamp', pa.int64()), ('rating', pa.float32())])
+
+def partitioning(by_source: bool) -> 'ds.Partitioning':
+    return ds.partitioning(pa.schema([('date', pa.string())] + ([('source', pa.string())] if by_source else [])), flavor='hive')
+
+def day_of(timestamp: int) -> str:
+    return dt.datetime.fromtimestamp(timestamp, dt.timezone.utc).strftime('%Y-%m-%d')
+
+def day_start(day: str) -> int:
+    return int(dt.datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=dt.timezone.utc).timestamp())
+
+
+# Manifest
+def load_manifest(path: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(path, '_manifest.json'), 'r') as f: return json.loads(f.read())
+    except: return { 'by_source': None, 'days': {} }
+
+def save_manifest(path: str, manifest: Dict[str, Any]):
+    manifest_path = os.path.join(path, '_manifest.json')
+    with open(f'{manifest_path}.tmp', 'w') as f: f.write(json.dumps(manifest, indent=4, sort_keys=True))
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+
+
+# Writing
+class Partition():
+    """
+    One output file, columns are buffered and written out a row group at a time. The file is
+    written under a hidden .tmp name (which dataset discovery skips) and only moved into place by commit().
+    """
+    def __init__(self, root: str, day: str, source: str, by_source: bool) -> None:
+        self.relative = os.path.join(f'date={day}', *([f'source={source}'] if by_source else []), 'part-0.parquet')
+        self.path = os.path.join(root, self.relative)
+        self.tmp = os.path.join(os.path.dirname(self.path), '.part-0.parquet.tmp')
+        self.schema = schema(by_source)
+        self.columns: Dict[str, List] = { name: [] for name in self.schema.names }
+        self.rows = 0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.writer = pq.ParquetWriter(self.tmp, self.schema, compression=COMPRESSION)
+
+    def append(self, document: Dict[str, Any]):
+        for name, values in self.columns.items(): values.append(document[name])
+        self.rows += 1
+        if len(self.columns['timestamp']) >= ROW_GROUP_SIZE: self.flush()
+
+    def flush(self):
+        if len(self.columns['timestamp']) == 0: return
+        arrays = [pa.array(self.columns[name], type=pa.string()).dictionary_encode() if pa.types.is_dictionary(field.type) else pa.array(self.columns[name], type=field.type)
+                  for name, field in zip(self.schema.names, self.schema)]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        for values in self.columns.values(): values.clear()
+
+    def commit(self):
+        self.flush()
+        self.writer.close()
+        os.replace(self.tmp, self.path)
+
+
+def scroll(from_time: int, to_time: int, sources: List[str]):
+    """
+    Yields the documents in [from_time, to_time) oldest first, in large pages of just the exported fields
+    """
+    es = _initialize()
+    page = es.search(
+        body={
+            'query': { 'bool': { 'filter': [
+                { 'terms': { 'source': sources } },
+                { 'range': { 'timestamp': { 'gte': from_time, 'lt': to_time } } },
+            ] } },
+            '_source': ['symbol', 'source', 'timestamp', 'rating'],
+            'sort': [{ 'timestamp': 'asc' }],
+            'size': PAGE_SIZE,
+        },
+        index=NEWS_INDEX,
+        scroll='2m',
+    )
+    while len(page['hits']['hits']) > 0:
+        for hit in page['hits']['hits']: yield hit['_source']
+        page = es.scroll(scroll_id=page['_scroll_id'], scroll='2m')
+    es.clear_scroll(scroll_id=page['_scroll_id'])
+
+def first_timestamp(sources: List[str]) -> int:
+    es = _initialize()
+    res = es.search(body={ 'query': { 'terms': { 'source': sources } }, 'aggs': { 'min_date': { 'min': { 'field': 'timestamp' } } }, 'size': 0 }, index=NEWS_INDEX)
+    value = res['aggregations']['min_date']['value']
+    return int(value) if value is not None else int(time.time())
+
+def export(since: str = None, until: str = None, output: str = EXPORT_DIR, by_source: bool = False, sources: List[str] = available_sources) -> Dict[str, Any]:
+    """
+    Streams the news index into parquet files partitioned by day (and source), between the YYYY-MM-DD
+    dates. Without [since] the export is incremental: it resumes after the last day the manifest has
+    as complete (or from the first document), re-exporting days that were still open last time.
+    """
+    _require()
+    started = int(time.time())
+    manifest = load_manifest(output)
+    if manifest['by_source'] is not None and manifest['by_source'] != by_source:
+        raise Exception(f'{output} is partitioned {"by date + source" if manifest["by_source"] else "by date"}, export to a fresh directory to change it')
+    manifest['by_source'] = by_source
+
+    to_time = min(started, day_start(until)) if until is not None else started
+    if since is not None: from_time = day_start(since)
+    else:
+        complete = sorted([day for day, entry in manifest['days'].items() if entry['complete']])
+        from_time = day_start(complete[-1]) + DAY if len(complete) > 0 else day_start(day_of(first_timestamp(sources)))
+    if from_time >= to_time:
+        print(f'export | {output} is up to date')
+        return manifest
+
+    # Documents arrive oldest first, so a day's partitions are committed as soon as the next day starts
+    open_day, partitions = None, {}
+    days: Dict[str, Dict[str, Any]] = {}
+    def close_day():
+        if open_day is None: return
+        for partition in partitions.values(): partition.commit()
+        replaced = [f for f in manifest['days'].get(open_day, {}).get('files', []) if f not in [p.relative for p in partitions.values()]]
+        for relative in replaced:
+            try: os.remove(os.path.join(output, relative))
+            except FileNotFoundError: pass
+        days[open_day] = { 'rows': sum([p.rows for p in partitions.values()]), 'files': sorted([p.relative for p in partitions.values()]) }
+
+    start = time.perf_counter()
+    for document in scroll(from_time, to_time, sources):
+        if document.get('timestamp') is None or document.get('symbol') is None: continue
+        document['timestamp'] = int(document['timestamp'])
+        day = day_of(document['timestamp'])
+        if day != open_day:
+            close_day()
+            open_day, partitions = day, {}
+        key = document['source'] if by_source else None
+        if key not in partitions: partitions[key] = Partition(output, day, document['source'], by_source)
+        partitions[key].append(document)
+    close_day()
+
+    # Every day in the range is recorded, including the empty ones, so incremental runs skip past them
+    for day_time in range(from_time, to_time, DAY):
+        day = day_of(day_time)
+        entry = days.get(day, { 'rows': 0, 'files': [] })
+        if day not in days:
+            for relative in manifest['days'].get(day, {}).get('files', []):
+                try: os.remove(os.path.join(output, relative))
+                except FileNotFoundError: pass
+        manifest['days'][day] = { **entry, 'complete': day_time + DAY <= started - SETTLE_SECONDS, 'exported_at': started }
+    save_manifest(output, manifest)
+
+    rows = sum([entry['rows'] for entry in days.values()])
+    print(f'export | {rows} documents over {len(range(from_time, to_time, DAY))} days written to {output} in {time.perf_counter() - start:.1f}s')
+    return manifest
+
+
+# Reading
+def read(path: str = EXPORT_DIR, from_time: int = None, to_time: int = None, sources: List[str] = None, symbols: List[str] = None) -> pd.DataFrame:
+    """
+    Exported impressions in [from_time, to_time) as columns (symbol, source, timestamp, rating), the
+    filters are pushed down to skip partitions + row groups
+    """
+    _require()
+    by_source = load_manifest(path)['by_source']
+    dataset = ds.dataset(path, format='parquet', partitioning=partitioning(bool(by_source)))
+
+    filters = []
+    if from_time is not None: filters += [ds.field('date') >= day_of(from_time), ds.field('timestamp') >= from_time]
+    if to_time is not None: filters += [ds.field('date') <= day_of(to_time - 1), ds.field('timestamp') < to_time]
+    if sources is not None: filters.append(ds.field('source').isin(sources))
+    if symbols is not None: filters.append(ds.field('symbol').isin(symbols))
+    condition = None
+    for f in filters: condition = f if condition is None else condition & f
+
+    frame = dataset.to_table(columns=['symbol', 'source', 'timestamp', 'rating'], filter=condition).to_pandas()
+    return frame.assign(
+        symbol=frame['symbol'].astype('category'),
+        source=frame['source'].astype('category'),
+        rating=frame['rating'].astype(np.float64),
+    )
@@ -0,0 +1,189 @@
+from typing import Any, Callable, Dict, List, Tuple
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import threading, time, json, os
+
+from data.es import NEWS_INDEX, available_sources, client, fetch_impressions
+from instrumentation.metrics import metrics, timed
+
+
+API_PORT = int(os.environ.get('TS_API_PORT', 8900))
+CACHE_SIZE = 2048           # responses kept for closed ranges
+CACHE_TTL = 60 * 60         # seconds a closed range's response is served from the cache (backfills can still add to it)
+CLOSED_AFTER = 15 * 60      # ranges ending this long ago are treated as closed, late documents land within it
+DEFAULT_RANGE = 24 * 60 * 60
+INTERVALS = ['1m', '5m', '15m', '30m', '1h', '3h', '6h', '12h', '1d']
+
+
+class Cache():
+    """
+    Least recently used responses, each valid for [ttl] seconds
+    """
+    def __init__(self, size: int = CACHE_SIZE, ttl: float = CACHE_TTL) -> None:
+        self.size = size
+        self.ttl = ttl
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Any:
+        with self.lock:
+            if key not in self.entries: return None
+            stored, value = self.entries[key]
+            if time.time() - stored > self.ttl:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: Tuple, value: Any):
+        with self.lock:
+            self.entries[key] = (time.time(), value)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.size: self.entries.popitem(last=False)
+
+
+class Flights():
+    """
+    Singleflight: concurrent calls for the same key wait on the first one's result instead of
+    repeating the query
+    """
+    def __init__(self) -> None:
+        self.flights: Dict[Tuple, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+
+    def do(self, key: Tuple, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Returns (fn's result, whether it was shared from another call)
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader: flight = self.flights[key] = { 'done': threading.Event(), 'result': None, 'error': None }
+        if not leader:
+            flight['done'].wait()
+            if flight['error'] is not None: raise flight['error']
+            return flight['result'], True
+
+        try: flight['result'] = fn()
+        except Exception as e: flight['error'] = e
+        finally:
+            with self.lock: del self.flights[key]
+            flight['done'].set()
+        if flight['error'] is not None: raise flight['error']
+        return flight['result'], False
+
+
+# Queries
+def _filters(symbol: str, from_time: int, to_time: int, sources: List[str]) -> Dict[str, Any]:
+    return { 'bool': {
+        'must': [{ 'match': { 'symbol': symbol } }, { 'terms': { 'source': sources } }],
+        'filter': [{ 'range': { 'timestamp': { 'gte': from_time, 'lt': to_time } } }],
+    } }
+
+def impressions(symbol: str, from_time: int, to_time: int, sources: List[str]) -> Dict[str, Any]:
+    entries, source_counts = fetch_impressions(symbol, from_time, to_time, sources)
+    return { 'impressions': [entry._asdict() for entry in entries], 'sources': source_counts }
+
+def aggregates(symbol: str, from_time: int, to_time: int, sources: List[str], interval: str = '1h') -> Dict[str, Any]:
+    """
+    Impression count + mean rating per [interval], from one aggregation rather than a scroll
+    """
+    res = client().search(
+        body={
+            'query': _filters(symbol, from_time, to_time, sources),
+            'aggs': { 'periods': {
+                'date_histogram': { 'field': 'timestamp', 'fixed_interval': interval, 'min_doc_count': 1 },
+                'aggs': { 'rating': { 'avg': { 'field': 'rating' } } },
+            } },
+            'size': 0,
+        },
+        index=NEWS_INDEX,
+    )
+    periods = [{ 'timestamp': bucket['key'] // 1000, 'count': bucket['doc_count'], 'rating': bucket['rating']['value'] } for bucket in res['aggregations']['periods']['buckets']]
+    # hits.total stops counting at 10000, every matching document lands in exactly one bucket
+    return { 'periods': periods, 'count': sum([period['count'] for period in periods]) }
+
+def source_counts(symbol: str, from_time: int, to_time: int, sources: List[str]) -> Dict[str, Any]:
+    res = client().search(
+        body={
+            'query': _filters(symbol, from_time, to_time, sources),
+            'aggs': { 'sources': { 'terms': { 'field': 'source', 'size': 500 } } },
+            'size': 0,
+        },
+        index=NEWS_INDEX,
+    )
+    return { 'sources': { bucket['key']: bucket['doc_count'] for bucket in res['aggregations']['sources']['buckets'] } }
+
+ENDPOINTS: Dict[str, Callable[..., Dict[str, Any]]] = {
+    '/impressions': impressions,
+    '/aggregates': aggregates,
+    '/sources': source_counts,
+}
+
+
+_cache = Cache()
+_flights = Flights()
+
+def query(path: str, params: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Runs an endpoint's query for the request parameters (symbol, from, to, sources[, interval]).
+    Responses for closed ranges are cached and identical requests in flight share one query.
+    """
+    now = int(time.time())
+    to_time = int(params['to']) if 'to' in params else now
+    from_time = int(params['from']) if 'from' in params else to_time - DEFAULT_RANGE
+    sources = sorted(params['sources'].split(',')) if 'sources' in params else available_sources
+    args = [params['symbol'].upper(), from_time, to_time, sources]
+    if path == '/aggregates':
+        if params.get('interval', '1h') not in INTERVALS: raise ValueError(f'interval must be one of {", ".join(INTERVALS)}')
+        args.append(params.get('interval', '1h'))
+
+    key = (path, *[tuple(arg) if type(arg) == list else arg for arg in args])
+    closed = to_time <= now - CLOSED_AFTER
+    if closed:
+        cached = _cache.get(key)
+        if cached is not None:
+            metrics().count('api_cache_hits_total', path)
+            return cached
+
+    with timed('api_query_seconds', path): result, shared = _flights.do(key, lambda: ENDPOINTS[path](*args))
+    if shared: metrics().count('api_coalesced_total', path)
+    if closed: _cache.put(key, result)
+    return result
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def _send(self, status: int, body: Dict[str, Any]):
+        data = json.dumps(body).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path not in ENDPOINTS:
+            self._send(404, { 'error': f'unknown endpoint, one of {", ".join(ENDPOINTS)}' })
+            return
+        params = { k: v[0] for k, v in parse_qs(parts.query).items() }
+        metrics().count('api_requests_total', parts.path)
+        try: self._send(200, query(parts.path, params))
+        except KeyError as e: self._send(400, { 'error': f'missing parameter {e}' })
+        except ValueError as e: self._send(400, { 'error': str(e) })
+        except Exception as e:
+            print(f'api | {self.path} failed: {e}')
+            self._send(502, { 'error': 'query failed' })
+
+    def log_message(self, format, *args): pass
+
+def serve(port: int = API_PORT) -> ThreadingHTTPServer:
+    """
+    Serves the read api from a background thread
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='api', daemon=True).start()
+    print(f'api | serving {", ".join(ENDPOINTS)} on http://127.0.0.1:{server.server_port}')
+    return server
@@ -0,0 +1,213 @@
+from typing import Any, Dict, List, Set
+from collections import OrderedDict
+import threading, requests, queue, math, time, json, os
+
+from config.models import Analysis
+from instrumentation.metrics import metrics
+
+
+# Sinks alerts go to, comma separated: file:<path> | webhook:<url> | queue (in process, see alerts())
+ALERT_SINKS = os.environ.get('TS_ALERTS', 'file:scrapers/fetched/alerts.jsonl')
+SPIKE_Z = float(os.environ.get('TS_SPIKE_Z', 4))   # z-score above which a bucket is reported
+BUCKET_SECONDS = 15 * 60            # mention counts are compared bucket by bucket
+VOLUME_HALF_LIFE = 4 * 24           # buckets, the volume baseline's memory (a day)
+RATING_HALF_LIFE = 200              # impressions, the sentiment baseline's memory
+MIN_BUCKETS = 24                    # buckets of history required before a symbol is checked
+MIN_MENTIONS = 5                    # impressions in a bucket required before it can be a spike
+MIN_RATINGS = 50                    # impressions of history required before sentiment is checked
+MAX_AGE = 24 * 60 * 60              # older contexts (e.g. historical + backfill writes) are ignored
+SEEN_IDS = 100000                   # recent document ids remembered, re-stored documents count once
+
+
+class Ewm():
+    """
+    Exponentially weighted mean + variance, updated one observation at a time
+    """
+    def __init__(self, half_life: float) -> None:
+        self.alpha = 1 - 0.5 ** (1 / half_life)
+        self.mean = 0.0
+        self.var = 0.0
+        self.n = 0
+
+    def update(self, x: float):
+        if self.n == 0: self.mean = x
+        else:
+            diff = x - self.mean
+            self.mean += self.alpha * diff
+            self.var = (1 - self.alpha) * (self.var + self.alpha * diff * diff)
+        self.n += 1
+
+    def std(self) -> float:
+        return math.sqrt(self.var)
+
+
+class SymbolState():
+    """
+    One symbol's baselines plus the bucket being filled. Buckets only join the baselines once
+    closed, so a spike doesn't hide itself by raising its own baseline.
+    """
+    def __init__(self, bucket: int) -> None:
+        self.volume = Ewm(VOLUME_HALF_LIFE)
+        self.rating = Ewm(RATING_HALF_LIFE)
+        self.bucket = bucket
+        self.ratings: List[float] = []
+        self.sources: Dict[str, int] = {}
+        self.alerted: Set[str] = set()
+
+    def roll(self, bucket: int):
+        """
+        Closes the current bucket (and any empty ones since) into the baselines
+        """
+        self.volume.update(len(self.ratings))
+        for _ in range(min(bucket - self.bucket - 1, VOLUME_HALF_LIFE * 8)): self.volume.update(0)
+        for rating in self.ratings: self.rating.update(rating)
+        self.bucket, self.ratings, self.sources, self.alerted = bucket, [], {}, set()
+
+
+class Detector():
+    """
+    Flags per symbol mention volume + sentiment spikes as contexts are written. Volume is the open
+    bucket's count against the EWM of past bucket counts, sentiment the open bucket's mean rating
+    against the EWM of past ratings (scaled by the bucket's standard error). Each kind alerts at
+    most once per symbol and bucket.
+    """
+    def __init__(self, sinks: List['Sink'], threshold: float = SPIKE_Z) -> None:
+        self.sinks = sinks
+        self.threshold = threshold
+        self.symbols: Dict[str, SymbolState] = {}
+        self.seen: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _new(self, doc_id: str) -> bool:
+        if doc_id is None: return True
+        if doc_id in self.seen:
+            self.seen.move_to_end(doc_id)
+            return False
+        self.seen[doc_id] = None
+        if len(self.seen) > SEEN_IDS: self.seen.popitem(last=False)
+        return True
+
+    def observe(self, analysis: Analysis, now: float = None):
+        now = time.time() if now is None else now
+        alerts: List[Dict[str, Any]] = []
+        with self.lock:
+            for i, entry in enumerate(analysis.data):
+                if entry.timestamp is None or entry.rating is None or now - entry.timestamp > MAX_AGE: continue
+                if not self._new(analysis.ids[i] if analysis.ids is not None else None): continue
+
+                # Late contexts count towards the open bucket
+                bucket = int(max(entry.timestamp, now - BUCKET_SECONDS) // BUCKET_SECONDS)
+                state = self.symbols.get(entry.symbol)
+                if state is None: state = self.symbols[entry.symbol] = SymbolState(bucket)
+                if bucket > state.bucket: state.roll(bucket)
+
+                state.ratings.append(entry.rating)
+                state.sources[entry.source] = state.sources.get(entry.source, 0) + 1
+                alerts += self._check(entry.symbol, state)
+
+        for alert in alerts:
+            metrics().count('spike_alerts_total', alert['kind'])
+            for sink in self.sinks:
+                try: sink.emit(alert)
+                except Exception as e: print(f'spikes | {type(sink).__name__} failed: {e}')
+
+    def _check(self, symbol: str, state: SymbolState) -> List[Dict[str, Any]]:
+        n = len(state.ratings)
+        if n < MIN_MENTIONS or state.volume.n < MIN_BUCKETS: return []
+        checks = []
+
+        # Counts are roughly poisson, so the spread is never taken below the baseline's square root
+        if 'volume' not in state.alerted:
+            spread = max(state.volume.std(), math.sqrt(max(state.volume.mean, 1)))
+            checks.append(('volume', (n - state.volume.mean) / spread, n, state.volume.mean))
+        if 'sentiment' not in state.alerted and state.rating.n >= MIN_RATINGS:
+            mean = sum(state.ratings) / n
+            checks.append(('sentiment', (mean - state.rating.mean) / (max(state.rating.std(), 0.05) / math.sqrt(n)), mean, state.rating.mean))
+
+        alerts = []
+        for kind, z, value, baseline in checks:
+            if abs(z) < self.threshold: continue
+            state.alerted.add(kind)
+            alerts.append({
+                'time': int(time.time()),
+                'symbol': symbol,
+                'kind': kind,
+                'z': round(z, 2),
+                'value': round(value, 4),
+                'baseline': round(baseline, 4),
+                'mentions': n,
+                'bucket_start': state.bucket * BUCKET_SECONDS,
+                'sources': dict(state.sources),
+            })
+        return alerts
+
+
+# Sinks
+class Sink():
+    def emit(self, alert: Dict[str, Any]): raise NotImplementedError()
+
+class FileSink(Sink):
+    """
+    Appends alerts as json lines
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def emit(self, alert: Dict[str, Any]):
+        with self.lock, open(self.path, 'a') as f: f.write(json.dumps(alert) + '\n')
+
+class QueueSink(Sink):
+    def __init__(self) -> None:
+        self.queue: queue.Queue = queue.Queue()
+
+    def emit(self, alert: Dict[str, Any]):
+        self.queue.put(alert)
+
+class WebhookSink(QueueSink):
+    """
+    Posts alerts as json from a background thread, so a slow endpoint never holds up writes
+    """
+    def __init__(self, url: str) -> None:
+        super().__init__()
+        self.url = url
+        threading.Thread(target=self._post, name='spikes-webhook', daemon=True).start()
+
+    def _post(self):
+        while True:
+            alert = self.queue.get()
+            try: requests.post(self.url, json=alert, timeout=10).raise_for_status()
+            except Exception as e: print(f'spikes | webhook post failed: {e}')
+
+def sinks_from(spec: str) -> List[Sink]:
+    sinks: List[Sink] = []
+    for part in [p.strip() for p in spec.split(',') if p.strip() != '']:
+        kind, _, target = part.partition(':')
+        if kind == 'file': sinks.append(FileSink(target))
+        elif kind == 'webhook': sinks.append(WebhookSink(target))
+        elif kind == 'queue': sinks.append(QueueSink())
+        else: raise Exception(f'Unknown alert sink: {part}')
+    return sinks
+
+
+_detector: Detector = None
+_detector_lock = threading.Lock()
+
+def detector() -> Detector:
+    """
+    Returns the process-wide detector, with the sinks configured by TS_ALERTS
+    """
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None: _detector = Detector(sinks_from(ALERT_SINKS))
+    return _detector
+
+def alerts() -> queue.Queue:
+    """
+    The queue of the in process sink, for consumers running alongside the monitors
+    """
+    for sink in detector().sinks:
+        if type(sink) == QueueSink: return sink.queue
+    raise Exception('No queue sink configured, add "queue" to TS_ALERTS')
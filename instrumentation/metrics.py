@@ -0,0 +1,136 @@
+from typing import Dict, Iterator, List, Tuple
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading, time, json, os
+
+
+METRICS_PORT = os.environ.get('TS_METRICS_PORT')    # serves /metrics in prometheus text format when set
+SNAPSHOT_PATH = os.environ.get('TS_METRICS_SNAPSHOT', 'scrapers/fetched/metrics.json')
+PREFIX = 'ts_'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+LAG_BUCKETS = (60, 300, 900, 3600, 6 * 3600, 24 * 3600, 7 * 24 * 3600, 30 * 24 * 3600, 365 * 24 * 3600)
+
+
+class Histogram():
+    """
+    Cumulative bucket counts plus sum / count, as prometheus expects them
+    """
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound: self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics():
+    """
+    Counters and histograms keyed by (metric name, source)
+    """
+    def __init__(self) -> None:
+        self.counters: Dict[Tuple[str, str], float] = {}
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self.lock = threading.Lock()
+
+    def count(self, name: str, source: str, n: float = 1):
+        with self.lock: self.counters[(name, source)] = self.counters.get((name, source), 0) + n
+
+    def observe(self, name: str, source: str, value: float, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        with self.lock:
+            if (name, source) not in self.histograms: self.histograms[(name, source)] = Histogram(buckets)
+            self.histograms[(name, source)].observe(value)
+
+    def render(self) -> str:
+        """
+        Prometheus text exposition of every metric
+        """
+        lines: List[str] = []
+        with self.lock:
+            for name in sorted(set([name for name, _ in self.counters])):
+                lines.append(f'# TYPE {PREFIX}{name} counter')
+                lines += [f'{PREFIX}{name}{{source="{source}"}} {value}' for (n, source), value in sorted(self.counters.items()) if n == name]
+
+            for name in sorted(set([name for name, _ in self.histograms])):
+                lines.append(f'# TYPE {PREFIX}{name} histogram')
+                for (n, source), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if n != name: continue
+                    lines += [f'{PREFIX}{name}_bucket{{source="{source}",le="{bound}"}} {count}' for bound, count in zip(histogram.buckets, histogram.counts)]
+                    lines.append(f'{PREFIX}{name}_bucket{{source="{source}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{PREFIX}{name}_sum{{source="{source}"}} {histogram.sum}')
+                    lines.append(f'{PREFIX}{name}_count{{source="{source}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict]]:
+        """
+        source -> metric -> value (counters) or count / sum / mean (histograms)
+        """
+        sources: Dict[str, Dict[str, Dict]] = {}
+        with self.lock:
+            for (name, source), value in self.counters.items(): sources.setdefault(source, {})[name] = value
+            for (name, source), histogram in self.histograms.items():
+                sources.setdefault(source, {})[name] = {
+                    'count': histogram.count,
+                    'sum': round(histogram.sum, 4),
+                    'mean': round(histogram.sum / histogram.count, 4) if histogram.count > 0 else None,
+                }
+        return sources
+
+
+
+_metrics: Metrics = None
+_metrics_lock = threading.Lock()
+
+def metrics() -> Metrics:
+    """
+    Returns the process-wide metrics registry
+    """
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None: _metrics = Metrics()
+    return _metrics
+
+
+@contextmanager
+def timed(name: str, source: str, clock=time.perf_counter, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Iterator[None]:
+    """
+    Observes the block's duration in seconds, pass clock=time.thread_time for CPU time
+    """
+    start = clock()
+    try: yield
+    finally: metrics().observe(name, source, clock() - start, buckets)
+
+
+def write_snapshot(path: str = SNAPSHOT_PATH):
+    with open(f'{path}.tmp', 'w') as f: f.write(json.dumps({ 'time': int(time.time()), 'sources': metrics().snapshot() }, indent=4))
+    os.replace(f'{path}.tmp', path)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics().render().encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): pass
+
+def serve(port: int = None) -> ThreadingHTTPServer:
+    """
+    Serves /metrics from a background thread
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', int(port if port is not None else METRICS_PORT)), _Handler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    print(f'metrics | serving on http://127.0.0.1:{server.server_port}/metrics')
+    return server
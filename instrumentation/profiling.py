@@ -0,0 +1,148 @@
+from typing import Callable, Iterable, Iterator, List, Optional, Set
+from collections import Counter
+from contextlib import contextmanager
+import cProfile, pstats, tracemalloc, threading, time, sys, os
+
+from instrumentation.metrics import timed
+
+
+# Sources to profile, comma separated or 'all'. Also settable with main.py's --profile
+PROFILE_SOURCES: Set[str] = set([s.strip() for s in os.environ.get('TS_PROFILE', '').split(',') if s.strip() != ''])
+PROFILE_DIR = os.environ.get('TS_PROFILE_DIR', 'scrapers/fetched/profiles')
+SAMPLE_INTERVAL = 0.005     # seconds between stack samples
+TOP_ALLOCATIONS = 25        # allocation sites listed in the memory report
+
+
+def enable(sources: Iterable[str]):
+    PROFILE_SOURCES.update(sources)
+
+def enabled(source: str) -> bool:
+    return source in PROFILE_SOURCES or 'all' in PROFILE_SOURCES
+
+
+_local = threading.local()
+_tracing_runs = 0
+_tracing_lock = threading.Lock()
+
+def current() -> Optional['ProfileRun']:
+    """
+    The profile run active in this thread, if any
+    """
+    return getattr(_local, 'run', None)
+
+
+class ProfileRun():
+    """
+    One profiled source invocation. A sampler thread records the stacks of the invoking thread
+    and of every thread it names after itself (e.g. 'cnbc' and its pipeline workers 'cnbc/cnbc:fetch'),
+    while each participating thread also runs a deterministic profiler. On finish the merged
+    profile, collapsed stacks (for flamegraph.pl / speedscope) and a tracemalloc report are written.
+    """
+    def __init__(self, source: str) -> None:
+        self.source = source
+        self.prefix = threading.current_thread().name
+        self.started = time.strftime('%Y%m%d-%H%M%S')
+        self.profiles: List[cProfile.Profile] = []
+        self.stacks: Counter = Counter()
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    @contextmanager
+    def thread(self) -> Iterator[None]:
+        """
+        Deterministically profiles the calling thread for the duration of the block
+        """
+        profile = cProfile.Profile()
+        try: profile.enable()
+        except ValueError: # only one profiler may be active at a time on newer interpreters, the sampler still covers this thread
+            yield
+            return
+        try: yield
+        finally:
+            profile.disable()
+            with self.lock: self.profiles.append(profile)
+
+    def _participates(self, name: str) -> bool:
+        return name == self.prefix or name.startswith(f'{self.prefix}/')
+
+    def _sample(self):
+        while not self.done.wait(SAMPLE_INTERVAL):
+            names = { th.ident: th.name for th in threading.enumerate() }
+            for ident, frame in sys._current_frames().items():
+                if ident not in names or not self._participates(names[ident]): continue
+                stack: List[str] = []
+                while frame is not None:
+                    stack.append(f'{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})')
+                    frame = frame.f_back
+                self.stacks[';'.join([names[ident].split(':')[-1]] + stack[::-1])] += 1
+
+    def start(self):
+        global _tracing_runs
+        with _tracing_lock:
+            if _tracing_runs == 0 and not tracemalloc.is_tracing(): tracemalloc.start()
+            _tracing_runs += 1
+        threading.Thread(target=self._sample, name=f'profiler-{self.source}', daemon=True).start()
+
+    def finish(self):
+        global _tracing_runs
+        self.done.set()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        with _tracing_lock:
+            _tracing_runs -= 1
+            if _tracing_runs == 0: tracemalloc.stop()
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f'{self.source}-{self.started}')
+        with self.lock:
+            if len(self.profiles) > 0:
+                stats = pstats.Stats(self.profiles[0])
+                for profile in self.profiles[1:]: stats.add(profile)
+                stats.dump_stats(f'{path}.prof')
+
+            with open(f'{path}.collapsed', 'w') as f:
+                for stack, count in self.stacks.most_common(): f.write(f'{stack} {count}\n')
+
+        # Allocations are process wide, concurrently running sources show up here too
+        with open(f'{path}.memory.txt', 'w') as f:
+            f.write(f'peak traced memory: {peak / 1024 / 1024:.1f} MiB\n\n')
+            for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]: f.write(f'{stat}\n')
+        print(f'profiling | {self.source} profile written to {path}.*')
+
+
+@contextmanager
+def source_run(source: str) -> Iterator[None]:
+    """
+    Wraps one source invocation: always timed, profiled when enabled for the source
+    """
+    with timed('run_seconds', source):
+        if not enabled(source) or current() is not None:
+            yield
+            return
+
+        run = ProfileRun(source)
+        _local.run = run
+        run.start()
+        try:
+            with run.thread(): yield
+        finally:
+            _local.run = None
+            run.finish()
+
+def profiled(source: str, fn: Callable) -> Callable:
+    """
+    [fn] with every call wrapped in source_run, for scheduler jobs that are a source's unit of work
+    """
+    def run(*args, **kwargs):
+        with source_run(source): return fn(*args, **kwargs)
+    return run
+
+@contextmanager
+def thread_profile(run: Optional[ProfileRun]) -> Iterator[None]:
+    """
+    Joins a worker thread to the run it was started for, a no-op when it isn't being profiled
+    """
+    if run is None:
+        yield
+        return
+    with run.thread(): yield
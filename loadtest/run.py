@@ -0,0 +1,143 @@
+"""
+Load tests the live refresh against a local fake news server, run from the repository root:
+    python -m loadtest.run -r 20 -d 600            # 20 articles / minute per feed for 10 minutes
+    python -m loadtest.run -l 0.5 -e 0.05 -q       # slow, flaky sites, only print the reports
+    python -m loadtest.run --serve -p 8800         # just the server, for TS_BASE_URL=http://127.0.0.1:8800
+"""
+from typing import Any, Dict, List
+from optparse import OptionParser
+from unittest.mock import patch
+import os, sys, json, time, threading
+
+# Load tests never touch the real sentiment cache
+os.environ.setdefault('TS_SENTIMENT_CACHE', ':memory:')
+
+from benchmarks.fake_es import FakeElasticsearch, fake_es
+from loadtest.server import NewsWorld, FINURLS_SITES, serve
+from scrapers.fetching import set_base_url
+from scrapers.mixed import run_source
+from scrapers.scheduler import Scheduler
+from instrumentation.metrics import metrics
+
+
+LOADTEST_SOURCES = ['cnbc', 'reuters', 'ap', 'pr_newswire', 'finurls']
+
+
+class Arrivals():
+    """
+    Publish to index lag of every document written for an article published during the run
+    """
+    def __init__(self, since: float) -> None:
+        self.since = since
+        self.lags: List[float] = []
+        self.documents = 0
+        self.lock = threading.Lock()
+
+    def record(self, body: Dict[str, Any]):
+        with self.lock:
+            self.documents += 1
+            if body.get('timestamp') is not None and body['timestamp'] >= int(self.since): self.lags.append(time.time() - body['timestamp'])
+
+    def percentiles(self) -> Dict[str, float]:
+        with self.lock: lags = sorted(self.lags)
+        if len(lags) == 0: return { 'p50': None, 'p95': None, 'max': None }
+        return { 'p50': round(lags[len(lags) // 2], 2), 'p95': round(lags[int(len(lags) * 0.95)], 2), 'max': round(lags[-1], 2) }
+
+_arrivals: Arrivals = None
+
+class TimedElasticsearch(FakeElasticsearch):
+    def index(self, index: str, body: Dict[str, Any], **kwargs):
+        super().index(index, body, **kwargs)
+        _arrivals.record(body)
+
+
+def feeds_for(sources: List[str]) -> List[str]:
+    return [feed for source in sources for feed in (FINURLS_SITES if source == 'finurls' else [source])]
+
+def refresh(sources: List[str]):
+    """
+    One live refresh round, every source in its own thread like mixed.check_sources
+    """
+    threads = [threading.Thread(target=run_source, args=[source, 'recent'], name=source) for source in sources]
+    for th in threads: th.start()
+    for th in threads: th.join()
+
+def summarize(world: NewsWorld, scheduler: Scheduler, start: float) -> Dict[str, Any]:
+    elapsed = time.time() - start
+    coverage = world.coverage(start)
+    published, fetched = sum([c['published'] for c in coverage.values()]), sum([c['fetched'] for c in coverage.values()])
+    pipeline_fetched = sum([counters.get('pipeline_fetched_total', 0) for counters in metrics().snapshot().values()])
+    return {
+        'elapsed': round(elapsed, 1),
+        'published': published,
+        'fetched': fetched,
+        'published_per_sec': round(published / elapsed, 2),
+        'fetched_per_sec': round(fetched / elapsed, 2),
+        'pipeline_fetched_per_sec': round(pipeline_fetched / elapsed, 2), # includes the backlog
+        'documents': _arrivals.documents,
+        'index_lag': _arrivals.percentiles(),
+        'server': dict(world.counts),
+        'refresh': { key: value for key, value in scheduler.status()['refresh'].items() if key in ['runs', 'skipped', 'last_duration'] },
+        'sources': coverage,
+    }
+
+def report(world: NewsWorld, scheduler: Scheduler, start: float):
+    s = summarize(world, scheduler, start)
+    print(
+        f'loadtest | {s["elapsed"]:>7.1f}s | published {s["published"]} ({s["published_per_sec"]}/s) | fetched {s["fetched"]} ({s["fetched_per_sec"]}/s) '
+        f'| docs {s["documents"]} | index lag p50 {s["index_lag"]["p50"]}s p95 {s["index_lag"]["p95"]}s '
+        f'| server errors {s["server"]["errors"]} | refresh runs {s["refresh"]["runs"]} skipped {s["refresh"]["skipped"]}',
+        file=sys.__stdout__
+    )
+
+def main():
+    global _arrivals
+    parser = OptionParser()
+    parser.add_option('-s', '--sources', dest='sources', help='Comma separated sources', metavar='STR', default=','.join(LOADTEST_SOURCES))
+    parser.add_option('-r', '--rate', dest='rate', help='Articles published per minute by each feed', type='float', default=2)
+    parser.add_option('-l', '--latency', dest='latency', help='Mean response latency in seconds', type='float', default=0.05)
+    parser.add_option('-e', '--errors', dest='errors', help='Fraction of requests failing with a 503', type='float', default=0)
+    parser.add_option('-b', '--backlog', dest='backlog', help='Minutes of articles already published at start', type='float', default=60)
+    parser.add_option('-d', '--duration', dest='duration', help='Seconds to run for', type='float', default=300)
+    parser.add_option('-i', '--interval', dest='interval', help='Seconds between refreshes', type='float', default=60)
+    parser.add_option('--report', dest='report', help='Seconds between reports', type='float', default=10)
+    parser.add_option('-o', '--output', dest='output', help='Write the final summary as json to this path', metavar='PATH', default=None)
+    parser.add_option('-q', '--quiet', dest='quiet', help='Silence scraper output', action='store_true', default=False)
+    parser.add_option('-p', '--port', dest='port', help='Server port', type='int', default=0)
+    parser.add_option('--serve', dest='serve', help='Only run the server', action='store_true', default=False)
+    (options, _) = parser.parse_args()
+
+    sources = options.sources.split(',')
+    unknown = [source for source in sources if source not in LOADTEST_SOURCES]
+    if len(unknown) > 0: raise Exception(f'Sources without a fake: {", ".join(unknown)}')
+
+    world = NewsWorld(options.rate, options.latency, options.errors, options.backlog * 60, feeds_for(sources))
+    _, base_url = serve(world, options.port)
+    if options.serve:
+        print(f'loadtest | serving until interrupted, run the scrapers with TS_BASE_URL={base_url}')
+        threading.Event().wait()
+
+    set_base_url(base_url)
+    if options.quiet: sys.stdout = open(os.devnull, 'w')
+
+    # Scraper state is kept in memory so runs start from scratch and leave scrapers/fetched alone
+    states: Dict[str, Dict[str, Any]] = {}
+    start = time.time()
+    _arrivals = Arrivals(start)
+    scheduler = Scheduler()
+    scheduler.every(options.interval, 'refresh', refresh, sources)
+    scheduler.every(options.report, 'report', report, world, scheduler, start, run_now=False)
+    threading.Timer(options.duration, scheduler.stop).start()
+
+    with patch('scrapers.mixed.get_state', lambda source: states.setdefault(source, {})), patch('scrapers.mixed.save_state', lambda source, state: None):
+        with fake_es(TimedElasticsearch):
+            scheduler.run()
+            # Let the round in flight finish while the fakes are still in place
+            while scheduler.status()['refresh']['running']: time.sleep(0.5)
+
+    summary = summarize(world, scheduler, start)
+    print(json.dumps(summary, indent=4), file=sys.__stdout__)
+    if options.output is not None:
+        with open(options.output, 'w') as f: f.write(json.dumps(summary, indent=4))
+
+if __name__ == '__main__': main()
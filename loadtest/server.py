@@ -0,0 +1,230 @@
+from typing import Dict, List, Tuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import datetime as dt, threading, calendar, random, math, time, json, re, os
+
+
+TEMPLATES = os.path.join(os.path.dirname(__file__), '..', 'benchmarks', 'fixtures', 'articles')
+
+# Source -> the host its pages live on, finurls sites are listed by the finurls api
+HOSTS = {
+    'cnbc': 'www.cnbc.com',
+    'reuters': 'www.reuters.com',
+    'ap': 'apnews.com',
+    'pr_newswire': 'www.prnewswire.com',
+    'yahoo': 'finance.yahoo.com',
+    'forbes': 'www.forbes.com',
+    'themotleyfool': 'www.fool.com',
+}
+FINURLS_SITES = ['yahoo', 'forbes', 'themotleyfool']
+PR_NEWSWIRE_PAGE_SIZE = 100
+FINURLS_PAGE_SIZE = 30
+
+LEADS = ['Shares moved in early trading', 'Analysts revised their outlook', 'The company issued new guidance',
+         'Volume picked up into the close', 'Investors weighed the latest data', 'The board approved a buyback']
+
+
+class Feed():
+    """
+    The articles of one source, article i is published at [origin] + i / rate. [backlog] seconds
+    worth of articles are already published when the feed starts.
+    """
+    def __init__(self, source: str, per_minute: float, start: float, backlog: float) -> None:
+        self.source = source
+        self.interval = 60 / per_minute
+        self.origin = start - backlog
+
+    def published_at(self, i: int) -> float:
+        return self.origin + i * self.interval
+
+    def published(self, since: float, until: float) -> range:
+        """
+        Indices of the articles published in [since, until), capped at now
+        """
+        until = min(until, time.time())
+        first = max(0, math.ceil((since - self.origin) / self.interval))
+        return range(first, max(first, math.ceil((until - self.origin) / self.interval)))
+
+    def latest(self) -> int:
+        return int((time.time() - self.origin) // self.interval)
+
+    def url(self, i: int) -> str:
+        host = HOSTS[self.source]
+        day = dt.datetime.fromtimestamp(self.published_at(i), dt.timezone.utc)
+        if self.source == 'cnbc': return f'https://{host}/{day:%Y/%m/%d}/markets-update-{i}.html'
+        if self.source == 'reuters': return f'https://{host}/business/markets-update-idUSKBN{i}'
+        if self.source == 'ap': return f'https://{host}/press-release/pr-newswire/markets-update-{i}'
+        if self.source == 'pr_newswire': return f'https://{host}/news-releases/markets-update-{i}.html'
+        return f'https://{host}/news/markets-update-{i}.html'
+
+
+class NewsWorld():
+    """
+    Generated sitemaps + article pages for each source, following the real sites' url schemes and
+    page structure (article pages are the benchmark fixtures with a fresh timestamp, shuffled
+    paragraphs and a unique lead so scoring isn't all cache hits). Every response is delayed by
+    up to 2x [latency] seconds and a [error_rate] fraction fail with a 503.
+    """
+    def __init__(self, per_minute: float = 2, latency: float = 0.05, error_rate: float = 0, backlog: float = 3600, sources: List[str] = None) -> None:
+        self.start = time.time()
+        self.feeds = { source: Feed(source, per_minute, self.start, backlog) for source in (sources if sources is not None else HOSTS) }
+        self.latency = latency
+        self.error_rate = error_rate
+        self.templates: Dict[str, str] = {}
+        for source in self.feeds:
+            with open(os.path.join(TEMPLATES, f'{source}.html'), 'r') as f: self.templates[source] = f.read()
+
+        # First time each article page was served, for coverage + publish to fetch lag
+        self.served: Dict[Tuple[str, int], float] = {}
+        self.counts = { 'requests': 0, 'errors': 0, 'not_found': 0 }
+        self.lock = threading.Lock()
+
+    def _count(self, key: str):
+        with self.lock: self.counts[key] += 1
+
+    def _day(self, y: int, m: int, d: int) -> Tuple[float, float]:
+        start = dt.datetime(y, m, d, tzinfo=dt.timezone.utc).timestamp()
+        return start, start + 24 * 60 * 60
+
+    def _urlset(self, feed: Feed, indices: List[int]) -> str:
+        urls = ''.join([f'<url><loc>{feed.url(i)}</loc><lastmod>{dt.datetime.fromtimestamp(int(feed.published_at(i)), dt.timezone.utc):%Y-%m-%dT%H:%M:%S+00:00}</lastmod></url>' for i in indices])
+        return f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>'
+
+    def article(self, source: str, i: int) -> str:
+        feed = self.feeds[source]
+        rng = random.Random(f'{source}-{i}')
+        published = dt.datetime.fromtimestamp(int(feed.published_at(i)), dt.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        html = re.sub(r'(published_time|og:pubdate)" content="[^"]*"', lambda m: f'{m.group(1)}" content="{published}"', self.templates[source])
+
+        paragraphs = re.findall(r'<p>.*?</p>', html, re.S)
+        rng.shuffle(paragraphs)
+        shuffled = iter(paragraphs)
+        html = re.sub(r'<p>.*?</p>', lambda _: next(shuffled), html, flags=re.S)
+        return html.replace('<p>', f'<p>{rng.choice(LEADS)} on story {i}. ', 1)
+
+    def get(self, path: str, form: Dict[str, str] = None) -> Tuple[int, str, str]:
+        """
+        (status, content type, body) for a request to /{host}/{path as on the real site}
+        """
+        parts = urlsplit(path)
+        host, _, rest = parts.path.lstrip('/').partition('/')
+        query = { k: v[0] for k, v in parse_qs(parts.query).items() }
+        sources = { h: s for s, h in HOSTS.items() if s in self.feeds }
+
+        if host == 'finurls.com' and rest == 'api/get_titles': return self._finurls(form if form is not None else query)
+        if host not in sources: return 404, 'text/plain', 'unknown host'
+        source = sources[host]
+        feed = self.feeds[source]
+
+        if source == 'cnbc' and rest.startswith('site-map/articles/'):
+            y, month, d = rest[len('site-map/articles/'):].strip('/').split('/')
+            since, until = self._day(int(y), list(calendar.month_name).index(month), int(d))
+            links = ''.join([f'<li><a class="SiteMapArticleList-link" href="{feed.url(i)}">Story {i}</a></li>' for i in feed.published(since, until)])
+            return 200, 'text/html', f'<html><body><ul class="SiteMapArticleList-list">{links}</ul></body></html>'
+
+        if source == 'reuters' and rest.startswith('sitemap_'):
+            # Lists the articles published on the span's end date
+            end = rest[len('sitemap_'):-len('.xml')].split('-')[1]
+            since, until = self._day(int(end[:4]), int(end[4:6]), int(end[6:]))
+            return 200, 'application/xml', self._urlset(feed, list(feed.published(since, until)))
+
+        if source == 'ap' and rest.startswith('sitemap/sitemap_'):
+            # Only the first of the minute variants ap discovery tries exists
+            stamp = rest[len('sitemap/sitemap_'):-len('.xml')]
+            if not stamp.endswith('T05:00:00+00:00'): return 404, 'text/plain', 'no such sitemap'
+            y, m, d = stamp[:10].split('-')
+            return 200, 'application/xml', self._urlset(feed, list(feed.published(*self._day(int(y), int(m), int(d)))))
+
+        if source == 'pr_newswire' and rest == 'sitemap-main-news.xml':
+            # Newest first
+            newest = feed.latest() - (int(query.get('page', 1)) - 1) * PR_NEWSWIRE_PAGE_SIZE
+            return 200, 'application/xml', self._urlset(feed, list(range(newest, max(newest - PR_NEWSWIRE_PAGE_SIZE, -1), -1)))
+
+        match = re.search(r'markets-update-(?:idUSKBN)?(\d+)(?:\.html)?$', rest)
+        if match is None or int(match.group(1)) > feed.latest(): return 404, 'text/plain', 'no such article'
+        i = int(match.group(1))
+        with self.lock: self.served.setdefault((source, i), time.time())
+        return 200, 'text/html', self.article(source, i)
+
+    def _finurls(self, form: Dict[str, str]) -> Tuple[int, str, str]:
+        site = form.get('site')
+        if site not in self.feeds: return 200, 'application/json', json.dumps({ 'status': 'error', 'data': [] })
+        feed = self.feeds[site]
+
+        # Entry ids are the feed indices, load_more pages continue below last_id
+        newest = int(form['last_id']) - 1 if 'last_id' in form else feed.latest()
+        entries = []
+        for i in range(newest, max(newest - FINURLS_PAGE_SIZE, -1), -1):
+            published = dt.datetime.fromtimestamp(int(feed.published_at(i)), dt.timezone.utc)
+            date = f'{published:%Y-%m-%d %H:%M:%S}{"AM" if published.hour < 12 else "PM"} UTC'
+            entries.append({ 'id': i, 'title': f'Story {i}', 'url': feed.url(i), 'comment_url': None, 'ago': '', 'date': date })
+        return 200, 'application/json', json.dumps({ 'status': 'success', 'data': entries })
+
+    def respond(self, path: str, form: Dict[str, str] = None) -> Tuple[int, str, str]:
+        """
+        get() with the configured latency + error injection applied
+        """
+        self._count('requests')
+        if self.latency > 0: time.sleep(random.uniform(0, 2 * self.latency))
+        if random.random() < self.error_rate:
+            self._count('errors')
+            return 503, 'text/plain', 'injected error'
+
+        # Periods past the end of a month (which the scrapers do list) don't exist
+        try: status, content_type, body = self.get(path, form)
+        except ValueError: status, content_type, body = 404, 'text/plain', 'no such period'
+        if status == 404: self._count('not_found')
+        return status, content_type, body
+
+    def coverage(self, since: float) -> Dict[str, Dict[str, float]]:
+        """
+        source -> articles published since [since], # fetched and publish to first fetch lag
+        """
+        report: Dict[str, Dict[str, float]] = {}
+        with self.lock: served = dict(self.served)
+        for source, feed in self.feeds.items():
+            published = feed.published(since, time.time())
+            lags = sorted([served[(source, i)] - feed.published_at(i) for i in published if (source, i) in served])
+            report[source] = {
+                'published': len(published),
+                'fetched': len(lags),
+                'fetch_lag_p50': round(lags[len(lags) // 2], 2) if len(lags) > 0 else None,
+                'fetch_lag_max': round(lags[-1], 2) if len(lags) > 0 else None,
+            }
+        return report
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def _send(self, status: int, content_type: str, body: str):
+        data = body.encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._send(*self.server.world.respond(self.path))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = { k: v[0] for k, v in parse_qs(self.rfile.read(length).decode('utf8')).items() }
+        self._send(*self.server.world.respond(self.path, form))
+
+    def log_message(self, format, *args): pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256 # every source's fetch workers connect at once
+
+def serve(world: NewsWorld, port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    Serves the world from a background thread, returns the server + its base url
+    """
+    server = _Server(('127.0.0.1', port), _Handler)
+    server.world = world
+    threading.Thread(target=server.serve_forever, name='loadtest-server', daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    print(f'loadtest | fake news server on {base_url}')
+    return server, base_url
@@ -1,11 +1,20 @@
-import threading, sys
+import sys, threading
 from typing import Callable, List, Tuple
-from optparse import OptionParser
+from optparse import OptionParser, Values
 
 from config.models import Analysis
 from scrapers import analyze_wsb, analyze_mixed, analyze_hn
 from scrapers import monitor_mixed, monitor_wsb, monitor_hn, monitor_twitter, analyze_twitter
-from data.es import add_analyses, reset, _initialize
+from scrapers.scheduler import Scheduler
+from scrapers.mixed import SOURCES as MIXED_SOURCES
+from scrapers.backfill import backfill, run_worker, BACKFILL_SOURCES
+from instrumentation.metrics import serve as serve_metrics, write_snapshot, METRICS_PORT
+from instrumentation.profiling import enable as enable_profiling, PROFILE_SOURCES
+from data.es import add_analyses, add_listener, reset, _initialize
+from data.spikes import detector
+from data.analysis import run as run_analysis, ANALYSIS_DIR
+from data.export import export, EXPORT_DIR
+from data.server import serve as serve_api
 
 
 
@@ -20,33 +29,58 @@ def start_historical_analysis(services: List[Callable]):
 
 def start_live_analysis(services: List[Callable]):
     """
-    Starts live article monitoring for each of the provided services
+    Starts live article monitoring for each of the provided services, all driven by one scheduler
     """
     
     refresh_frequency = 300
-    for service in services:
-        threading.Thread(target=service, args=[refresh_frequency]).start()
+    scheduler = Scheduler()
+    add_listener(detector().observe)
+    for service in services: service(refresh_frequency, scheduler)
 
+    if METRICS_PORT is not None: serve_metrics()
+    scheduler.every(60, 'metrics', write_snapshot, run_now=False)
+    scheduler.run()
 
 
-def initialize() -> Tuple[str, bool]:
+
+def initialize() -> Tuple[str, bool, Values]:
     """
-    Returns tuple indicating [run mode, reset es data]
+    Returns tuple indicating [run mode, reset es data, all options]
     """
     _initialize()
 
     parser = OptionParser()
-    parser.add_option("-m", "--mode", dest="mode", help="", metavar="STR", default="live")
-    parser.add_argument('-r', '--reset', help='Reset ElasticSearch Data', action='store_true')
+    parser.add_option("-m", "--mode", dest="mode", help="live | historical | backfill | worker | analysis | export | api", metavar="STR", default="live")
+    parser.add_option('-r', '--reset', dest='reset', help='Reset ElasticSearch Data', action='store_true', default=False)
+    parser.add_option('-w', '--workers', dest='workers', help='Backfill worker processes', type='int', default=4)
+    parser.add_option('-s', '--sources', dest='sources', help='Comma separated backfill sources', metavar="STR", default=','.join(BACKFILL_SOURCES))
+    parser.add_option('-p', '--profile', dest='profile', help='Comma separated sources to profile (or all)', metavar="STR", default='')
+    parser.add_option('--since', dest='since', help='Analysis / export start date (YYYY-MM-DD), default 90 days ago / incremental', metavar="DATE", default=None)
+    parser.add_option('--until', dest='until', help='Analysis / export end date (YYYY-MM-DD), default now', metavar="DATE", default=None)
+    parser.add_option('--freq', dest='freq', help='Analysis period length (pandas frequency)', metavar="STR", default='1D')
+    parser.add_option('--window', dest='window', help='Analysis rolling window in periods', type='int', default=7)
+    parser.add_option('--format', dest='format', help='Analysis output format: csv | parquet', metavar="STR", default='csv')
+    parser.add_option('-o', '--output', dest='output', help=f'Analysis / export output directory, default {ANALYSIS_DIR} / {EXPORT_DIR}', metavar="DIR", default=None)
+    parser.add_option('-i', '--input', dest='input', help='Analyze a parquet export instead of elasticsearch', metavar="DIR", default=None)
+    parser.add_option('--by-source', dest='by_source', help='Partition the export by source as well as date', action='store_true', default=False)
     (options, _) = parser.parse_args()
-    return options.mode, options.reset
+    if options.profile != '': enable_profiling(options.profile.split(','))
+    profilable = [*MIXED_SOURCES, 'hacker_news', 'wsb', 'twitter', 'all']
+    unknown = sorted([source for source in PROFILE_SOURCES if source not in profilable])
+    if len(unknown) > 0: parser.error(f'cannot profile {", ".join(unknown)}, sources are: {", ".join(profilable)}')
+    return options.mode, options.reset, options
 
-mode, reset_es = initialize()
+mode, reset_es, options = initialize()
 print(f'\n\n\nStarting News Fetch Analsis | Mode: {mode} | Reset: {reset_es}\n')
 
 if reset_es: reset()
 
-if mode == 'analysis': print('Analysis Mode Not Yet Implemented')
+if mode == 'analysis': run_analysis(options.since, options.until, options.freq, options.window, options.output or ANALYSIS_DIR, options.format, input=options.input)
+elif mode == 'export': export(options.since, options.until, options.output or EXPORT_DIR, options.by_source)
+elif mode == 'api':
+    serve_api()
+    if METRICS_PORT is not None: serve_metrics()
+    threading.Event().wait()
 elif mode == 'historical':
     start_historical_analysis(
         services=[
@@ -56,6 +90,8 @@ elif mode == 'historical':
             # analyze_twitter,
         ]
     )
+elif mode == 'backfill': backfill(options.sources.split(','), options.workers)
+elif mode == 'worker': run_worker() # joins an existing backfill queue, e.g. from another machine
 elif mode == 'live':
     start_live_analysis(
         services=[
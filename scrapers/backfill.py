@@ -0,0 +1,104 @@
+from typing import Callable, Dict, List, Tuple
+import multiprocessing, threading, socket, time, os
+
+from scrapers.workqueue import WorkQueue, WorkUnit, QUEUE_PATH, LEASE_SECONDS
+from scrapers.pipeline import Source, EDIT_WINDOW
+from scrapers.mixed import (
+    get_state, run_pipeline, run_periods, CNBC, AP, REUTERS, CNN, _monthly_period_end,
+    _bloomberg_periods, _bloomberg_process_period, _seeking_alpha_periods, _seeking_alpha_process_period
+)
+
+
+def _completing(source: str, process: Callable[[str], None], closed: Callable[[str], bool]) -> Callable[[str], None]:
+    """
+    Raises when a closed period wasn't recorded complete, so its work unit is failed + retried instead
+    of marked done. Open periods can't be completed yet, live mode picks those up.
+    """
+    def run(period: str):
+        process(period)
+        if closed(period) and period not in get_state(source).get('completed_periods', []): raise Exception(f'{source} {period} was not completed')
+    return run
+
+def _pipelined(source: Source) -> Callable[[str], None]:
+    return _completing(source.name, lambda period: run_pipeline(source, 'all', [period]), source.closed)
+
+def _stateful(source: str, process_period: Callable) -> Callable[[str], None]:
+    return _completing(
+        source,
+        lambda period: run_periods(source, get_state(source), [period], process_period, _monthly_period_end),
+        lambda period: time.time() > _monthly_period_end(period) + EDIT_WINDOW
+    )
+
+# Historical sources split into sitemap periods: name -> (list periods for a mode, process a single period)
+BACKFILL_SOURCES: Dict[str, Tuple[Callable[[str], List[str]], Callable[[str], None]]] = {
+    'cnbc': (CNBC.periods, _pipelined(CNBC)),
+    'ap': (AP.periods, _pipelined(AP)),
+    'reuters': (REUTERS.periods, _pipelined(REUTERS)),
+    'cnn': (CNN.periods, _pipelined(CNN)),
+    'bloomberg': (_bloomberg_periods, _stateful('bloomberg', _bloomberg_process_period)),
+    'seeking_alpha': (_seeking_alpha_periods, _stateful('seeking_alpha', _seeking_alpha_process_period)),
+}
+
+
+def enqueue(sources: List[str], queue_path: str = QUEUE_PATH) -> Dict[str, int]:
+    """
+    Turns each source's historical periods into work units, periods already marked complete are left out
+    """
+    queue = WorkQueue(queue_path)
+    for source in sources:
+        if source not in BACKFILL_SOURCES: raise Exception(f'Unknown backfill source requested: {source}')
+        periods, _ = BACKFILL_SOURCES[source]
+        completed = set(get_state(source).get('completed_periods', []))
+        print(f'backfill | {source}: {queue.enqueue(source, [p for p in periods("all") if p not in completed])} new work units')
+    return queue.counts()
+
+
+def run_worker(queue_path: str = QUEUE_PATH, lease_seconds: float = LEASE_SECONDS, idle_wait: float = 30):
+    """
+    Claims and processes work units until none are pending or leased. Safe to run any number
+    of these, in any number of processes, against the same queue.
+    """
+    queue = WorkQueue(queue_path)
+    owner = f'{socket.gethostname()}:{os.getpid()}'
+    print(f'backfill | worker {owner} starting')
+
+    while True:
+        unit = queue.claim(owner, lease_seconds)
+        if unit is None:
+            if not queue.active(): break
+            time.sleep(idle_wait) # other workers hold the remaining leases, they'll be reclaimable if they expire
+            continue
+
+        # Keep the lease alive while the period is processed
+        finished = threading.Event()
+        def heartbeat(unit: WorkUnit = unit):
+            while not finished.wait(lease_seconds / 3):
+                if not queue.heartbeat(unit, owner, lease_seconds): print(f'backfill | {owner} lost lease on {unit.source} {unit.period}')
+
+        th = threading.Thread(target=heartbeat, daemon=True)
+        th.start()
+        start = time.time()
+        try:
+            _, process = BACKFILL_SOURCES[unit.source]
+            process(unit.period)
+            queue.complete(unit, owner)
+            print(f'backfill | {unit.source} {unit.period} complete | took {(time.time() - start):.2f} seconds')
+        except Exception as e:
+            print(f'backfill | {unit.source} {unit.period} failed (attempt {unit.attempts}):', e)
+            queue.fail(unit, owner, repr(e))
+        finally:
+            finished.set()
+            th.join()
+
+    print(f'backfill | worker {owner} finished')
+
+
+def backfill(sources: List[str], workers: int = 4, queue_path: str = QUEUE_PATH):
+    """
+    Enqueues the sources' historical periods and works through them with [workers] local processes
+    """
+    print('backfill | queue:', enqueue(sources, queue_path))
+    processes = [multiprocessing.Process(target=run_worker, args=[queue_path]) for _ in range(workers)]
+    for p in processes: p.start()
+    for p in processes: p.join()
+    print('backfill | complete:', WorkQueue(queue_path).counts())
@@ -0,0 +1,130 @@
+from typing import Any, Dict, NamedTuple, Optional
+from collections import OrderedDict
+import sqlite3, hashlib, json, threading, unicodedata, time, os
+from nltk.sentiment.vader import SentimentIntensityAnalyzer
+
+
+CACHE_PATH = os.environ.get('TS_SENTIMENT_CACHE', 'scrapers/fetched/sentiment_cache.db')
+MEMORY_ENTRIES = 50000
+MAX_ROWS = 2000000              # rows kept on disk, the least recently stored are pruned beyond this
+MAX_AGE = 90 * 24 * 60 * 60     # rows not stored for this long are pruned
+PRUNE_EVERY = 10000             # puts between prunes
+BUSY_TIMEOUT = 10000            # ms to wait on other processes' (e.g. the wsb scoring pool's) write locks
+
+
+class CachedSentiment(NamedTuple):
+    compound: Optional[float]           # Compound rating of the full text, if it has been scored
+    symbols: Optional[Dict[str, Any]]   # Symbol ratings extracted from the text, if any
+
+
+def content_key(text: str) -> str:
+    """
+    VADER tokenises on whitespace, so collapsing it doesn't change the score but
+    lets re-crawled or syndicated copies of a body share a key
+    """
+    normalised = ' '.join(unicodedata.normalize('NFC', text).split())
+    return hashlib.blake2b(normalised.encode('utf8'), digest_size=16).hexdigest()
+
+
+class SentimentCache():
+    """
+    Content addressed sentiment results, an LRU memory tier in front of an sqlite store that's
+    pruned by age + row count
+    """
+    def __init__(self, path: str = CACHE_PATH, memory_entries: int = MEMORY_ENTRIES) -> None:
+        self.memory: OrderedDict = OrderedDict()
+        self.memory_entries = memory_entries
+        self.lock = threading.Lock()
+
+        self.puts = 0
+
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=BUSY_TIMEOUT / 1000)
+        self.db.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT}')
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS sentiment (key TEXT PRIMARY KEY, compound REAL, symbols TEXT, stored INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS sentiment_stored ON sentiment (stored)')
+
+    def _remember(self, key: str, entry: CachedSentiment):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.memory_entries: self.memory.popitem(last=False)
+
+    def get(self, text: str) -> Optional[CachedSentiment]:
+        key = content_key(text)
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+
+            entry = self._read(key)
+            if entry is not None: self._remember(key, entry)
+            return entry
+
+    def _read(self, key: str) -> Optional[CachedSentiment]:
+        row = self.db.execute('SELECT compound, symbols FROM sentiment WHERE key = ?', (key,)).fetchone()
+        return CachedSentiment(row[0], json.loads(row[1]) if row[1] is not None else None) if row is not None else None
+
+    def put(self, text: str, compound: float = None, symbols: Dict[str, Any] = None):
+        """
+        Stores results for the text, keeping any previously stored field that isn't provided
+        """
+        key = content_key(text)
+        with self.lock:
+            self.db.execute(
+                'INSERT INTO sentiment (key, compound, symbols, stored) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET compound = COALESCE(excluded.compound, compound), symbols = COALESCE(excluded.symbols, symbols), stored = excluded.stored',
+                (key, compound, json.dumps(symbols) if symbols is not None else None, int(time.time()))
+            )
+
+            # The merged entry goes into the memory tier, the disk row is only read when it may hold a field not given here
+            previous = self.memory.get(key)
+            if previous is None and (compound is None or symbols is None): previous = self._read(key)
+            if previous is None: previous = CachedSentiment(None, None)
+            self._remember(key, CachedSentiment(compound if compound is not None else previous.compound, symbols if symbols is not None else previous.symbols))
+
+            self.puts += 1
+            if self.puts % PRUNE_EVERY == 0: self._prune()
+
+    def _prune(self, max_rows: int = MAX_ROWS, max_age: float = MAX_AGE):
+        """
+        Drops rows not stored for [max_age] and the least recently stored beyond [max_rows]
+        """
+        self.db.execute('DELETE FROM sentiment WHERE stored < ?', (int(time.time() - max_age),))
+        excess = self.db.execute('SELECT COUNT(*) FROM sentiment').fetchone()[0] - max_rows
+        if excess > 0: self.db.execute('DELETE FROM sentiment WHERE key IN (SELECT key FROM sentiment ORDER BY stored LIMIT ?)', (excess,))
+
+
+
+_sentiment_cache: SentimentCache = None
+_sentiment_cache_lock = threading.Lock()
+
+def sentiment_cache() -> SentimentCache:
+    """
+    Returns the process-wide sentiment cache, opening it on first use
+    """
+    global _sentiment_cache
+    if _sentiment_cache is None:
+        with _sentiment_cache_lock:
+            if _sentiment_cache is None: _sentiment_cache = SentimentCache()
+    return _sentiment_cache
+
+def _reset_after_fork():
+    # sqlite connections can't be shared with forked workers, they open their own on first use
+    global _sentiment_cache, _sentiment_cache_lock
+    _sentiment_cache, _sentiment_cache_lock = None, threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def polarity(vader: SentimentIntensityAnalyzer, text: str) -> float:
+    """
+    Compound rating of the text, only running vader on cache misses
+    """
+    cache = sentiment_cache()
+    cached = cache.get(text)
+    if cached is not None and cached.compound is not None: return cached.compound
+
+    compound = vader.polarity_scores(text)['compound']
+    cache.put(text, compound)
+    return compound
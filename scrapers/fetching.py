@@ -1,4 +1,4 @@
-import time, requests, re, fake_useragent as fu
+import time, requests, re, os, fake_useragent as fu
 from typing import Tuple, Union
 from bs4 import BeautifulSoup
 from selenium import webdriver
@@ -8,6 +8,22 @@ from selenium.webdriver.support.expected_conditions import presence_of_element_l
 from selenium.webdriver.support.select import By
 from dotenv import load_dotenv, dotenv_values
 
+# Routes source requests to a stand-in server instead of the real sites (see loadtest/), e.g. http://127.0.0.1:8800
+BASE_URL = os.environ.get('TS_BASE_URL')
+
+def set_base_url(url: str):
+    global BASE_URL
+    BASE_URL = url
+
+def rebase(url: str) -> str:
+    """
+    https://www.cnbc.com/a/b -> {BASE_URL}/www.cnbc.com/a/b when a base url override is set
+    """
+    if BASE_URL is None or url.startswith(BASE_URL): return url
+    return re.sub(r'^https?://', f'{BASE_URL.rstrip("/")}/', url)
+
+
+
 # Source-Specific Support
 def _seeking_alpha(bs: BeautifulSoup):
     try:
@@ -94,7 +110,7 @@ def fetch_article(url: str, source: str, parser: str = 'lxml') -> Union[str, Bea
         browser = webdriver.Chrome(executable_path="/usr/local/bin/chromedriver", options=opts)
         # browser = webdriver.Safari()
         browser.delete_all_cookies()
-        browser.get(url)
+        browser.get(rebase(url))
 
         try: browser_wait(browser, source)
         except Exception as e:
@@ -111,7 +127,7 @@ def fetch_article(url: str, source: str, parser: str = 'lxml') -> Union[str, Bea
         soup = BeautifulSoup(browser.page_source, parser)
         browser.close()
     else:
-        res = requests.get(url).text
+        res = requests.get(rebase(url)).text
         soup = BeautifulSoup(res, parser)
 
     if source == 'seeking_alpha' and False:
@@ -1,46 +1,56 @@
-from typing import Any, Dict, List, NamedTuple
-import requests, numpy as np, json, time, threading, asyncio
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import requests, numpy as np, json, threading, time, os
 from nltk.sentiment.vader import SentimentIntensityAnalyzer
 
-from config.symbols import enhanced_symbols
+from scrapers.matching import company_trie
+from scrapers.cache import polarity
+from scrapers.scheduler import Scheduler
+from instrumentation.profiling import profiled, source_run
 from config.models import Analysis, SentimentContext, HN_Item, HN_Post
 from data.es import add_analyses
 
 
 # Based on documentation found @ https://github.com/HackerNews/API
-top_stories_url = 'https://hacker-news.firebaseio.com/v0/topstories.json?print=pretty'
+new_stories_url = 'https://hacker-news.firebaseio.com/v0/newstories.json'
+updates_url = 'https://hacker-news.firebaseio.com/v0/updates.json'
+MAX_COMMENT_DEPTH = 8       # reply levels followed below a story
+MAX_COMMENTS = 500          # comments assembled per story
+FETCH_CONCURRENCY = int(os.environ.get('TS_HN_CONCURRENCY', 32))   # item requests in flight at once
+FETCH_WINDOW = 512          # items requested ahead of the one being consumed
+LIVE_WINDOW = 2 * 24 * 60 * 60  # seconds after posting a story's new comments are followed
+LIVE_NEW_STORIES = 100          # newest stories considered each live cycle
 
 
 
 # Utils
 def item_url(id: str): return f'https://hacker-news.firebaseio.com/v0/item/{id}.json?print=pretty'
 
-def is_subset(parent: list, child: list) -> bool:
-    for i in range(len(parent) - len(child)):
-        if parent[i:i+len(child)] == child:
-            return True
-    return False
-
 
 def get_state() -> Dict[str, Any]:
     with open('scrapers/fetched/hn.json', 'r') as f:
         try: state = json.loads(f.read())
         except: state = {}
 
-    if 'fetched' not in state: state['fetched'] = {}
+    # Story id -> comment ids, json stores the ids as strings
+    state['fetched'] = { int(story_id): comments for story_id, comments in state.get('fetched', {}).items() }
+    # Relevant stories followed by live mode: story id -> { time, symbols, sentiment sum + count, comment ids }
+    state['live'] = { int(story_id): story for story_id, story in state.get('live', {}).items() }
+    # Every story live mode has checked (relevant or not) -> posting time, kept for LIVE_WINDOW
+    state['seen'] = { int(story_id): posted for story_id, posted in state.get('seen', {}).items() }
     if 'last_analyzed_post_id' not in state: state['last_analyzed_post_id'] = -1
     return state
 
-def update_state(post: HN_Post):
-    state = get_state()
-    state['last_analyzed_post_id'] = post.story.id
-    state['fetched'][post.story.id] = [c.id for c in post.comments]
-
-    # Update visited ids with newly analyzed post
+def save_state(state: Dict[str, Any]):
     with open('scrapers/fetched/hn.json', 'w') as f:
         try: f.write(json.dumps(state, indent=4))
         except Exception as e: print('Error updating hackernews state')
 
+def update_state(state: Dict[str, Any], post: HN_Post):
+    state['last_analyzed_post_id'] = post.story.id
+    state['fetched'][post.story.id] = [c.id for c in post.comments]
+
 
 def last_valid_id() -> int:
     try:
@@ -53,182 +63,255 @@ def last_valid_id() -> int:
 
 
 
-async def analyze_comments_for_post(post: HN_Post):
-    symbol_data = enhanced_symbols()
-    vader = SentimentIntensityAnalyzer()
+_local = threading.local()
+_pool: ThreadPoolExecutor = None
+_pool_lock = threading.Lock()
 
-    analysis = Analysis()
-    # First we determine if it's a relevant story
-    # If it is, we then perform sentiment analysis on the comments + title
-    title_segments = post.story.title.split(' ') # Removed .lower() to prevent erroneous matches
+def item_pool() -> ThreadPoolExecutor:
+    """
+    Returns the process-wide item fetching pool, sized to the concurrency cap
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None: _pool = ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY, thread_name_prefix='hn-fetch')
+    return _pool
+
+def fetch_item(id: int) -> Optional[HN_Item]:
+    # A session per thread keeps its connection to the api alive between items
+    if not hasattr(_local, 'session'): _local.session = requests.Session()
+    data = _local.session.get(item_url(id)).json()
+    return HN_Item.from_json(data) if data is not None else None
+
+def fetch_items(ids: Iterable[int], window: int = FETCH_WINDOW) -> Iterator[Tuple[int, Optional[HN_Item]]]:
+    """
+    Fetches the ids on the shared pool with up to [window] requests queued ahead of the consumer,
+    yielding (id, item) strictly in the order given. Items that don't exist or fail yield None.
+    The window starts at the concurrency cap and grows by one per consumed item, so a consumer
+    that stops early (and has its queued requests cancelled) wastes at most about as many as it used.
+    """
+    ids = iter(ids)
+    pending: Deque[Tuple[int, Future]] = deque()
+    def submit() -> bool:
+        id = next(ids, None)
+        if id is None: return False
+        pending.append((id, item_pool().submit(fetch_item, id)))
+        return True
+
+    limit = min(window, FETCH_CONCURRENCY)
+    try:
+        while len(pending) < limit and submit(): pass
+        while len(pending) > 0:
+            id, future = pending.popleft()
+            limit = min(window, limit + 1)
+            while len(pending) < limit and submit(): pass
+            try: item = future.result()
+            except Exception as e:
+                print(f'Error fetching hackernews item with id {id}, skipping:', e)
+                item = None
+            yield id, item
+    finally:
+        for _, future in pending: future.cancel()
+
+def story_companies(story: HN_Item) -> List[str]:
+    return company_trie().find(story.title.split(' ')) # Removed .lower() to prevent erroneous matches
+
+def assemble_post(story: HN_Item, max_depth: int = MAX_COMMENT_DEPTH, max_comments: int = MAX_COMMENTS) -> HN_Post:
+    """
+    Fetches the story's comment tree top down through each item's kids, a level at a time so the
+    caps cut off the deepest / latest replies. Comments with ids below their story are included.
+    """
+    return HN_Post(story, assemble_comments(story.kids, max_depth, max_comments))
 
-    contained_companies = [sym for sym, comp in symbol_data.companies.items() if is_subset(title_segments, [c.title() for c in comp.split(' ')])]
-    if len(contained_companies) > 0:
-        # print(f'\t{post.story.title} contains {len(contained_companies)} companies:', contained_companies)
-        
-        title_score = vader.polarity_scores(post.story.title)
-        sentiments = [title_score['compound']]
-        for comment in post.comments:
-            comment_score = vader.polarity_scores(comment.text)
-            sentiments.append(comment_score['compound'])
-        adj_sentiment = np.mean(sentiments) if len(sentiments) > 0 else 0
-        print(f'\thacker_news | sentiment: {adj_sentiment} | symbols: {contained_companies}')
+def assemble_comments(kids: List[int], max_depth: int = MAX_COMMENT_DEPTH, max_comments: int = MAX_COMMENTS) -> List[HN_Item]:
+    """
+    The comments under the given kids, fetched level by level
+    """
+    comments: List[HN_Item] = []
+    level, depth = list(kids), 1
+    while len(level) > 0 and depth <= max_depth and len(comments) < max_comments:
+        next_level: List[int] = []
+        for _, comment in fetch_items(level[:max_comments - len(comments)]):
+            if comment is None: continue
+            if comment.text != '': comments.append(comment) # deleted / dead comments still lead to their replies
+            next_level += comment.kids
+        level, depth = next_level, depth + 1
+    return comments
+
+def unfetched_ranges(top_id: int, fetched: Set[int], mode: str = 'all') -> List[Tuple[int, int]]:
+    """
+    Descending, inclusive id ranges above (and for 'all' below) the span of previously fetched stories
+    """
+    if len(fetched) == 0: return [(top_id, 1)]
+    ranges = [(top_id, max(fetched) + 1)]
+    if mode == 'all': ranges.append((min(fetched) - 1, 1))
+    return ranges
 
-        for sym in contained_companies:
-            analysis.data.append(SentimentContext(sym, 'hacker_news', post.story.time, adj_sentiment))
+def scan_items(ranges: List[Tuple[int, int]], window: int = FETCH_WINDOW) -> Iterator[HN_Item]:
+    """
+    Every existing item in the id ranges, fetched concurrently but yielded in descending id order,
+    so once an item is processed every id above it (within the ranges) has been too
+    """
+    ids = (current_id for top, bottom in ranges for current_id in range(top, bottom - 1, -1))
+    for _, item in fetch_items(ids, window):
+        if item is not None: yield item
 
-    add_analyses([analysis])
+def stream_posts(max_article_count: int, ranges: List[Tuple[int, int]]) -> Iterator[HN_Post]:
+    """
+    Yields up to [max_article_count] stories found scanning the id ranges, each as soon as its comment
+    tree is assembled. Comments met during the scan are dropped (they're reached from their story)
+    and only stories mentioning a company have their trees fetched, so nothing accumulates between
+    stories and memory stays flat however many are backfilled.
+    """
+    remaining = max_article_count
+    for item in scan_items(ranges):
+        if remaining <= 0: return
+        if item.type != 'story': continue
+        remaining -= 1
+        yield assemble_post(item) if len(story_companies(item)) > 0 else HN_Post(item, [])
+
+def score_post(vader: SentimentIntensityAnalyzer, post: HN_Post) -> Analysis:
+    """
+    Stories mentioning a company get the mean sentiment of their title + comments
+    """
+    analysis = Analysis()
+    contained_companies = story_companies(post.story)
+    if len(contained_companies) == 0: return analysis
 
+    sentiments = [polarity(vader, post.story.title)]
+    for comment in post.comments: sentiments.append(polarity(vader, comment.text))
+    adj_sentiment = np.mean(sentiments)
+    print(f'\thacker_news | sentiment: {adj_sentiment} | {len(post.comments)} comments | symbols: {contained_companies}')
 
+    for sym in contained_companies:
+        analysis.data.append(SentimentContext(sym, 'hacker_news', post.story.time, adj_sentiment))
+    analysis.ids = [doc_id(post.story.id, sym) for sym in contained_companies]
+    return analysis
 
-def analyze(max_article_count: int = 100, mode: str = 'all') -> List[HN_Post]:
-    current_id = last_valid_id()
-    remaining_articles = max_article_count
+def doc_id(story_id: int, symbol: str) -> str:
+    """
+    Re-analyzed / updated stories replace their earlier documents
+    """
+    return f'hacker_news-{story_id}-{symbol}'
 
-    # Load in previously fetched ids
+def analyze_posts(posts: Iterator[HN_Post]):
+    """
+    Scores + stores each post as it arrives, the post is released before the next one is assembled.
+    State is written once at the end (or on an error), not per post.
+    """
+    vader = SentimentIntensityAnalyzer()
     state = get_state()
-
-    # Ignore all previously fetched posts except for latest 20 to account for new comments
-    previously_fetched = list(state['fetched'].keys())
-    ignore_posts = set(previously_fetched[20:])
-    # if len(ignore_posts) > 0: 
-
-    try: loop = asyncio.get_event_loop()
-    except: loop = asyncio.new_event_loop()
-
-    # First we construct the item dictionary
-    items: Dict[int, HN_Item] = {}
-    while remaining_articles > 0 and current_id >= 0:
-        # Ignore certain posts
-        if current_id in ignore_posts:
-            if mode == 'recent': return
-            current_id = min(ignore_posts) - 1
-            continue
-
-        try:
-            item = HN_Item.from_json(requests.get(item_url(current_id)).json())
-            items[item.id] = item
-            if item.type == 'story':
-                post = HN_Post(item, [items[kid] for kid in item.kids if kid in items])
-                if post.story.id in ignore_posts: # Delete unused post comments
-                    for comment in [c for c in post.comments if c.id in items]: del items[comment.id]
-                    del items[post.story.id]
-                else:
-                    print(f'\thacker_news | analyzing post {post.story.id} | {remaining_articles - 1} remaining')
-                    loop.run_until_complete(analyze_comments_for_post(post))
-                    remaining_articles -= 1
-                    update_state(post)
-
-            current_id -= 1
-
-        except Exception as e:
-            print(f'Error fetching hackernews item with id {current_id}, skipping:', e)
-
+    try:
+        for post in posts:
+            analysis = score_post(vader, post)
+            if len(analysis.data) > 0: add_analyses([analysis])
+            update_state(state, post)
+    finally: save_state(state)
 
 
 
+def analyze(max_article_count: int = 100, mode: str = 'all'):
+    """
+    Analyzes up to [max_article_count] stories newer than those previously fetched ('recent') or also
+    older ('all'). The latest 20 previously fetched stories are analyzed again to account for new comments.
+    """
+    fetched = sorted(get_state()['fetched'].keys(), reverse=True)
+    ranges = unfetched_ranges(last_valid_id(), set(fetched[20:]), mode)
+    with source_run('hacker_news'): analyze_posts(stream_posts(max_article_count, ranges))
 
 
+def analyze_v2(max_article_count: int = 2000):
+    """
+    HackerNews Analysis is performed by iterating (backwards) for a given max article count.
+    """
+    print('\n\nStarting HackerNews Analysis\n_____________\n')
+    ranges = unfetched_ranges(last_valid_id(), set(get_state()['fetched'].keys()))
+    with source_run('hacker_news'): analyze_posts(stream_posts(max_article_count, ranges))
+    print('\thacker_news | analysis complete')
 
 
 
-def fetch_posts(max_article_count: int, mode: str = 'all') -> List[HN_Post]:
-    print(f'Fetching {max_article_count} HN Posts')
 
-    max_id = last_valid_id()
-    current_id = max_id
-    remaining_articles = max_article_count
+# Live
+def _emit(live: Dict[int, Dict[str, Any]], story_ids: Set[int]):
+    analysis = Analysis(ids=[])
+    for story_id in story_ids:
+        story = live[story_id]
+        for sym in story['symbols']:
+            analysis.data.append(SentimentContext(sym, 'hacker_news', story['time'], story['sum'] / story['count']))
+            analysis.ids.append(doc_id(story_id, sym))
+    if len(analysis.data) > 0: add_analyses([analysis], bulk=True)
 
-    # Load in previously fetched ids
+def refresh_live(max_new_stories: int = LIVE_NEW_STORIES) -> Dict[str, int]:
+    """
+    One live cycle driven by the api's change feeds instead of an id scan:
+        - newstories: stories not seen before are fetched, relevant ones with their comment trees
+        - updates: of the changed items only followed stories + their known comments are fetched,
+          replies not seen before are added to the story's running sentiment
+    Only new stories and those whose comment set grew are (re-)stored, under deterministic ids so
+    they replace their earlier documents. Stories are followed (and remembered as seen) for
+    LIVE_WINDOW after posting, the newstories feed doesn't reach back further than that. Live mode
+    keeps its ids out of state['fetched'], which records the historical analysis.
+    """
     state = get_state()
-    skip_ids = set(state['fetched'])
-
-    # First we construct the item dictionary
-    items: Dict[int, HN_Item] = {}
-    while remaining_articles > 0 and current_id > 0:
-        if current_id % 100 == 0: print(f'\thn | {max_id - current_id}/{max_id} | {remaining_articles} remaining articles required')
-
-        if current_id in skip_ids:
-            current_id -= 1
-            continue
-        else: skip_ids.add(current_id)
-
-        try:
-            res = requests.get(item_url(current_id)).json()
-            if res is not None:
-                item = HN_Item.from_json(res)
-                items[item.id] = item
-                if item.type == 'story': remaining_articles -= 1
-            current_id -= 1
-
-        except Exception as e:
-            print(res)
-            print(f'Error fetching hackernews item with id {current_id}, skipping:', e)
-
-    # Update visited ids
-    with open('scrapers/fetched/hn.json', 'w') as f:
-        data = {'fetched_ids': list(skip_ids)}
-        try: f.write(json.dumps(data, indent=4))
-        except Exception as e: print('Error updating hackernews visited ids')
+    live, seen = state['live'], state['seen']
+    now = time.time()
+    for story_id in [story_id for story_id, story in live.items() if now - story['time'] > LIVE_WINDOW]: del live[story_id]
+    for story_id in [story_id for story_id, posted in seen.items() if now - posted > LIVE_WINDOW]: del seen[story_id]
+    owners = { comment_id: story_id for story_id, story in live.items() for comment_id in story['comments'] }
 
-    # Now we can associate the posts with their comments
-    posts: List[HN_Post] = []
-    for story in [s for s in items.values() if s.type == 'story']:
-        posts.append(HN_Post(story, [items[kid] for kid in story.kids if kid in items]))
+    new_ids = [id for id in requests.get(new_stories_url).json()[:max_new_stories] if id not in seen]
+    changed = [id for id in requests.get(updates_url).json()['items'] if id in live or id in owners]
 
-    return posts
-
-
-def analyze_v2(max_article_count: int = 2000):
-    """
-    HackerNews Analysis is performed by iterating (backwards) for a given max article count.
-    """
-    
-    print('\n\nStarting HackerNews Analysis\n_____________\n')
-    posts = fetch_posts(max_article_count)
-    symbol_data = enhanced_symbols()
     vader = SentimentIntensityAnalyzer()
+    touched: Set[int] = set()
+    counts = { 'new_stories': 0, 'changed_items': len(changed), 'new_comments': 0 }
+    for _, story in fetch_items(new_ids):
+        if story is None or story.type != 'story': continue
+        counts['new_stories'] += 1
+        companies = story_companies(story)
+        seen[story.id] = story.time
+        if len(companies) == 0: continue
+
+        post = assemble_post(story)
+        sentiments = [polarity(vader, story.title)] + [polarity(vader, c.text) for c in post.comments]
+        live[story.id] = { 'time': story.time, 'symbols': list(companies), 'sum': float(np.sum(sentiments)), 'count': len(sentiments), 'comments': [c.id for c in post.comments] }
+        touched.add(story.id)
+
+    for _, item in fetch_items(changed):
+        if item is None: continue
+        story_id = item.id if item.id in live else owners.get(item.id)
+        if story_id is None or story_id not in live: continue
+
+        known = set(live[story_id]['comments'])
+        new_kids = [kid for kid in item.kids if kid not in known]
+        if len(new_kids) == 0: continue # edits, score or descendant count changes
+        comments = [c for c in assemble_comments(new_kids, max_comments=max(MAX_COMMENTS - len(known), 0)) if c.id not in known]
+        if len(comments) == 0: continue
+
+        live[story_id]['comments'] += [c.id for c in comments]
+        for c in comments: owners[c.id] = story_id
+        live[story_id]['sum'] += float(np.sum([polarity(vader, c.text) for c in comments]))
+        live[story_id]['count'] += len(comments)
+        counts['new_comments'] += len(comments)
+        touched.add(story_id)
+
+    _emit(live, touched)
+    save_state(state)
+    counts['stored_stories'] = len(touched)
+    print(f'\thacker_news | live refresh | {counts}')
+    return counts
 
-    print(f'\tFetch Complete: {len(posts)} Posts')
-    for post in posts:
-        analysis = Analysis()
-        # First we determine if it's a relevant story
-        # If it is, we then perform sentiment analysis on the comments + title
-        title_segments = post.story.title.split(' ') # Removed .lower() to prevent erroneous matches
-
-        contained_companies = [sym for sym, comp in symbol_data.companies.items() if is_subset(title_segments, [c.title() for c in comp.split(' ')])]
-        if len(contained_companies) > 0:
-            print(f'\t{post.story.title} contains {len(contained_companies)} companies:', contained_companies)
-            
-            title_score = vader.polarity_scores(post.story.title)
-            sentiments = [title_score['compound']]
-            for comment in post.comments:
-                comment_score = vader.polarity_scores(comment.text)
-                sentiments.append(comment_score['compound'])
-            adj_sentiment = np.mean(sentiments) if len(sentiments) > 0 else 0
-
-            for sym in contained_companies:
-                analysis.data.append(SentimentContext(sym, 'hacker_news', post.story.time, adj_sentiment))
-
-        add_analyses([analysis])
-
-    
 
 
 # Monitoring    
 
-def monitor(frequency: int = 60):
+def monitor(frequency: int = 60, scheduler: Scheduler = None):
     """
-    Continually checks the api for unviewed posts
+    Continually checks the api's change feeds for new stories + comments, see refresh_live.
+    Registers with the provided scheduler, or runs its own when called standalone.
     """
-    MAX_LIVE_ARTICLE_CHECK = 30
-
-    # Kick off monitoring
-    starttime = time.time()
-    th = threading.Thread(target=analyze, args=[MAX_LIVE_ARTICLE_CHECK, 'recent'])
-    th.start()
-    while True:
-        if not th.is_alive():
-            time.sleep(frequency - ((time.time() - starttime) % frequency))
-            th = threading.Thread(target=analyze, args=[MAX_LIVE_ARTICLE_CHECK, 'recent'])
-            th.start()
+    standalone = scheduler is None
+    if standalone: scheduler = Scheduler()
+    scheduler.every(frequency, 'hacker_news', profiled('hacker_news', refresh_live))
+    if standalone: scheduler.run()
@@ -0,0 +1,227 @@
+from typing import Dict, FrozenSet, Iterable, List, Set, Tuple
+import threading, re
+
+from config.symbols import enhanced_symbols, us
+from config.models import Mention, SymbolData
+
+
+class CompanyMatcher():
+    """
+    Aho-Corasick automaton over reduced company names. Built once, then every
+    company mention in a text is found in a single pass over its characters.
+    """
+    goto: List[Dict[str, int]]  # Per-state character transitions
+    fail: List[int]             # Per-state failure links
+    output: List[List[int]]     # Per-state indices into patterns ending at that state
+    patterns: List[Tuple[str, List[str]]]  # [(company name, [symbols])]
+
+    def __init__(self, companies: Dict[str, str]) -> None:
+        self.goto, self.fail, self.output, self.patterns = [{}], [0], [[]], []
+
+        # Several symbols can share one company name (e.g. share classes)
+        by_name: Dict[str, List[str]] = {}
+        for symbol, name in companies.items():
+            if not isinstance(name, str) or len(name.strip()) == 0: continue
+            by_name.setdefault(name.strip(), []).append(symbol)
+
+        for name, symbols in by_name.items(): self._add(name, symbols)
+        self._link()
+
+    def _add(self, name: str, symbols: List[str]):
+        state = 0
+        for char in name:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+
+        self.output[state].append(len(self.patterns))
+        self.patterns.append((name, symbols))
+
+    def _link(self):
+        # Breadth-first so every failure target is resolved before its dependents
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, child in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]: fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+                queue.append(child)
+
+    def find(self, text: str, blacklist: Set[str] = frozenset()) -> List[Mention]:
+        """
+        Returns every whole-word company mention in the text, skipping blacklisted symbols
+        """
+        mentions: List[Mention] = []
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in goto[state]: state = fail[state]
+            state = goto[state].get(char, 0)
+            if not output[state]: continue
+
+            for pattern_index in output[state]:
+                name, symbols = self.patterns[pattern_index]
+                start, end = i - len(name) + 1, i + 1
+                if start > 0 and text[start - 1].isalnum(): continue
+                if end < len(text) and text[end].isalpha(): continue
+                for symbol in symbols:
+                    if symbol not in blacklist: mentions.append(Mention(symbol, start, end, 'company'))
+
+        return mentions
+
+
+
+_company_matcher: CompanyMatcher = None
+_company_matcher_lock = threading.Lock()
+
+def company_matcher() -> CompanyMatcher:
+    """
+    Returns the process-wide company matcher, building it on first use
+    """
+    global _company_matcher
+    if _company_matcher is None:
+        with _company_matcher_lock:
+            if _company_matcher is None: _company_matcher = CompanyMatcher(enhanced_symbols().companies)
+    return _company_matcher
+
+
+
+class TokenTrie():
+    """
+    Trie over title-cased company name tokens, so a tokenised title is matched
+    against every company in one walk over its tokens.
+    """
+    children: List[Dict[str, int]]  # Per-node token transitions
+    symbols: List[List[str]]        # Per-node symbols whose company name ends at that node
+
+    def __init__(self, companies: Dict[str, str]) -> None:
+        self.children, self.symbols = [{}], [[]]
+        for symbol, name in companies.items():
+            if not isinstance(name, str) or len(name.strip()) == 0: continue
+            self._add([token.title() for token in name.split(' ')], symbol)
+
+    def _add(self, tokens: List[str], symbol: str):
+        node = 0
+        for token in tokens:
+            if token not in self.children[node]:
+                self.children.append({})
+                self.symbols.append([])
+                self.children[node][token] = len(self.children) - 1
+            node = self.children[node][token]
+        self.symbols[node].append(symbol)
+
+    def find(self, tokens: List[str]) -> List[str]:
+        """
+        Returns the symbols of every company whose name appears as a contiguous run of tokens
+        """
+        found: Dict[str, None] = {}
+        for start in range(len(tokens)):
+            node = 0
+            for token in tokens[start:]:
+                node = self.children[node].get(token)
+                if node is None: break
+                for symbol in self.symbols[node]: found[symbol] = None
+        return list(found)
+
+
+
+_company_trie: TokenTrie = None
+_company_trie_lock = threading.Lock()
+
+def company_trie() -> TokenTrie:
+    """
+    Returns the process-wide company token trie, building it on first use
+    """
+    global _company_trie
+    if _company_trie is None:
+        with _company_trie_lock:
+            if _company_trie is None: _company_trie = TokenTrie(enhanced_symbols().companies)
+    return _company_trie
+
+
+
+# Exchange tagged symbols in prose e.g. (NYSE: X) or (Nasdaq: X), cashtags e.g. $tsla and bare uppercase tokens e.g. TSLA.
+# Exchange tags skip the ticker check so they're strict: opening parenthesis and uppercase symbols
+TICKER_PATTERN = re.compile(
+    r'\(\s*(?:NYSE|NASDAQ|Nasdaq)\s*:\s*([A-Z]{1,5}(?:\.[A-Z])?)(?![\w])'
+    r'|(?<![\w$])\$([A-Za-z]{1,5})(?![\w])'
+    r'|(?<![\w$\'&.-])([A-Z]{1,5})(?![\w\'&-]|\.\w)'
+)
+TICKER_KINDS = ('exchange', 'cashtag', 'ticker')
+
+# Ticker markup of any exchange e.g. NASDAQ:AAPL, NYSEMKT:SENS, OTC:TCEHY or NASDAQOTH:ADRNY, see find_tags
+TAG_PATTERN = re.compile(r'(?<![\w])[A-Z]{2,10}\s*:\s*([A-Z]{1,5}(?:\.[A-Z]{1,2})?)(?![\w])')
+
+def source_blacklists(data: SymbolData) -> Dict[str, FrozenSet[str]]:
+    """
+    Per-source blacklists from the compiled symbol data, anything unlisted uses data.blacklist (wsb-oriented)
+    """
+    return {
+        'ap': frozenset(),
+        'cnbc': data.blacklist.union({'NWSA', 'NWS'}),
+        'reuters': data.extended_blacklist,
+        'themotleyfool': frozenset(),
+    }
+
+class TickerTokenizer():
+    """
+    Finds exchange tagged symbols, cashtags and bare uppercase tickers in a single regex scan.
+    Exchange tagged symbols are explicit so they're only checked against the blacklist,
+    everything else must also be a known ticker.
+    """
+    tickers: FrozenSet[str]
+    blacklists: Dict[str, FrozenSet[str]]
+    default_blacklist: FrozenSet[str]
+
+    def __init__(self, tickers: Iterable[str], blacklists: Dict[str, FrozenSet[str]] = None, default_blacklist: Iterable[str] = frozenset()) -> None:
+        self.tickers = frozenset(tickers)
+        self.blacklists = blacklists if blacklists is not None else {}
+        self.default_blacklist = frozenset(default_blacklist)
+
+    def blacklist_for(self, source: str = None) -> FrozenSet[str]:
+        return self.blacklists.get(source, self.default_blacklist)
+
+    def find(self, text: str, source: str = None, kinds: Tuple[str, ...] = TICKER_KINDS) -> List[Mention]:
+        mentions: List[Mention] = []
+        source_blacklist = self.blacklist_for(source)
+        for match in TICKER_PATTERN.finditer(text):
+            group = match.lastindex
+            kind = TICKER_KINDS[group - 1]
+            if kind not in kinds: continue
+
+            symbol = match.group(group).upper()
+            if symbol in source_blacklist: continue
+            if kind != 'exchange' and symbol not in self.tickers: continue
+            mentions.append(Mention(symbol, match.start(group), match.end(group), kind))
+
+        return mentions
+
+    def find_tags(self, text: str, source: str = None) -> List[Mention]:
+        """
+        Symbols of EXCHANGE:SYMBOL tags, for markup whose every tag is a ticker. Like exchange
+        mentions they're only checked against the blacklist, so listings outside the us universe count.
+        """
+        source_blacklist = self.blacklist_for(source)
+        return [Mention(match.group(1), match.start(1), match.end(1), 'exchange') for match in TAG_PATTERN.finditer(text) if match.group(1) not in source_blacklist]
+
+
+
+_ticker_tokenizer: TickerTokenizer = None
+_ticker_tokenizer_lock = threading.Lock()
+
+def ticker_tokenizer() -> TickerTokenizer:
+    """
+    Returns the process-wide ticker tokenizer, building it on first use
+    """
+    global _ticker_tokenizer
+    if _ticker_tokenizer is None:
+        with _ticker_tokenizer_lock:
+            if _ticker_tokenizer is None:
+                data = enhanced_symbols()
+                _ticker_tokenizer = TickerTokenizer(us, source_blacklists(data), data.blacklist)
+    return _ticker_tokenizer
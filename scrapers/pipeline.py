@@ -0,0 +1,280 @@
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Set, Tuple
+import queue, threading, requests, time
+from bs4 import BeautifulSoup
+from nltk.sentiment.vader import SentimentIntensityAnalyzer
+
+from config.models import Analysis, PipelineArticle, SentimentContext
+from data.es import add_analyses
+from scrapers.scoring import rate_symbols
+from scrapers.fetching import rebase
+from instrumentation.metrics import metrics, timed
+from instrumentation.profiling import ProfileRun, current as current_profile, thread_profile
+
+
+_DONE = object() # end of stream marker passed between stages
+EDIT_WINDOW = 3 * 24 * 60 * 60 # seconds after a period ends during which its sitemap may still change
+
+
+class _PeriodDiscovered(NamedTuple):
+    """
+    Sent straight to the writer once a period has been fully listed
+    """
+    period: str
+    articles: int   # new articles queued for the period
+    ok: bool        # False when listing the period failed part way
+
+
+class Source():
+    """
+    The hooks a source supplies to the pipeline:
+        - discover(mode, seen): yields candidate articles. [seen] holds every article id already processed
+          or queued, discovery can use it to stop early but doesn't need to filter with it
+        - or, for sitemap style sources, periods(mode) listing the sitemap periods (newest first) and
+          discover_period(period, seen) yielding the candidates of a single period
+        - extract(article, soup): fills in the article's text, symbols (+ mentions / timestamp when known),
+          returning False when the article isn't relevant
+        - fetch(article): optional override for retrieving the raw page, defaults to a plain GET
+        - period_end(period): optional, the timestamp a period ends at. Periods past their end + edit
+          window are closed, once fully processed they're recorded in state and never listed again
+    """
+    name: str
+    extract: Callable[[PipelineArticle, BeautifulSoup], bool]
+    periods: Callable[[str], List[str]]
+    discover_period: Callable[[str, Set[str]], Iterator[PipelineArticle]]
+    fetch: Callable[[PipelineArticle], str]
+    parser: str
+    period_end: Callable[[str], float]
+    edit_window: float
+
+    def __init__(self, name: str, extract: Callable, discover: Callable = None, periods: Callable = None, discover_period: Callable = None,
+                 fetch: Callable = None, parser: str = 'html.parser', period_end: Callable = None, edit_window: float = EDIT_WINDOW) -> None:
+        if discover is None and (periods is None or discover_period is None):
+            raise Exception(f'{name}: either discover or periods + discover_period are required')
+
+        self.name = name
+        self.extract = extract
+        self._discover = discover
+        self.periods = periods
+        self.discover_period = discover_period
+        self.fetch = fetch if fetch is not None else (lambda article: requests.get(rebase(article.url)).text)
+        self.parser = parser
+        self.period_end = period_end
+        self.edit_window = edit_window
+
+    def discover(self, mode: str, seen: Set[str], periods: List[str] = None) -> Iterator[PipelineArticle]:
+        if periods is None and self._discover is not None:
+            yield from self._discover(mode, seen)
+            return
+
+        if self.periods is None: raise Exception(f'{self.name} is not period based')
+        for period in (periods if periods is not None else self.periods(mode)): yield from self.discover_period(period, seen)
+
+    def closed(self, period: str) -> bool:
+        """
+        Whether the period's sitemap can no longer change
+        """
+        return self.period_end is not None and time.time() > self.period_end(period) + self.edit_window
+
+
+class Pipeline():
+    """
+    discover -> fetch -> parse -> score -> write, with bounded queues between stages so a slow
+    stage pushes back on everything upstream of it. Every discovered article reaches the writer
+    (relevant or not) so it's marked as fetched once its results are stored. Articles whose fetch or
+    write failed aren't, so later runs retry them, while parse / score errors are recorded like
+    irrelevant articles. Closed periods are marked complete in state['completed_periods'] once all
+    of their articles are stored without a retryable failure, and skipped by later runs.
+    """
+    def __init__(self, source: Source, state: Dict[str, Any], save_state: Callable[[Dict[str, Any]], None],
+                 fetch_workers: int = 6, parse_workers: int = 2, score_workers: int = 2, queue_size: int = 64, write_batch: int = 25) -> None:
+        self.source = source
+        self.state = state
+        self.save_state = save_state
+        self.workers = { 'fetch': fetch_workers, 'parse': parse_workers, 'score': score_workers }
+        self.queues = { stage: queue.Queue(maxsize=queue_size) for stage in ['fetch', 'parse', 'score', 'write'] }
+        self.write_batch = write_batch
+        self.local = threading.local()
+
+        if 'fetched' not in self.state: self.state['fetched'] = []
+        if 'completed_periods' not in self.state: self.state['completed_periods'] = []
+        self.seen: Set[str] = set(self.state['fetched'])
+
+        # Writer side period bookkeeping: period -> (# articles, listed without error), period -> # stored / # failed
+        self.period_totals: Dict[str, Tuple[int, bool]] = {}
+        self.period_written: Dict[str, int] = {}
+        self.period_failed: Dict[str, int] = {}
+        self.counts = { 'discovered': 0, 'new': 0, 'fetched': 0, 'parsed': 0, 'scored': 0, 'written': 0, 'write_errors': 0, 'skipped_periods': 0, 'completed_periods': 0 }
+        self.counts_lock = threading.Lock()
+
+    def _count(self, key: str, n: int = 1):
+        with self.counts_lock: self.counts[key] += n
+        metrics().count(f'pipeline_{key}_total', self.source.name, n)
+
+    def _vader(self) -> SentimentIntensityAnalyzer:
+        if not hasattr(self.local, 'vader'): self.local.vader = SentimentIntensityAnalyzer()
+        return self.local.vader
+
+
+    # Stages
+    def _discover(self, mode: str, periods: List[str] = None):
+        if self.source.periods is None or (periods is None and self.source._discover is not None):
+            self._queue_new(self.source.discover(mode, self.seen))
+        else:
+            completed = set(self.state['completed_periods'])
+            for period in (periods if periods is not None else self.source.periods(mode)):
+                if period in completed:
+                    self._count('skipped_periods')
+                    continue
+                articles, ok = self._queue_new(self.source.discover_period(period, self.seen), period)
+                self.queues['write'].put(_PeriodDiscovered(period, articles, ok))
+
+        for _ in range(self.workers['fetch']): self.queues['fetch'].put(_DONE)
+
+    def _queue_new(self, articles: Iterator[PipelineArticle], period: str = None) -> Tuple[int, bool]:
+        """
+        Queues the articles not seen before, returns (# queued, listed without error)
+        """
+        queued = 0
+        listed, start = False, time.perf_counter()
+        try:
+            for article in articles:
+                # Time to the first article covers fetching and parsing the listing
+                if not listed: metrics().observe('sitemap_seconds', self.source.name, time.perf_counter() - start)
+                listed = True
+                self._count('discovered')
+                if article.id in self.seen: continue
+                self.seen.add(article.id)
+                article.period = period
+                self._count('new')
+                queued += 1
+                self.queues['fetch'].put(article)
+        except Exception as e:
+            print(f'{self.source.name} | discovery error{f" for {period}" if period is not None else ""}:', e)
+            return queued, False
+        return queued, True
+
+    def _fetch(self, article: PipelineArticle) -> str:
+        with timed('fetch_seconds', self.source.name): article.html = self.source.fetch(article)
+        self._count('fetched')
+        return 'parse'
+
+    def _parse(self, article: PipelineArticle) -> str:
+        with timed('parse_cpu_seconds', self.source.name, time.thread_time):
+            soup = BeautifulSoup(article.html, self.source.parser)
+            article.html = None # free the raw page as soon as it's parsed
+            relevant = self.source.extract(article, soup)
+        self._count('parsed')
+        return 'score' if relevant and len(article.symbols) > 0 else 'write'
+
+    def _score(self, article: PipelineArticle) -> str:
+        with timed('score_cpu_seconds', self.source.name, time.thread_time):
+            article.ratings = rate_symbols(self._vader(), article.text, article.symbols, article.mentions, self.source.name)
+        article.text, article.mentions = None, None
+        self._count('scored')
+        return 'write'
+
+    def _worker(self, stage: str, handler: Callable[[PipelineArticle], str], finished: List[int]):
+        """
+        Runs one stage worker, the last worker of a stage to finish closes the next stage
+        """
+        stages = ['fetch', 'parse', 'score', 'write']
+        next_stage = stages[stages.index(stage) + 1]
+        while True:
+            article = self.queues[stage].get()
+            if article is _DONE: break
+            try: destination = handler(article)
+            except Exception as e:
+                print(f'{self.source.name}:{stage} error for link: {article.url}  |  ', e)
+                # Only a failed download is worth retrying, a page that can't be parsed fails the same way every run
+                article.failed = stage == 'fetch'
+                destination = 'write'
+            self.queues[destination].put(article)
+
+        with self.counts_lock:
+            finished[0] += 1
+            last = finished[0] == self.workers[stage]
+        if last:
+            for _ in range(self.workers[next_stage] if next_stage in self.workers else 1): self.queues[next_stage].put(_DONE)
+
+    def _write(self):
+        # Earlier stages also route articles here, but they all close before the score stage does
+        pending: List[PipelineArticle] = []
+        while True:
+            article = self.queues['write'].get()
+            if article is _DONE: break
+            if isinstance(article, _PeriodDiscovered):
+                self.period_totals[article.period] = (article.articles, article.ok)
+                if self._complete_periods(): self.save_state(self.state)
+                continue
+            pending.append(article)
+            if len(pending) >= self.write_batch: self._flush(pending)
+        self._flush(pending)
+
+    def _flush(self, pending: List[PipelineArticle]):
+        if len(pending) == 0: return
+        analysis = Analysis()
+        for article in pending:
+            if article.ratings is None: continue
+            for symbol, rating in article.ratings.items(): analysis.data.append(SentimentContext(symbol, self.source.name, article.timestamp, rating))
+            print(f'\t{self.source.name}: sentiment {article.ratings} | {article.url}')
+
+        # A failed batch is dropped rather than killing the writer (which would leave every upstream
+        # stage blocked on a full queue), its articles fail like any other stage error
+        if len(analysis.data) > 0:
+            try:
+                add_analyses([analysis], bulk=True) # timed per source as es_write_seconds
+                self._count('written', len(analysis.data))
+            except Exception as e:
+                print(f'{self.source.name}:write error for {len(pending)} articles  |  ', e)
+                self._count('write_errors')
+                for article in pending: article.failed = True
+
+        # Failed articles aren't marked fetched so the next run retries them, and keep their period incomplete
+        self.state['fetched'] += [article.id for article in pending if not article.failed]
+        for article in pending:
+            if article.period is None: continue
+            counts = self.period_failed if article.failed else self.period_written
+            counts[article.period] = counts.get(article.period, 0) + 1
+        self._complete_periods()
+        self.save_state(self.state)
+        pending.clear()
+
+    def _complete_periods(self) -> bool:
+        """
+        Records closed periods whose articles have all been stored, returns whether any were recorded.
+        Periods with a failed article are left incomplete so a later run lists them again.
+        """
+        finished = [period for period, (total, _) in self.period_totals.items() if self.period_written.get(period, 0) + self.period_failed.get(period, 0) >= total]
+        recorded = False
+        for period in finished:
+            _, ok = self.period_totals.pop(period)
+            if not ok or self.period_failed.get(period, 0) > 0 or not self.source.closed(period): continue
+            self.state['completed_periods'].append(period)
+            self._count('completed_periods')
+            recorded = True
+        return recorded
+
+    def _profiled(self, profile: ProfileRun, target: Callable, *args):
+        with thread_profile(profile): target(*args)
+
+    def run(self, mode: str = 'all', periods: List[str] = None) -> Dict[str, int]:
+        """
+        Runs the source through every stage, blocking until all discovered articles are written.
+        [periods] restricts a period based source to the given sitemap periods.
+        """
+        # Workers are named after the calling thread so a profile of the caller takes them in
+        prefix, profile = f'{threading.current_thread().name}/{self.source.name}', current_profile()
+        def thread(stage: str, target: Callable, *args) -> threading.Thread:
+            return threading.Thread(target=self._profiled, args=[profile, target, *args], name=f'{prefix}:{stage}')
+
+        threads = [thread('discover', self._discover, mode, periods)]
+        for stage, handler in [('fetch', self._fetch), ('parse', self._parse), ('score', self._score)]:
+            finished = [0]
+            threads += [thread(stage, self._worker, stage, handler, finished) for _ in range(self.workers[stage])]
+        threads.append(thread('write', self._write))
+
+        for th in threads: th.start()
+        for th in threads: th.join()
+
+        print(f'\t{self.source.name} | pipeline complete | {self.counts}')
+        return self.counts
@@ -0,0 +1,126 @@
+from typing import Any, Callable, Dict, List, Tuple
+import heapq, threading, time, traceback
+
+from instrumentation.metrics import metrics
+
+
+class Job():
+    """
+    A periodic job owned by the scheduler. Runs never overlap: a deadline that arrives
+    while the previous run is still going is skipped rather than queued.
+    """
+    name: str
+    fn: Callable
+    args: Tuple[Any, ...]
+    interval: float
+    next_run: float
+    running: bool
+    runs: int
+    skipped: int
+    last_started: float
+    last_duration: float
+    last_error: str
+
+    def __init__(self, name: str, fn: Callable, args: Tuple[Any, ...], interval: float, next_run: float) -> None:
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.interval = interval
+        self.next_run = next_run
+        self.running = False
+        self.runs = 0
+        self.skipped = 0
+        self.last_started = None
+        self.last_duration = None
+        self.last_error = None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'interval': self.interval,
+            'next_run': self.next_run,
+            'running': self.running,
+            'runs': self.runs,
+            'skipped': self.skipped,
+            'last_started': self.last_started,
+            'last_duration': self.last_duration,
+            'last_error': self.last_error,
+        }
+
+
+class Scheduler():
+    """
+    Heap based scheduler for every periodic job, the loop thread sleeps until the next deadline
+    """
+    jobs: Dict[str, Job]
+
+    def __init__(self) -> None:
+        self.jobs = {}
+        self.heap: List[Tuple[float, str]] = []
+        self.condition = threading.Condition()
+        self.stopped = False
+
+    def every(self, interval: float, name: str, fn: Callable, *args, run_now: bool = True) -> Job:
+        """
+        Registers fn(*args) to run every [interval] seconds
+        """
+        with self.condition:
+            if name in self.jobs: raise Exception(f'Scheduler job already registered: {name}')
+            job = Job(name, fn, args, interval, time.time() + (0 if run_now else interval))
+            self.jobs[name] = job
+            heapq.heappush(self.heap, (job.next_run, name))
+            self.condition.notify()
+        return job
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        with self.condition: return { name: job.status() for name, job in self.jobs.items() }
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def _execute(self, job: Job):
+        start = time.time()
+        try:
+            job.fn(*job.args)
+            job.last_error = None
+        except Exception as e:
+            job.last_error = repr(e)
+            print(f'scheduler | {job.name} failed:', e)
+            traceback.print_exc()
+
+        with self.condition:
+            job.running = False
+            job.runs += 1
+            job.last_duration = time.time() - start
+        metrics().observe('job_seconds', job.name, job.last_duration)
+
+    def _dispatch(self, job: Job, now: float):
+        if job.running:
+            job.skipped += 1
+            metrics().count('job_skipped_total', job.name)
+            print(f'scheduler | {job.name} still running, skipping this run')
+        else:
+            job.running = True
+            job.last_started = now
+            threading.Thread(target=self._execute, args=[job], name=f'job-{job.name}', daemon=True).start()
+
+        # Deadlines missed entirely (e.g. after a suspend) are coalesced into the next one
+        missed = int((now - job.next_run) // job.interval)
+        if missed > 0: job.skipped += missed
+        job.next_run += job.interval * (missed + 1)
+        heapq.heappush(self.heap, (job.next_run, job.name))
+
+    def run(self):
+        """
+        Blocks, running jobs as their deadlines come up until stopped
+        """
+        with self.condition:
+            while not self.stopped:
+                now = time.time()
+                while len(self.heap) > 0 and self.heap[0][0] <= now:
+                    _, name = heapq.heappop(self.heap)
+                    self._dispatch(self.jobs[name], now)
+
+                timeout = self.heap[0][0] - now if len(self.heap) > 0 else None
+                self.condition.wait(timeout)
@@ -0,0 +1,79 @@
+from typing import Dict, Iterable, List, Tuple
+import re, os, bisect
+from nltk.sentiment.vader import SentimentIntensityAnalyzer
+
+from config.models import Mention
+from scrapers.utils import extract_mentions
+from scrapers.cache import sentiment_cache, polarity
+
+
+# 'window' scores the sentences around each mention, 'article' scores the full text for every symbol
+SCORING_MODE = os.environ.get('TS_SCORING_MODE', 'window')
+WINDOW_SENTENCES = 1 # sentences either side of the mentioning sentence
+
+SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+|\n+')
+
+
+def sentence_spans(text: str) -> List[Tuple[int, int]]:
+    spans: List[Tuple[int, int]] = []
+    start = 0
+    for match in SENTENCE_BREAK.finditer(text):
+        if match.start() > start: spans.append((start, match.start()))
+        start = match.end()
+    if start < len(text): spans.append((start, len(text)))
+    return spans
+
+
+def rate_symbols(vader: SentimentIntensityAnalyzer, text: str, symbols: Iterable[str], mentions: List[Mention] = None, source: str = None, mode: str = None) -> Dict[str, float]:
+    """
+    Returns a compound rating per symbol. In window mode each symbol is rated by the
+    sentences surrounding its mentions, symbols that can't be located in the text fall
+    back to the full text rating. Mentions are located with the shared extractor when not provided.
+    Results are cached by content so re-crawled or syndicated bodies aren't scored twice.
+    """
+    symbols = set(symbols)
+    if len(symbols) == 0: return {}
+
+    mode = mode or SCORING_MODE
+    cached = sentiment_cache().get(text)
+    if cached is not None and cached.symbols is not None and cached.symbols.get('mode') == mode:
+        if symbols.issubset(cached.symbols['ratings']): return { symbol: cached.symbols['ratings'][symbol] for symbol in symbols }
+
+    article_rating: List[float] = []
+    def rate_article() -> float:
+        if len(article_rating) == 0: article_rating.append(polarity(vader, text))
+        return article_rating[0]
+
+    if mode == 'article':
+        ratings = { symbol: rate_article() for symbol in symbols }
+        sentiment_cache().put(text, symbols={ 'mode': mode, 'ratings': ratings })
+        return ratings
+
+    if mentions is None: mentions = extract_mentions(text, True, True, source)
+    spans = sentence_spans(text)
+    starts = [start for start, _ in spans]
+
+    # Sentence indices to score for each located symbol
+    windows: Dict[str, set] = {}
+    for mention in mentions:
+        if mention.symbol not in symbols or len(spans) == 0: continue
+        index = max(bisect.bisect_right(starts, mention.start) - 1, 0)
+        window = range(max(index - WINDOW_SENTENCES, 0), min(index + WINDOW_SENTENCES + 1, len(spans)))
+        windows.setdefault(mention.symbol, set()).update(window)
+
+    # Overlapping windows share sentence scores
+    sentence_ratings: Dict[int, float] = {}
+    ratings: Dict[str, float] = {}
+    for symbol in symbols:
+        if symbol not in windows:
+            ratings[symbol] = rate_article()
+            continue
+
+        for index in windows[symbol]:
+            if index not in sentence_ratings:
+                start, end = spans[index]
+                sentence_ratings[index] = polarity(vader, text[start:end])
+        ratings[symbol] = sum([sentence_ratings[i] for i in windows[symbol]]) / len(windows[symbol])
+
+    sentiment_cache().put(text, symbols={ 'mode': mode, 'ratings': ratings })
+    return ratings
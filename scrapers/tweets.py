@@ -1,13 +1,25 @@
-import requests, time, json, threading, asyncio, os, numpy as np
+import requests, time, json, threading, asyncio, os
+from collections import deque
 from nltk.sentiment.vader import SentimentIntensityAnalyzer
-from typing import Any, Dict
+from typing import Any, Dict, Iterable, List
 from concurrent.futures import ThreadPoolExecutor
 
 from data.es import add_analyses
+from scrapers.cache import polarity
+from scrapers.scheduler import Scheduler
+from instrumentation.profiling import profiled, source_run
 from config.symbols import focus_symbols
 from config.models import TweetData, Analysis, SentimentContext
 
 EXECUTOR = ThreadPoolExecutor(max_workers=6)
+API_PREFIX = 'https://api.stocktwits.com/api/2/streams/symbol'
+RATE_LIMIT = 200            # stocktwits allows 200 requests / hour
+RATE_WINDOW = 3600
+PAGE_SIZE = 30              # most messages a request returns
+CATCHUP_PAGES = 3           # extra pages a live poll may spend catching up on a busy symbol
+MIN_RATE = 1 / 3600         # messages / second floor, so quiet symbols still come round
+RATE_SMOOTHING = 0.3        # weight of the latest page in a symbol's message rate estimate
+MAX_STALENESS = 3600        # seconds before a symbol is polled regardless of its rate
 
 
 # Helpers
@@ -18,7 +30,12 @@ def get_state() -> Dict[str, Any]:
         try: state = json.loads(f.read())
         except: state = {}
     
-    if 'fetched' not in state: state['fetched'] = {}
+    # Older states kept every fetched id per symbol, only the newest & oldest are needed
+    if 'fetched' in state:
+        state['cursors'] = { symbol: { 'since': max(ids), 'max': min(ids) } for symbol, ids in state.pop('fetched').items() if len(ids) > 0 }
+        save_state(state)
+
+    if 'cursors' not in state: state['cursors'] = {}
     return state
 
 def save_state(state: Dict[str, Any]):
@@ -33,44 +50,217 @@ def _process_tweet(tweet: TweetData):
     vader = SentimentIntensityAnalyzer()
 
     try:
-        sentiment = vader.polarity_scores(tweet.body)
-        for symbol in tweet.symbols: analysis.data.append(SentimentContext(symbol, 'twitter', tweet.timestamp, sentiment['compound']))
+        rating = polarity(vader, tweet.body)
+        for symbol in tweet.symbols: analysis.data.append(SentimentContext(symbol, 'twitter', tweet.timestamp, rating))
         add_analyses([analysis])
-        print(f'\ttwitter: sentiment {sentiment["compound"]} | symbols: {tweet.symbols}\n')
+        print(f'\ttwitter: sentiment {rating} | symbols: {tweet.symbols}\n')
 
     except Exception as e: print('Error processing tweet:', e)
 
 
+class RateBudget():
+    """
+    Sliding window request budget, which also stops spending when the provider reports none remaining
+    """
+    def __init__(self, limit: int = RATE_LIMIT, window: float = RATE_WINDOW) -> None:
+        self.limit = limit
+        self.window = window
+        self.requests: deque = deque()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        """
+        Takes a request from the budget, returns False when none are available right now
+        """
+        with self.lock:
+            now = time.time()
+            while len(self.requests) > 0 and self.requests[0] <= now - self.window: self.requests.popleft()
+            if now < self.blocked_until or len(self.requests) >= self.limit: return False
+            self.requests.append(now)
+            return True
+
+    def update(self, headers: Dict[str, str]):
+        remaining, reset = headers.get('X-RateLimit-Remaining'), headers.get('X-RateLimit-Reset')
+        if remaining is None or reset is None or int(remaining) > 0: return
+        with self.lock: self.blocked_until = max(self.blocked_until, float(reset))
+
+
+def _request_page(symbol: str, since: int = None, max_id: int = None, budget: RateBudget = None) -> List[TweetData]:
+    """
+    Up to a page of the symbol's messages, newest first, with ids in (since, max_id]
+    """
+    url = f'{API_PREFIX}/{symbol}.json?filter=all&limit={PAGE_SIZE}'
+    if since is not None: url += f'&since={since}'
+    if max_id is not None: url += f'&max={max_id}'
+
+    res = requests.get(url)
+    if budget is not None: budget.update(res.headers)
+    res = res.json()
+    if 'response' not in res or res['response']['status'] != 200:
+        raise Exception(f'Invalid Twitter Response Body: ', res)
+    return [TweetData(message) for message in res['messages']]
+
+def _store(symbol: str, state: Dict[str, Any], tweets: List[TweetData]):
+    """
+    Processes the tweets and moves the symbol's cursors out to cover them
+    """
+    if len(tweets) == 0: return
+    print(f'\ttwitter: {symbol} | {len(tweets)} tweets')
+
+    try: loop = asyncio.get_event_loop()
+    except: loop = asyncio.new_event_loop()
+    loop.run_until_complete(asyncio.wait([loop.run_in_executor(EXECUTOR, _process_tweet, t) for t in tweets]))
+
+    ids = [t.id for t in tweets]
+    cursor = state['cursors'].setdefault(symbol, { 'since': max(ids), 'max': min(ids) })
+    cursor['since'], cursor['max'] = max(cursor['since'], max(ids)), min(cursor['max'], min(ids))
+    save_state(state)
+
+def fetch_newer(symbol: str, state: Dict[str, Any], budget: RateBudget = None) -> List[TweetData]:
+    """
+    Fetches messages newer than the symbol's high-water mark. A full page means more are waiting,
+    the rest are paged through (budget permitting, up to CATCHUP_PAGES). When catch-up stops short
+    of the old mark, the unfetched range is kept in cursor['gaps'] and filled by later polls with
+    the pages they have left over.
+    """
+    cursor = state['cursors'].get(symbol)
+    since = cursor['since'] if cursor is not None else None
+
+    page = _request_page(symbol, since, budget=budget)
+    tweets, pages = page, 0
+    reached = since is None or len(page) < PAGE_SIZE
+    while not reached and pages < CATCHUP_PAGES:
+        if budget is not None and not budget.acquire(): break
+        page = _request_page(symbol, since, min([t.id for t in page]) - 1, budget)
+        tweets, pages = tweets + page, pages + 1
+        reached = len(page) < PAGE_SIZE
+    oldest = min([t.id for t in tweets]) if len(tweets) > 0 else None
+
+    # Gaps are [since, max] id ranges (since exclusive) left by earlier polls, newest first
+    gaps: List[List[int]] = cursor.get('gaps', []) if cursor is not None else []
+    had_gaps = len(gaps) > 0
+    for gap in list(gaps):
+        while pages < CATCHUP_PAGES:
+            if budget is not None and not budget.acquire(): break
+            page = _request_page(symbol, gap[0], gap[1], budget)
+            tweets, pages = tweets + page, pages + 1
+            gap[1] = min([t.id for t in page] + [gap[1] + 1]) - 1
+            if len(page) < PAGE_SIZE or gap[1] <= gap[0]:
+                gaps.remove(gap)
+                break
+
+    if not reached and oldest - 1 > since: gaps.insert(0, [since, oldest - 1])
+    if cursor is not None:
+        cursor['gaps'] = gaps
+        if had_gaps and len(tweets) == 0: save_state(state) # _store only saves when there are tweets
+    _store(symbol, state, tweets)
+    return tweets
+
+def fetch_older(symbol: str, state: Dict[str, Any], budget: RateBudget = None) -> List[TweetData]:
+    """
+    Fetches the page of messages before the symbol's low-water mark
+    """
+    cursor = state['cursors'].get(symbol)
+    tweets = _request_page(symbol, max_id=cursor['max'] - 1 if cursor is not None else None, budget=budget)
+    _store(symbol, state, tweets)
+    return tweets
+
+
 def fetch_tweets(mode: str = 'all'):
-    api_prefix = 'https://api.stocktwits.com/api/2/streams/symbol'
-    rate_limit = 200 # can do 200 requests / hour
     state = get_state()
 
     for symbol in focus_symbols:
-        n_pages = (rate_limit // len(focus_symbols)) if mode == 'all' else 1
-        last_fetched_id = min(state['fetched'][symbol]) if symbol in state['fetched'] and len(state['fetched'][symbol]) > 0 else None
-        
-        for page in range(n_pages):
-            url = f'{api_prefix}/{symbol}.json?filter=all&limit=30'
-            if page > 0 and last_fetched_id is not None: url += f'&max={last_fetched_id}'
-
-            res = requests.get(url).json()
-            if 'response' not in res or res['response']['status'] != 200:
-                raise Exception(f'Invalid Twitter Response Body: ', res)
-
-            tweets = [TweetData(message) for message in res['messages']]
-            last_fetched_id = np.min([t.id for t in tweets])
-            tweets = [tweet for tweet in tweets if tweet.id not in state['fetched']]
-            
-            if len(tweets) == 0: continue
-            else: print(f'\ttwitter: page {page + 1} | {len(tweets)} tweets')
-            try: loop = asyncio.get_event_loop()
-            except: loop = asyncio.new_event_loop()
-            loop.run_until_complete(asyncio.wait([loop.run_in_executor(EXECUTOR, _process_tweet, t) for t in tweets]))
-            
-            if symbol not in state['fetched']: state['fetched'][symbol] = []
-            for t in tweets: state['fetched'][symbol].append(t.id)
-            save_state(state)
+        if mode != 'all':
+            fetch_newer(symbol, state)
+            continue
+
+        for _ in range(RATE_LIMIT // len(focus_symbols)):
+            if len(fetch_older(symbol, state)) == 0: break
+
+
+class PolledSymbol():
+    """
+    Polling history of one symbol, rate is an estimate of its recent messages / second
+    """
+    symbol: str
+    rate: float
+    polls: int
+    last_polled: float
+    newest_message: int
+
+    def __init__(self, symbol: str) -> None:
+        self.symbol = symbol
+        self.rate = MIN_RATE
+        self.polls = 0
+        self.last_polled = None
+        self.newest_message = None
+
+    def backlog(self, now: float) -> float:
+        """
+        Messages expected to have arrived since the last poll
+        """
+        if self.last_polled is None or now - self.last_polled >= MAX_STALENESS: return float('inf')
+        return max(self.rate, MIN_RATE) * (now - self.last_polled)
+
+    def observe(self, tweets: List[TweetData], now: float):
+        """
+        Updates the rate estimate from the messages that arrived since the previous poll
+        """
+        previous_poll = self.last_polled
+        self.polls += 1
+        self.last_polled = now
+        if len(tweets) > 0: self.newest_message = max([t.timestamp for t in tweets])
+
+        # Without a previous poll, or when the messages didn't all fit, the span of the returned (latest) messages gives the rate
+        if len(tweets) >= PAGE_SIZE or previous_poll is None:
+            if len(tweets) == 0: return
+            rate = len(tweets) / max(now - min([t.timestamp for t in tweets]), 1)
+        else: rate = len(tweets) / max(now - previous_poll, 1)
+        self.rate = rate if previous_poll is None else (1 - RATE_SMOOTHING) * self.rate + RATE_SMOOTHING * rate
+
+    def status(self, now: float) -> Dict[str, Any]:
+        return {
+            'polls': self.polls,
+            'messages_per_hour': round(self.rate * 3600, 2),
+            'since_poll': round(now - self.last_polled) if self.last_polled is not None else None,
+            'newest_message_age': round(now - self.newest_message) if self.newest_message is not None else None,
+        }
+
+
+class PollAllocator():
+    """
+    Spends the request budget evenly through the window, one poll per tick. Each tick goes to the
+    symbol with the most messages expected to be waiting (message rate * time since its last poll),
+    so busy symbols are polled more often without any extra requests.
+    """
+    def __init__(self, symbols: Iterable[str], budget: RateBudget = None) -> None:
+        self.budget = budget if budget is not None else RateBudget()
+        self.symbols: Dict[str, PolledSymbol] = { symbol: PolledSymbol(symbol) for symbol in symbols }
+        self.state = get_state()
+
+    def interval(self) -> float:
+        return self.budget.window / self.budget.limit
+
+    def poll_next(self):
+        now = time.time()
+        polled = max(self.symbols.values(), key=lambda s: s.backlog(now))
+        if not self.budget.acquire():
+            print('twitter | request budget spent, skipping poll')
+            return
+
+        try: tweets = fetch_newer(polled.symbol, self.state, self.budget)
+        except Exception as e:
+            print(f'twitter | error polling {polled.symbol}:', e)
+            tweets = []
+        polled.observe(tweets, now)
+
+    def freshness(self) -> Dict[str, Dict[str, Any]]:
+        now = time.time()
+        return { symbol: polled.status(now) for symbol, polled in self.symbols.items() }
+
+    def report(self):
+        print('twitter | freshness:', json.dumps(self.freshness()))
 
 
                 
@@ -79,24 +269,23 @@ def fetch_tweets(mode: str = 'all'):
 # Analysis
 def analyze():
     print('Starting Twitter Analysis')
-    try: fetch_tweets()
+    try:
+        with source_run('twitter'): fetch_tweets()
     except Exception as e: print('Twitter Analysis Error:', e)
     print('Twitter Analysis Complete')
 
 
 # Monitoring
-def monitor(frequency: int = 60):
+def monitor(frequency: int = 60, scheduler: Scheduler = None):
     """
-    Continually checks for recent tweets
+    Continually polls the focus symbols for recent tweets, spreading the hourly request budget
+    across them by activity. Per-symbol freshness is reported every [frequency] seconds.
+    Registers with the provided scheduler, or runs its own when called standalone.
     """
-    frequency = 3600
+    allocator = PollAllocator(focus_symbols)
 
-    # Kick off monitoring
-    starttime = time.time()
-    th = threading.Thread(target=fetch_tweets, args=['all'])
-    th.start()
-    while True:
-        if not th.is_alive():
-            time.sleep(frequency - ((time.time() - starttime) % frequency))
-            th = threading.Thread(target=fetch_tweets, args=['all'])
-            th.start()
+    standalone = scheduler is None
+    if standalone: scheduler = Scheduler()
+    scheduler.every(allocator.interval(), 'twitter', profiled('twitter', allocator.poll_next))
+    scheduler.every(frequency, 'twitter-freshness', allocator.report, run_now=False)
+    if standalone: scheduler.run()
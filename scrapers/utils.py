@@ -1,5 +1,6 @@
 from typing import List
-from config.symbols import blacklist, us, enhanced_symbols
+from config.models import Mention
+from scrapers.matching import company_matcher, ticker_tokenizer
 
 
 def find_all(p: str, s: str):
@@ -10,20 +11,23 @@ def find_all(p: str, s: str):
         i = s.find(p, i+1)
 
 
-def extract_tickers(text: str, use_companies: bool = False, use_tickers: bool = True) -> List[str]:
-    symbol_data = enhanced_symbols()
-    mentioned_symbols = []
-    if use_tickers: mentioned_symbols = [word for word in text.split() if word.isupper() and len(word) <= 5 and word not in blacklist and word in us]
+def extract_mentions(text: str, use_companies: bool = False, use_tickers: bool = True, source: str = None) -> List[Mention]:
+    """
+    Returns every ticker + company mention in the text along with its position, ordered by position
+    """
+    tokenizer = ticker_tokenizer()
+    mentions: List[Mention] = []
+    if use_tickers: mentions += tokenizer.find(text, source)
 
-    if use_companies:
-        mentioned_companies = [(sym, company) for sym, company in symbol_data.companies.items() if company in text]
-        for sym, company in mentioned_companies:
-            mentions = list(find_all(text, company))
-            if any([not text[m_start + len(company)].isalpha() for m_start in mentions]): mentioned_symbols.append(sym)
-            
-    return set(mentioned_symbols)
+    # Company names are matched in a single pass by the shared automaton
+    if use_companies: mentions += company_matcher().find(text, tokenizer.blacklist_for(source))
+
+    return sorted(mentions, key=lambda m: m.start)
+
+
+def extract_tickers(text: str, use_companies: bool = False, use_tickers: bool = True, source: str = None) -> List[str]:
+    return set([m.symbol for m in extract_mentions(text, use_companies, use_tickers, source)])
 
 
 def extract_market_segment(text: str) -> List[str]:
     return []
-
@@ -0,0 +1,91 @@
+from typing import Dict, List, NamedTuple, Optional
+import sqlite3, time, os
+
+
+QUEUE_PATH = os.environ.get('TS_BACKFILL_QUEUE', 'scrapers/fetched/backfill.db')
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+
+
+class WorkUnit(NamedTuple):
+    id: int
+    source: str
+    period: str
+    attempts: int
+
+
+class WorkQueue():
+    """
+    Durable (source, period) work units backed by sqlite. Workers claim a unit with a lease,
+    extend it with heartbeats while working and mark it done; a unit whose lease expires
+    (crashed or stalled worker) becomes claimable again. Each worker process opens its own
+    WorkQueue. Workers on other machines can share the file over a network mount that
+    supports sqlite's locking.
+    """
+    def __init__(self, path: str = QUEUE_PATH) -> None:
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS units (
+                id INTEGER PRIMARY KEY,
+                source TEXT NOT NULL,
+                period TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                UNIQUE(source, period)
+            )
+        ''')
+
+    def enqueue(self, source: str, periods: List[str]) -> int:
+        """
+        Adds units for the given periods, already known units are left untouched. Returns # added.
+        """
+        before = self.db.total_changes
+        self.db.execute('BEGIN IMMEDIATE')
+        self.db.executemany('INSERT OR IGNORE INTO units (source, period) VALUES (?, ?)', [(source, period) for period in periods])
+        self.db.execute('COMMIT')
+        return self.db.total_changes - before
+
+    def claim(self, owner: str, lease_seconds: float = LEASE_SECONDS) -> Optional[WorkUnit]:
+        now = time.time()
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.db.execute(
+                "SELECT id, source, period, attempts FROM units "
+                "WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?) ORDER BY id LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None: return None
+
+            self.db.execute("UPDATE units SET status = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?", (owner, now + lease_seconds, row[0]))
+            return WorkUnit(row[0], row[1], row[2], row[3] + 1)
+        finally: self.db.execute('COMMIT')
+
+    def heartbeat(self, unit: WorkUnit, owner: str, lease_seconds: float = LEASE_SECONDS) -> bool:
+        """
+        Extends the lease, returns False if the unit has since been claimed by another worker
+        """
+        cursor = self.db.execute(
+            "UPDATE units SET lease_expires = ? WHERE id = ? AND owner = ? AND status = 'leased'",
+            (time.time() + lease_seconds, unit.id, owner)
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, unit: WorkUnit, owner: str):
+        self.db.execute("UPDATE units SET status = 'done', lease_expires = NULL, error = NULL WHERE id = ? AND owner = ?", (unit.id, owner))
+
+    def fail(self, unit: WorkUnit, owner: str, error: str, max_attempts: int = MAX_ATTEMPTS):
+        status = 'failed' if unit.attempts >= max_attempts else 'pending'
+        self.db.execute("UPDATE units SET status = ?, lease_expires = NULL, error = ? WHERE id = ? AND owner = ?", (status, error, unit.id, owner))
+
+    def counts(self) -> Dict[str, int]:
+        return { status: n for status, n in self.db.execute('SELECT status, COUNT(*) FROM units GROUP BY status') }
+
+    def active(self) -> bool:
+        """
+        Whether any unit is still pending or leased
+        """
+        return self.db.execute("SELECT 1 FROM units WHERE status IN ('pending', 'leased') LIMIT 1").fetchone() is not None
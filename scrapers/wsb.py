@@ -1,15 +1,33 @@
-import praw, time, pandas as pd, json, threading
+import praw, time, pandas as pd, json, threading, queue, multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from nltk.sentiment.vader import SentimentIntensityAnalyzer
-from praw.models import Submission
-from typing import Dict, List, Tuple
-from timeit import default_timer as timer
+from praw.models import Submission, Comment, Subreddit
+from typing import Dict, List, Set, Tuple
 from dotenv import load_dotenv, dotenv_values
 
-from config.symbols import us, blacklist
+from scrapers.matching import ticker_tokenizer
+from scrapers.cache import polarity
+from scrapers.scheduler import Scheduler
+from instrumentation.metrics import metrics
+from instrumentation.profiling import source_run
 from config.models import Analysis, SentimentContext
 from data.es import add_analyses
 
 
+STREAM_BUFFER = 2000        # comments held between the stream reader and the scorer
+STREAM_BATCH = 100          # comments scored and stored together
+STREAM_FLUSH_SECONDS = 5    # longest a buffered comment waits for its batch to fill
+STREAM_RETRY_SECONDS = 10   # wait between attempts to store a streamed batch
+EXPAND_WORKERS = 3          # submissions whose comment forests are expanded concurrently
+SCORE_WORKERS = 4           # scoring processes
+SCORE_BATCH = 500           # comments per scoring task
+
+
+def load_state() -> Dict[str, List[str]]:
+    with open('scrapers/fetched/wsb.json', 'r') as f:
+        try: return json.loads(f.read())['fetched_posts']
+        except: return {}
+
 def save_state(state: Dict):
     with open('scrapers/fetched/wsb.json', 'w') as f:
         data = {'fetched_posts': state }
@@ -58,39 +76,85 @@ def extract_posts(subreddits: str = 'wallstreetbets', max_post_count: int = 10)
     return submissions, wsb_state
 
 
-def extract_significant_comments(state: Dict[str, List[str]], submissions: List[Submission], comment_limit: int = 10000, min_upvotes: int = 2, sort: str = 'new'):
+_local = threading.local()
+
+def _thread_reddit() -> praw.Reddit:
+    """
+    praw instances aren't thread safe, each expansion thread gets its own. They share the client's
+    rate limit, which praw paces against using the remaining budget reported with every response.
+    """
+    if not hasattr(_local, 'reddit'):
+        client_id, client_secret = fetch_creds()
+        _local.reddit = praw.Reddit(user_agent='Comment Extraction', client_id=client_id, client_secret=client_secret)
+    return _local.reddit
+
+def _expand_comments(submission_id: str, comment_limit: int, sort: str) -> List[Tuple[str, str, float, int]]:
+    """
+    Loads a submission's top level comments as (id, body, created, score)
+    """
+    submission = _thread_reddit().submission(id=submission_id)
+    submission.comment_sort = sort
+    submission.comments.replace_more(limit=min(comment_limit, submission.num_comments))
+    return [(c.id, c.body, c.created_utc, c.score) for c in submission.comments if hasattr(c, 'body')]
+
+_vader: SentimentIntensityAnalyzer = None
+
+def _score_comments(comments: List[Tuple[str, str, float]]) -> List[SentimentContext]:
+    """
+    Runs in the scoring processes
+    """
+    global _vader
+    if _vader is None: _vader = SentimentIntensityAnalyzer()
+
+    contexts: List[SentimentContext] = []
+    for _, body, created in comments:
+        mentioned_symbols = [m.symbol for m in ticker_tokenizer().find(body, 'wsb')]
+        if len(mentioned_symbols) == 0: continue
+        rating = polarity(_vader, body)
+        contexts += [SentimentContext(symbol, 'wsb', created, rating) for symbol in mentioned_symbols]
+    return contexts
+
+
+def _scorer_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Forked scoring processes, started before the caller runs any expansion thread: forking while
+    those threads make requests could copy locks they hold (urllib3's, logging's) into the children.
+    A forkserver or spawn start would instead re-run main.py, which has no __main__ guard.
+    """
+    # Forked workers inherit the loaded symbol data instead of rebuilding it
+    ticker_tokenizer()
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+    pool.submit(int).result() # a fork context pool starts every worker with its first task
+    return pool
+
+
+def extract_significant_comments(state: Dict[str, List[str]], submissions: List[Submission], comment_limit: int = 10000, min_upvotes: int = 2, sort: str = 'new',
+                                 expand_workers: int = EXPAND_WORKERS, score_workers: int = SCORE_WORKERS):
+    """
+    Expands up to [expand_workers] submissions' comments at once, the API quota being the limit
+    there, while comments of already expanded submissions are scored in a process pool
+    """
     post_flairs = ['Daily Discussion', 'Weekend Discussion', 'Discussion']
-    vader = SentimentIntensityAnalyzer()
-
-    post_details = {}
-    for i, submission in enumerate(submissions):
-        print(f'\twsb | analyzing submission {i+1}/{len(submissions)}: {submission.title}')
-        try:
-            analysis = Analysis()
-            if submission.link_flair_text in post_flairs:
-                post_details[submission.id] = []
-                submission.comment_sort = sort # 'new'
-                comments = submission.comments
+    submissions = [s for s in submissions if s.link_flair_text in post_flairs]
+
+    with _scorer_pool(score_workers) as scorers, ThreadPoolExecutor(max_workers=expand_workers) as expanders:
+        expansions = { expanders.submit(_expand_comments, s.id, comment_limit, sort): s for s in submissions }
+        for i, future in enumerate(as_completed(expansions)):
+            submission = expansions[future]
+            print(f'\twsb | analyzing submission {i+1}/{len(submissions)}: {submission.title}')
+            try:
                 prev_comments = set(state[submission.id])
-                
-                submission.comments.replace_more(limit=min(comment_limit, submission.num_comments))
-                check_comments = [c for c in comments if c.score >= min_upvotes and c.id not in prev_comments]
+                check_comments = [(id, body, created) for id, body, created, score in future.result() if score >= min_upvotes and id not in prev_comments]
                 print(f'\tchecking {len(check_comments)} comments | sorted by {sort} | >= {min_upvotes} upvotes')
-                for comment in check_comments:
-                    if comment.id in prev_comments: continue
-                    else: state[submission.id].append(comment.id)
-                    comment_words = comment.body.split(" ")
-                    sanitized_words = [w.replace('$', '') for w in comment_words]
-                    mentioned_symbols = [word for word in sanitized_words if word.isupper() and len(word) <= 5 and word not in blacklist and word in us]
-                    if len(mentioned_symbols) > 0:
-                        polarity = vader.polarity_scores(comment.body)
-                        for symbol in mentioned_symbols:
-                            analysis.data.append(SentimentContext(symbol, 'wsb', comment.created_utc, polarity['compound']))
 
-            add_analyses([analysis])
-            save_state(state)
+                analysis = Analysis()
+                batches = [check_comments[j:j + SCORE_BATCH] for j in range(0, len(check_comments), SCORE_BATCH)]
+                for contexts in scorers.map(_score_comments, batches): analysis.data += contexts
 
-        except: continue
+                state[submission.id] += [id for id, _, _ in check_comments]
+                if len(analysis.data) > 0: add_analyses([analysis], bulk=True)
+                save_state(state)
+            except Exception as e: print(f'\twsb | error analyzing {submission.title}:', e)
 
 
 
@@ -98,54 +162,152 @@ def analyze():
     print('Starting WSB Comment Analysis')
     submissions, state = extract_posts(max_post_count=5)
     print(f'\tBeginning comment analysis of {len(submissions)} posts')
-    extract_significant_comments(state, submissions, comment_limit=15000)
+    with source_run('wsb'): extract_significant_comments(state, submissions, comment_limit=15000)
     print('WSB Comment Analysis Complete')
 
 
 
 
 # Monitoring
-def check_latest_thread(subreddit):
-    print('wsb | Checking Latest Thread')
+def active_threads(subreddit: Subreddit) -> Dict[str, str]:
+    """
+    Returns id -> title of the current daily discussion / moves threads
+    """
+    submissions = subreddit.search(query='subreddit:wallstreetbets flair:Daily Discussion', sort='new', time_filter='day')
+    return { s.id: s.title for s in submissions if ('Daily Discussion Thread' in s.title or 'What Are Your Moves Tomorrow' in s.title) and 'Unpinned' not in s.title }
 
-    start = timer()
-    with open('scrapers/fetched/wsb.json', 'r') as f:
-        try: state = json.loads(f.read())['fetched_posts']
-        except: state = {}
 
-    submissions = list(subreddit.search(
-        query='subreddit:wallstreetbets title:daily discussion',
-        sort='new',
-        time_filter = 'day', # Can be one of: all, day, hour, month, week, year (
-    ))
-    submissions = [s for s in submissions if 'Daily Discussion Thread' in s.title and 'Unpinned' not in s.title]
-    if len(submissions) == 0:
-        print('wsb | No matching threads')
-        return
+class CommentStream():
+    """
+    Live comment ingestion: a reader thread follows the subreddit's comment stream, keeping comments on
+    the active discussion threads in a bounded buffer (a full buffer blocks the reader rather than
+    dropping comments) and a scorer thread stores them in batches as they arrive. Fresh comments
+    haven't been voted on, so unlike the historical path there's no upvote filter. The active threads
+    are looked up on a thread of the stream's own, at start and on every refresh() request.
+    """
+    def __init__(self, subreddit: Subreddit, buffer_size: int = STREAM_BUFFER, batch_size: int = STREAM_BATCH, flush_seconds: float = STREAM_FLUSH_SECONDS) -> None:
+        self.subreddit = subreddit
+        self.buffer: queue.Queue = queue.Queue(maxsize=buffer_size)
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.threads: Set[str] = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.refreshing = threading.Event()   # set to re-check the active threads
+        self.following = threading.Event()    # set once the active threads are first known
+
+        # Owned by the scorer thread
+        self.state = load_state()
+        self.seen: Dict[str, Set[str]] = { submission_id: set(ids) for submission_id, ids in self.state.items() }
+
+    def refresh_threads(self):
+        threads = active_threads(self.subreddit)
+        with self.lock: self.threads = set(threads)
+        self.following.set()
+        print(f'wsb | following {len(threads)} threads: {", ".join(threads.values())}')
+
+    def refresh(self):
+        """
+        Asks the stream to re-check the active threads, without waiting on the search
+        """
+        self.refreshing.set()
 
-    submission = submissions[0]
-    if submission.id not in state: state[submission.id] = []
-    extract_significant_comments(state, [submission], 500)
-    print(f'WSB Refresh Complete | took {(timer() - start):.2f} seconds\n')
+    def start(self):
+        threading.Thread(target=self._follow, name='wsb-threads', daemon=True).start()
+        threading.Thread(target=self._read, name='wsb-stream', daemon=True).start()
+        threading.Thread(target=self._score, name='wsb-score', daemon=True).start()
 
-    
+    def stop(self):
+        self.stopped.set()
+        self.refreshing.set()
 
-def monitor(frequency: int = 60):
+    def _follow(self):
+        while not self.stopped.is_set():
+            try: self.refresh_threads()
+            except Exception as e: print('wsb | error refreshing threads:', e)
+            self.refreshing.wait()
+            self.refreshing.clear()
+
+    def _read(self):
+        # Until the first lookup every comment would be dropped as off thread
+        self.following.wait()
+        while not self.stopped.is_set():
+            try:
+                # The first ~100 comments replay recent history, already stored ones are dropped by the scorer
+                for comment in self.subreddit.stream.comments():
+                    if self.stopped.is_set(): return
+                    with self.lock: active = comment.link_id[3:] in self.threads
+                    if active: self.buffer.put(comment)
+            except Exception as e:
+                print('wsb | comment stream error, reconnecting:', e)
+                time.sleep(10)
+
+    def _next_batch(self) -> List[Comment]:
+        batch: List[Comment] = []
+        deadline = time.time() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            try: batch.append(self.buffer.get(timeout=max(deadline - time.time(), 0)))
+            except queue.Empty: break
+        return batch
+
+    def _score(self):
+        vader = SentimentIntensityAnalyzer()
+        while not self.stopped.is_set():
+            batch = self._next_batch()
+            if len(batch) == 0: continue
+            metrics().count('stream_comments_total', 'wsb', len(batch))
+            with source_run('wsb'): stored = self._store(batch, vader)
+            if not stored: return
+
+    def _store(self, batch: List[Comment], vader: SentimentIntensityAnalyzer) -> bool:
+        """
+        Scores + stores a batch, returns False when stopped before it could be stored
+        """
+        # Comments are only recorded as seen once stored, a failed write is retried until it goes through
+        # (a full buffer meanwhile holds up the reader) instead of dropping the batch
+        fresh = list({ comment.id: comment for comment in batch if comment.id not in self.seen.get(comment.link_id[3:], set()) }.values())
+
+        analysis = Analysis()
+        for comment in fresh:
+            mentioned_symbols = [m.symbol for m in ticker_tokenizer().find(comment.body, 'wsb')]
+            if len(mentioned_symbols) == 0: continue
+            rating = polarity(vader, comment.body)
+            for symbol in mentioned_symbols: analysis.data.append(SentimentContext(symbol, 'wsb', comment.created_utc, rating))
+
+        stored = len(analysis.data) == 0
+        while not stored and not self.stopped.is_set():
+            try:
+                add_analyses([analysis], bulk=True)
+                stored = True
+            except Exception as e:
+                print(f'wsb | error storing streamed comments, retrying in {STREAM_RETRY_SECONDS}s:', e)
+                self.stopped.wait(STREAM_RETRY_SECONDS)
+        if not stored: return False
+
+        for comment in fresh:
+            submission_id = comment.link_id[3:]
+            self.seen.setdefault(submission_id, set()).add(comment.id)
+            self.state.setdefault(submission_id, []).append(comment.id)
+        try: save_state(self.state)
+        except Exception as e: print('wsb | error saving stream state:', e)
+        print(f'wsb | stored {len(analysis.data)} mentions from {len(batch)} streamed comments | {self.buffer.qsize()} buffered')
+        return True
+
+
+def monitor(frequency: int = 60, scheduler: Scheduler = None):
     """
-    Continually checks the latest daily discussion post for more comments
+    Streams comments from the active daily discussion / moves threads as they're posted.
+    The set of active threads is re-checked every [frequency] seconds, requested through the
+    provided scheduler (or its own when called standalone) and run on the stream's thread.
     """
 
     # Set up praw instance
     client_id, client_secret = fetch_creds()
     reddit = praw.Reddit(user_agent='Comment Extraction', client_id=client_id, client_secret=client_secret)
-    subreddit = reddit.subreddit('wallstreetbets')
-
-    # Kick off monitoring
-    starttime = time.time()
-    th = threading.Thread(target=check_latest_thread, args=[subreddit])
-    th.start()
-    while True:
-        if not th.is_alive():
-            time.sleep(frequency - ((time.time() - starttime) % frequency))
-            th = threading.Thread(target=check_latest_thread, args=[subreddit])
-            th.start()
+    stream = CommentStream(reddit.subreddit('wallstreetbets'))
+    stream.start()
+
+    standalone = scheduler is None
+    if standalone: scheduler = Scheduler()
+    scheduler.every(frequency, 'wsb', stream.refresh, run_now=False)
+    if standalone: scheduler.run()
@@ -0,0 +1,71 @@
+from typing import Any, Dict, List
+from types import SimpleNamespace
+from unittest.mock import patch
+import time, unittest
+
+from config.models import HN_Item, HN_Post
+from scrapers import hackernews
+
+
+class FakeApi():
+    """
+    Serves the newstories + updates feeds and items from memory
+    """
+    def __init__(self, items: List[HN_Item], new: List[int], updates: List[int] = []) -> None:
+        self.items = { item.id: item for item in items }
+        self.new = new
+        self.updates = updates
+        self.requested: List[int] = []
+
+    def get(self, url: str):
+        return SimpleNamespace(json=lambda: self.new if url == hackernews.new_stories_url else { 'items': self.updates })
+
+    def fetch_items(self, ids):
+        for id in ids:
+            self.requested.append(id)
+            yield id, self.items.get(id)
+
+
+class RefreshLiveTest(unittest.TestCase):
+    def refresh(self, api: FakeApi, state: Dict[str, Any]) -> List[Dict[str, Any]]:
+        saved = []
+        with patch('scrapers.hackernews.get_state', lambda: state), patch('scrapers.hackernews.save_state', lambda s: saved.append(s)), \
+             patch('scrapers.hackernews.requests', api), patch('scrapers.hackernews.fetch_items', api.fetch_items), \
+             patch('scrapers.hackernews.story_companies', lambda story: ['AAPL'] if 'Apple' in story.title else []), \
+             patch('scrapers.hackernews.polarity', lambda vader, text: 0.5), patch('scrapers.hackernews.add_analyses', lambda analyses, bulk=False: None), \
+             patch('scrapers.hackernews.SentimentIntensityAnalyzer', object):
+            hackernews.refresh_live()
+        return saved
+
+    def test_seen_stories_are_limited_to_the_live_window(self):
+        now = int(time.time())
+        stories = [HN_Item(i, time=now - 60, title='Apple earnings' if i == 3 else 'Show HN', type='story') for i in range(1, 6)]
+        state = { 'fetched': {}, 'live': {}, 'seen': { 99: now - hackernews.LIVE_WINDOW - 60 } }
+        saved = self.refresh(FakeApi(stories, [5, 4, 3, 2, 1]), state)
+
+        self.assertEqual(len(saved), 1)
+        self.assertEqual(sorted(state['seen']), [1, 2, 3, 4, 5])
+        self.assertEqual(list(state['live']), [3])
+        self.assertEqual(state['fetched'], {})
+
+        # Seen stories aren't requested again
+        api = FakeApi(stories, [6, 5, 4, 3, 2, 1])
+        self.refresh(api, state)
+        self.assertEqual(api.requested, [6])
+
+
+class AnalyzePostsTest(unittest.TestCase):
+    def test_state_saved_once(self):
+        state = { 'fetched': {}, 'live': {}, 'seen': {}, 'last_analyzed_post_id': -1 }
+        saved = []
+        posts = [HN_Post(HN_Item(i, title='Show HN', type='story'), []) for i in range(3, 0, -1)]
+        with patch('scrapers.hackernews.get_state', lambda: state), patch('scrapers.hackernews.save_state', lambda s: saved.append(dict(s['fetched']))), \
+             patch('scrapers.hackernews.score_post', lambda vader, post: SimpleNamespace(data=[])), \
+             patch('scrapers.hackernews.SentimentIntensityAnalyzer', object):
+            hackernews.analyze_posts(iter(posts))
+        self.assertEqual(saved, [{ 3: [], 2: [], 1: [] }])
+        self.assertEqual(state['last_analyzed_post_id'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
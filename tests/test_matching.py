@@ -0,0 +1,40 @@
+import unittest
+
+from bs4 import BeautifulSoup
+
+from config.models import SymbolData
+from config.symbols import blacklist, extended_blacklist
+from scrapers.matching import TickerTokenizer, source_blacklists
+
+
+class TickerTokenizerTest(unittest.TestCase):
+    def setUp(self):
+        data = SymbolData()
+        data.blacklist, data.extended_blacklist = frozenset(blacklist), frozenset(extended_blacklist)
+        self.tokenizer = TickerTokenizer(['AAPL', 'TSLA', 'THE', 'GME'], source_blacklists(data), data.blacklist)
+
+    def symbols(self, mentions) -> list:
+        return [m.symbol for m in mentions]
+
+    def test_ap_exchange_mentions_need_parentheses(self):
+        text = 'Apple (NASDAQ: AAPL) and Tesla (Nasdaq:TSLA) rose, Berkshire ( NYSE : BRK.B ) fell. NYSE: IBM was flat.'
+        self.assertEqual(self.symbols(self.tokenizer.find(text, 'ap', kinds=('exchange',))), ['AAPL', 'TSLA', 'BRK.B'])
+
+    def test_ap_prose_isnt_an_exchange_mention(self):
+        for text in ['Nasdaq: the index rose', '(Nasdaq: the index rose)', '(NYSE: Apple) rose', '(NASDAQ: AAPLXY)']:
+            self.assertEqual(self.tokenizer.find(text, 'ap', kinds=('exchange',)), [], text)
+
+    def test_motley_fool_tags_of_any_exchange(self):
+        html = '''<div class="ticker"><a>NASDAQ:AAPL</a></div><div class="ticker"><a>NYSEMKT:
+            SENS</a></div><div class="ticker"><a>OTC:TCEHY</a></div><div class="ticker"><a>NASDAQOTH:ADRNY</a></div>
+            <div class="ticker"><a>NYSE:BRK.B</a></div>'''
+        ticker_text = ' '.join([ticker.text for ticker in BeautifulSoup(html, 'html.parser').select('.ticker a')])
+        self.assertEqual(self.symbols(self.tokenizer.find_tags(ticker_text, 'themotleyfool')), ['AAPL', 'SENS', 'TCEHY', 'ADRNY', 'BRK.B'])
+
+    def test_cashtags_and_tickers(self):
+        text = 'Bought $gme and TSLA, THE AAPL-like run'
+        self.assertEqual(self.symbols(self.tokenizer.find(text, 'wsb')), ['GME', 'TSLA'])
+
+
+if __name__ == '__main__':
+    unittest.main()
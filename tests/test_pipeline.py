@@ -0,0 +1,100 @@
+from typing import List
+from unittest.mock import patch
+import threading, unittest
+
+from config.models import Analysis, PipelineArticle
+from scrapers.pipeline import Pipeline, Source
+
+
+def discover(n: int):
+    return lambda mode, seen: (PipelineArticle('test', f'https://example.com/{i}', f'id{i}', 1600000000) for i in range(n))
+
+def extract(article: PipelineArticle, soup) -> bool:
+    article.text = 'AAPL rallied.'
+    article.symbols = { 'AAPL' }
+    return True
+
+
+class FlakySink():
+    """
+    Stands in for add_analyses, failing every [fail_every]th write
+    """
+    def __init__(self, fail_every: int) -> None:
+        self.fail_every = fail_every
+        self.calls = 0
+        self.written: List[Analysis] = []
+        self.lock = threading.Lock()
+
+    def __call__(self, analyses: List[Analysis], bulk: bool = False):
+        with self.lock:
+            self.calls += 1
+            if self.calls % self.fail_every == 0: raise Exception('es unavailable')
+            self.written += analyses
+
+
+class PipelineWriteTest(unittest.TestCase):
+    def run_pipeline(self, sink: FlakySink, articles: int, queue_size: int = 4) -> dict:
+        state = {}
+        source = Source('test', extract, discover=discover(articles), fetch=lambda article: '<p>AAPL rallied.</p>')
+        pipeline = Pipeline(source, state, lambda state: None, queue_size=queue_size, write_batch=5)
+        with patch('scrapers.pipeline.add_analyses', sink), patch('scrapers.pipeline.SentimentIntensityAnalyzer', object), \
+             patch('scrapers.pipeline.rate_symbols', lambda vader, text, symbols, mentions, source: { symbol: 0.5 for symbol in symbols }):
+            # Run in a thread so a stuck pipeline fails the test instead of hanging it
+            th = threading.Thread(target=pipeline.run, daemon=True)
+            th.start()
+            th.join(30)
+        self.assertFalse(th.is_alive(), 'pipeline never finished')
+        return state, pipeline.counts
+
+    def test_write_errors_dont_stall_the_pipeline(self):
+        # Far more articles than the queues hold, so a dead writer would block every stage
+        sink = FlakySink(fail_every=3)
+        state, counts = self.run_pipeline(sink, 200)
+        written = sum([len(analysis.data) for analysis in sink.written])
+        self.assertGreater(counts['write_errors'], 0)
+        self.assertEqual(counts['written'], written)
+        self.assertEqual(len(state['fetched']), written)
+        self.assertEqual(written + counts['write_errors'] * 5, 200)
+
+    def test_failed_batches_arent_marked_fetched(self):
+        sink = FlakySink(fail_every=1)
+        state, counts = self.run_pipeline(sink, 20)
+        self.assertEqual(state['fetched'], [])
+        self.assertEqual(counts['write_errors'], 4)
+
+
+class PipelinePeriodTest(unittest.TestCase):
+    def test_periods_with_failures_stay_incomplete(self):
+        def discover_period(period: str, seen):
+            return (PipelineArticle('test', f'https://example.com/{period}/{i}', f'{period}-{i}', 1600000000) for i in range(10))
+        def fetch(article: PipelineArticle) -> str:
+            if article.id == 'broken-3': raise Exception('503')
+            return '<p>AAPL rallied.</p>'
+
+        state = {}
+        source = Source('test', extract, periods=lambda mode: ['good', 'broken'], discover_period=discover_period, fetch=fetch, period_end=lambda period: 0)
+        with patch('scrapers.pipeline.add_analyses', FlakySink(fail_every=10 ** 6)), patch('scrapers.pipeline.SentimentIntensityAnalyzer', object), \
+             patch('scrapers.pipeline.rate_symbols', lambda vader, text, symbols, mentions, source: { symbol: 0.5 for symbol in symbols }):
+            Pipeline(source, state, lambda state: None, write_batch=4).run()
+        self.assertEqual(state['completed_periods'], ['good'])
+        self.assertNotIn('broken-3', state['fetched'])
+        self.assertEqual(len(state['fetched']), 19)
+
+    def test_parse_errors_arent_retried(self):
+        def discover_period(period: str, seen):
+            return (PipelineArticle('test', f'https://example.com/{period}/{i}', f'{period}-{i}', 1600000000) for i in range(10))
+        def broken_extract(article: PipelineArticle, soup) -> bool:
+            if article.id == 'day-3': raise AttributeError("'NoneType' object has no attribute 'text'")
+            return extract(article, soup)
+
+        state = {}
+        source = Source('test', broken_extract, periods=lambda mode: ['day'], discover_period=discover_period, fetch=lambda article: '<p>AAPL rallied.</p>', period_end=lambda period: 0)
+        with patch('scrapers.pipeline.add_analyses', FlakySink(fail_every=10 ** 6)), patch('scrapers.pipeline.SentimentIntensityAnalyzer', object), \
+             patch('scrapers.pipeline.rate_symbols', lambda vader, text, symbols, mentions, source: { symbol: 0.5 for symbol in symbols }):
+            Pipeline(source, state, lambda state: None, write_batch=4).run()
+        self.assertEqual(state['completed_periods'], ['day'])
+        self.assertIn('day-3', state['fetched'])
+        self.assertEqual(len(state['fetched']), 10)
+
+
+if __name__ == '__main__': unittest.main()
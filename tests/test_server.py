@@ -0,0 +1,30 @@
+from unittest.mock import patch
+import unittest
+
+from data.server import aggregates
+
+
+class FakeClient():
+    def __init__(self, buckets):
+        self.buckets = buckets
+
+    def search(self, body, index):
+        # Like elasticsearch, the hit total stops counting at 10000
+        total = sum([bucket['doc_count'] for bucket in self.buckets])
+        return {
+            'hits': { 'total': { 'value': min(total, 10000), 'relation': 'gte' if total > 10000 else 'eq' } },
+            'aggregations': { 'periods': { 'buckets': self.buckets } },
+        }
+
+
+class AggregatesTest(unittest.TestCase):
+    def test_count_past_track_total_limit(self):
+        buckets = [{ 'key': i * 3600 * 1000, 'doc_count': 4000, 'rating': { 'value': 0.1 } } for i in range(5)]
+        with patch('data.server.client', return_value=FakeClient(buckets)):
+            res = aggregates('TSLA', 0, 5 * 3600, ['reddit'])
+        self.assertEqual(res['count'], 20000)
+        self.assertEqual([period['timestamp'] for period in res['periods']], [i * 3600 for i in range(5)])
+
+
+if __name__ == '__main__':
+    unittest.main()
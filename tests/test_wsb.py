@@ -0,0 +1,144 @@
+from typing import List, NamedTuple
+from types import SimpleNamespace
+from unittest.mock import patch
+import threading, time, unittest
+
+from config.models import Analysis
+from scrapers.wsb import CommentStream
+
+
+class FakeComment(NamedTuple):
+    id: str
+    link_id: str
+    body: str
+    created_utc: float
+
+
+class FakeSubreddit():
+    """
+    Serves a fixed comment stream, recording how far the reader has pulled it
+    """
+    def __init__(self, comments: List[FakeComment]) -> None:
+        self.comments = comments
+        self.pulled = 0
+        self.stream = SimpleNamespace(comments=self._comments)
+
+    def _comments(self):
+        for comment in self.comments:
+            self.pulled += 1
+            yield comment
+        # Like praw's stream, block rather than end once caught up
+        while True: time.sleep(60)
+
+
+class FakeTokenizer():
+    def find(self, text: str, source: str):
+        return [SimpleNamespace(symbol=word[1:]) for word in text.split() if word.startswith('$')]
+
+
+class GatedSink():
+    """
+    Stands in for add_analyses, holding every write until opened
+    """
+    def __init__(self) -> None:
+        self.open = threading.Event()
+        self.batches: List[Analysis] = []
+
+    def __call__(self, analyses: List[Analysis], bulk: bool = False):
+        self.open.wait()
+        self.batches += analyses
+
+
+def comments(n: int, thread: str = 'abc', offset: int = 0) -> List[FakeComment]:
+    return [FakeComment(f'c{offset + i}', f't3_{thread}', f'buying ${"GME" if i % 2 == 0 else "AMC"}', 1600000000 + i) for i in range(n)]
+
+
+class CommentStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.sink = GatedSink()
+        self.saved = []
+        patches = [
+            patch('scrapers.wsb.load_state', lambda: {}),
+            patch('scrapers.wsb.save_state', lambda state: self.saved.append(sum([len(ids) for ids in state.values()]))),
+            patch('scrapers.wsb.active_threads', lambda subreddit: { 'abc': 'Daily Discussion Thread' }),
+            patch('scrapers.wsb.add_analyses', self.sink),
+            patch('scrapers.wsb.ticker_tokenizer', FakeTokenizer),
+            patch('scrapers.wsb.polarity', lambda vader, text: 0.5),
+            patch('scrapers.wsb.SentimentIntensityAnalyzer', object),
+        ]
+        for p in patches: p.start()
+        for p in patches: self.addCleanup(p.stop)
+
+    def wait_for(self, condition, timeout: float = 10):
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() > deadline: self.fail('timed out')
+            time.sleep(0.01)
+
+    def test_full_buffer_blocks_the_reader(self):
+        subreddit = FakeSubreddit(comments(50))
+        stream = CommentStream(subreddit, buffer_size=5, batch_size=10, flush_seconds=0.1)
+        self.addCleanup(stream.stop)
+        stream.start()
+
+        # The scorer is stuck on its first write, so the reader can't get further than one batch + a full buffer
+        self.wait_for(lambda: stream.buffer.full())
+        time.sleep(0.2)
+        self.assertLessEqual(subreddit.pulled, 10 + 5 + 1)
+
+        self.sink.open.set()
+        self.wait_for(lambda: sum([len(a.data) for a in self.sink.batches]) == 50)
+        self.assertEqual(sorted(set([c.symbol for a in self.sink.batches for c in a.data])), ['AMC', 'GME'])
+        self.assertEqual(self.saved[-1], 50)
+
+    def test_partial_batch_flushes_after_timeout(self):
+        self.sink.open.set()
+        # Comments on other threads never reach the buffer
+        subreddit = FakeSubreddit(comments(3) + comments(4, thread='other', offset=3))
+        stream = CommentStream(subreddit, batch_size=100, flush_seconds=0.2)
+        self.addCleanup(stream.stop)
+        start = time.time()
+        stream.start()
+
+        self.wait_for(lambda: len(self.sink.batches) == 1)
+        self.assertGreaterEqual(time.time() - start, 0.2)
+        self.assertEqual(len(self.sink.batches[0].data), 3)
+        self.assertEqual(stream.state, { 'abc': ['c0', 'c1', 'c2'] })
+
+    def test_failed_writes_are_retried_before_marking_seen(self):
+        self.sink.open.set()
+        attempts = []
+        def failing_once(analyses: List[Analysis], bulk: bool = False):
+            attempts.append(len(self.saved))
+            if len(attempts) == 1: raise Exception('es unavailable')
+            self.sink(analyses, bulk)
+
+        with patch('scrapers.wsb.add_analyses', failing_once), patch('scrapers.wsb.STREAM_RETRY_SECONDS', 0.05):
+            stream = CommentStream(FakeSubreddit(comments(3)), batch_size=3)
+            self.addCleanup(stream.stop)
+            stream.start()
+            self.wait_for(lambda: len(self.saved) == 1)
+        # Nothing was saved as seen before the write went through
+        self.assertEqual(attempts, [0, 0])
+        self.assertEqual(self.saved, [3])
+        self.assertEqual(len(self.sink.batches[0].data), 3)
+
+    def test_refresh_runs_on_the_stream_thread(self):
+        self.sink.open.set()
+        callers = []
+        def active_threads(subreddit):
+            callers.append(threading.current_thread().name)
+            return { 'abc': 'Daily Discussion Thread' }
+
+        with patch('scrapers.wsb.active_threads', active_threads):
+            stream = CommentStream(FakeSubreddit([]))
+            self.addCleanup(stream.stop)
+            stream.start()
+            self.wait_for(lambda: len(callers) == 1)
+            stream.refresh()
+            self.wait_for(lambda: len(callers) == 2)
+        self.assertEqual(callers, ['wsb-threads', 'wsb-threads'])
+
+
+if __name__ == '__main__':
+    unittest.main()